@@ -1,21 +1,13 @@
-import re
-from collections import defaultdict
 import pandas as pd
 
+import perf_data
+from perf_parse import parse_events
+from vma_map import VmaMap
+
 PAGE_SIZE = 4096    # 4KB
 NUM_PAGES = 1000    # Num pages in workload
-
-page_stats = defaultdict(lambda: {
-    "page_faults": 0,
-    "tlb_load_misses": 0,
-    "tlb_store_misses": 0,
-    "cache_misses": 0,
-    "cache_references": 0,
-    "context_switches": 0,
-    "instructions": 0,
-    "branches": 0,
-    "branch_misses": 0,
-})
+PERF_FILE = 'perf_output.txt'   # Or perf.data, read without the perf script step
+MAPS_FILE = None    # Saved /proc/<pid>/maps, rows become the sampled pages of its VMAs
 
 global_stats = {
     "context_switches": 0,
@@ -24,53 +16,25 @@ global_stats = {
     "branch_misses": 0,    
 }
 
-address_pattern = re.compile(r":\s+\d+\s+\S+:\s+([0-9a-fA-F]+)")
+# Read perf output file (derived from perf.data), split into byte ranges
+# that perf_parse.py parses in parallel, or decode perf.data itself
+vmas = VmaMap.from_proc_maps(MAPS_FILE, PAGE_SIZE) if MAPS_FILE else None
+if PERF_FILE.endswith('.data'):
+    page_counts, _ = perf_data.parse_events(PERF_FILE, PAGE_SIZE, vmas=vmas)
+else:
+    page_counts, _ = parse_events(PERF_FILE, PAGE_SIZE, vmas=vmas)
 
-# Read perf output file (derived from perf.data)
-with open('perf_output.txt', 'r') as f:
-    for line in f:
-        if "page-faults" in line:
-            match = address_pattern.search(line)
-            if match:
-                address = int(match.group(1), 16)
-                page = address // PAGE_SIZE
-                page_stats[page]["page_faults"] += 1
-        elif "dTLB-load-misses" in line:
-            match = address_pattern.search(line)
-            if match:
-                address = int(match.group(1), 16)
-                page = address // PAGE_SIZE
-                page_stats[page]["tlb_load_misses"] += 1
-        elif "dTLB-store-misses" in line:
-            match = address_pattern.search(line)
-            if match:
-                address = int(match.group(1), 16)
-                page = address // PAGE_SIZE
-                page_stats[page]["tlb_store_misses"] += 1
-        elif "cache-misses" in line:
-            match = address_pattern.search(line)
-            if match:
-                address = int(match.group(1), 16)
-                page = address // PAGE_SIZE
-                page_stats[page]["cache_misses"] += 1
-        elif "cache-references" in line:
-            match = address_pattern.search(line)
-            if match:
-                address = int(match.group(1), 16)
-                page = address // PAGE_SIZE
-                page_stats[page]["cache_references"] += 1
-        elif "context-switches" in line:
-            page_stats["global"]["context_switches"] += 1
-        elif "instructions" in line:
-            page_stats["global"]["instructions"] += 1
-        elif "branches" in line:
-            page_stats["global"]["branches"] += 1
-        elif "branch-misses" in line:
-            page_stats["global"]["branch_misses"] += 1
+# Without a maps file pages are absolute page numbers and only the first
+# NUM_PAGES are kept, with one every sampled page of the mapped VMAs is
+pages = sorted(page_counts.index) if vmas is not None else range(NUM_PAGES)
+page_stats = {
+    page: dict(counts, **{key: 0 for key in global_stats})
+    for page, counts in page_counts[page_counts.index.isin(pages)].iterrows()
+}
 
 # Compute derived metrics
 data = []
-for page in range(NUM_PAGES):
+for page in pages:
     stats = page_stats.get(page, {
         "page_faults": 0,
         "tlb_load_misses": 0,
@@ -118,6 +82,8 @@ for page in range(NUM_PAGES):
     })
 
 df = pd.DataFrame(data)
+if vmas is not None:
+    df = pd.concat([df, vmas.describe(df['page'])], axis=1)
 print(df.head())
 df.to_csv("ml_dataset.csv", index=False)
 
@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+
+from fault_latency import fault_outcome
+from fault_sampling import sample_weights
+from page_granularity import add_granularity_columns
+from page_history import page_fault_gaps
+
+
+def add_fault_features(df):
+    """Derived per-fault columns page_trace_5.py stores next to the raw fields
+
+    Captures of several processes get their gaps per process, like the
+    in-kernel distance. For sampled captures the gap is divided by the
+    record's sample_weight to approximate the mean gap of the faults the
+    record stands for. The weights are counted per CPU, so with several
+    processes faulting on one CPU this is only an approximation.
+    time_since_page_fault is the gap since the same page last faulted, a
+    grouped diff over the whole capture (page_history.page_fault_gaps)
+    that never evicts a page.
+    """
+    if 'pid' in df.columns and df['pid'].nunique() > 1:
+        df['time_since_last_fault'] = df.groupby('pid')['timestamp_ns'].diff()
+    else:
+        df['time_since_last_fault'] = df['timestamp_ns'].diff()
+    if 'sample_weight' not in df.columns:
+        df['sample_weight'] = 1
+    df['time_since_last_fault'] /= sample_weights(df)
+    df['time_since_page_fault'] = page_fault_gaps(df)
+    if 'vma_start' in df.columns:
+        df['offset_in_vma'] = df['page_id']*4096 - df['vma_start']
+        df['vma_size'] = df['vma_end'] - df['vma_start']
+        df['relative_position'] = df['offset_in_vma'] / df['vma_size']
+    df['sequential_access'] = (df['distance'] == 1).astype(int)
+    if 'vm_fault' in df.columns:
+        df['fault_outcome'] = fault_outcome(df['vm_fault'].to_numpy())
+    return add_granularity_columns(df)
+
+
+def open_dataset(path):
+    """pyarrow dataset over a directory of spilled Parquet/Arrow parts"""
+    # Only spilled captures need pyarrow, CSV and .pfcap readers do not
+    import pyarrow.dataset as ds
+    names = sorted(os.listdir(path))
+    fmt = 'arrow' if any(name.endswith('.arrow') for name in names) else 'parquet'
+    return ds.dataset(path, format=fmt)
+
+
+def load_capture(path, columns=None):
+    """Load a capture CSV, a binary .pfcap file or a directory of spilled Parquet/Arrow parts"""
+    if path.endswith('.pfcap'):
+        from fault_capture import capture_to_frame
+        df = add_fault_features(capture_to_frame(path))
+        return df[columns] if columns is not None else df
+    if not os.path.isdir(path):
+        return pd.read_csv(path, usecols=columns)
+
+    dataset = open_dataset(path)
+    if columns is not None and set(columns) <= set(dataset.schema.names):
+        return dataset.to_table(columns=columns).to_pandas()
+    df = dataset.to_table().to_pandas()
+
+    # Spilled parts hold the raw BPF fields, derive the rest like the CSV writers do
+    if 'timestamp_ns' in df.columns and 'time_since_last_fault' not in df.columns:
+        df = add_fault_features(df)
+    if columns is not None:
+        df = df[columns]
+    return df
@@ -0,0 +1,270 @@
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Workloads every collector is measured on, name -> command. C workloads
+# are built from <name>.c into the work directory and take C_WORKLOAD_SIZE.
+PYTHON_WORKLOADS = {
+    'workload5': ['python3', 'workload5.py'],
+    'workload7': ['python3', 'workload7.py'],
+    'workload10': ['python3', 'workload10.py'],
+    'workloadr': ['python3', 'workloadr.py'],
+    'workloadc': ['python3', 'workloadc.py'],
+}
+C_WORKLOADS = ['workload', 'simple_workload']
+C_WORKLOAD_SIZE = '1G'
+
+COLLECTORS = ['page_trace_3.py', 'page_trace_4.py', 'page_trace_5.py', 'window.py',
+              'time_analysis.py']
+REPEATS = 3  # Runs per (collector, workload), the median is reported
+RESULTS_DIR = 'bench_results'
+
+
+def build_c_workloads(src_dir, out_dir):
+    """Compile the C workloads, name -> command"""
+    commands = {}
+    for name in C_WORKLOADS:
+        binary = os.path.join(out_dir, name)
+        subprocess.run(['cc', '-O2', '-o', binary, os.path.join(src_dir, f'{name}.c')], check=True)
+        commands[name] = [binary, C_WORKLOAD_SIZE]
+    return commands
+
+
+class _Measurement:
+    """Timing and resource use of the one workload run inside a benchmark child"""
+
+    def __init__(self):
+        self.started = None
+        self.finished = None
+        self.self_before = None
+        self.self_after = None
+        self.children_before = None
+        self.children_after = None
+        self.lost = 0
+
+    def start(self):
+        self.self_before = resource.getrusage(resource.RUSAGE_SELF)
+        self.children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+            self.self_after = resource.getrusage(resource.RUSAGE_SELF)
+            # Taken as soon as the workload is reaped, before a collector's
+            # own child processes such as a feature process are
+            self.children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    def result(self, collector_globals=None):
+        """Metrics for this run; collector_* are None without a collector
+
+        A collector's feature process (see EventPipeline.stage_usage) is
+        counted as collector, its CPU time in collector_*_s and its peak
+        RSS in collector_stage_peak_rss_kb.
+        """
+        children = self.children_after
+        wall = self.finished - self.started
+        faults = (children.ru_minflt + children.ru_majflt
+                  - self.children_before.ru_minflt - self.children_before.ru_majflt)
+        result = {
+            'wall_s': wall,
+            'faults': faults,
+            'faults_per_s': faults / wall if wall > 0 else 0.0,
+            'workload_peak_rss_kb': children.ru_maxrss,
+            'events_lost': None,
+            'collector_user_s': None,
+            'collector_sys_s': None,
+            'collector_peak_rss_kb': None,
+            'collector_stage_peak_rss_kb': None,
+        }
+        if collector_globals is not None:
+            # Ring buffer collectors count drops in the kernel and report them
+            # as lost_events, perf buffer losses are counted by the lost callback
+            lost = collector_globals.get('lost_events')
+            result['events_lost'] = int(lost) if isinstance(lost, (int, np.integer)) else self.lost
+            result['collector_user_s'] = self.self_after.ru_utime - self.self_before.ru_utime
+            result['collector_sys_s'] = self.self_after.ru_stime - self.self_before.ru_stime
+            result['collector_peak_rss_kb'] = self.self_after.ru_maxrss
+            stage = getattr(collector_globals.get('pipeline'), 'stage_usage', None)
+            if stage is not None:
+                result['collector_user_s'] += stage['ru_utime']
+                result['collector_sys_s'] += stage['ru_stime']
+                result['collector_stage_peak_rss_kb'] = stage['ru_maxrss']
+        return result
+
+
+def _count_lost_events(measurement):
+    """Give every perf buffer a lost callback that also counts into measurement"""
+    from bcc import table
+
+    real_open = table.PerfEventArray.open_perf_buffer
+
+    def open_perf_buffer(self, callback, page_cnt=8, lost_cb=None, **kwargs):
+        def counted(lost):
+            measurement.lost += lost
+            if lost_cb is not None:
+                lost_cb(lost)
+        return real_open(self, callback, page_cnt, counted, **kwargs)
+
+    table.PerfEventArray.open_perf_buffer = open_perf_buffer
+
+
+def _is_workload(args):
+    args = args if isinstance(args, (list, tuple)) else [args]
+    return any(os.path.basename(str(arg)).startswith('workload') for arg in args)
+
+
+def run_child(collector, command, out_path):
+    """Run one workload, under collector unless it is 'none', and write its metrics
+
+    The collector script runs in this process with its workload launch
+    replaced by command, so its own setup, polling and post-processing
+    are what is measured.
+    """
+    measurement = _Measurement()
+    if collector == 'none':
+        measurement.start()
+        subprocess.run(command, check=True)
+        measurement.stop()
+        result = measurement.result()
+    else:
+        real_popen = subprocess.Popen
+
+        class TimedWorkload(real_popen):
+            def __init__(self, args, *a, **kw):
+                measurement.start()
+                super().__init__(command, *a, **kw)
+
+            def wait(self, timeout=None):
+                returncode = super().wait(timeout)
+                measurement.stop()
+                return returncode
+
+        def fake_popen(args, *a, **kw):
+            if _is_workload(args):
+                return TimedWorkload(args, *a, **kw)
+            return real_popen(args, *a, **kw)
+
+        _count_lost_events(measurement)
+        # subprocess.run goes through subprocess.Popen as well
+        subprocess.Popen = fake_popen
+        collector_globals = {}
+        try:
+            collector_globals = runpy.run_path(collector, run_name='__main__')
+        except SystemExit:
+            pass
+        finally:
+            subprocess.Popen = real_popen
+        if measurement.started is None:
+            raise RuntimeError(f"{collector} never started its workload")
+        result = measurement.result(collector_globals)
+
+    with open(out_path, 'w') as f:
+        json.dump(result, f)
+
+
+def measure(collector, command, src_dir, work_dir):
+    """Metrics of one run, each run is a fresh interpreter so rusage is its own"""
+    out_path = os.path.join(work_dir, 'run.json')
+    target = 'none' if collector is None else os.path.join(src_dir, collector)
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', target, out_path,
+                    json.dumps(command)], cwd=work_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(out_path, 'r') as f:
+        return json.load(f)
+
+
+def _median(runs):
+    summary = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run[key] is not None]
+        summary[key] = float(np.median(values)) if values else None
+    return summary
+
+
+def run_benchmarks(collectors=COLLECTORS, workloads=None, repeats=REPEATS, src_dir=None):
+    """Median metrics of every workload alone and under every collector
+
+    Slowdowns are relative to the workload's untraced wall time.
+    """
+    src_dir = os.path.abspath(src_dir or os.path.dirname(__file__))
+    work_dir = tempfile.mkdtemp(prefix='collector_bench_')
+    # Collectors check for and launch their workload scripts in the work directory
+    for name in os.listdir(src_dir):
+        if name.startswith('workload') and name.endswith('.py'):
+            os.symlink(os.path.join(src_dir, name), os.path.join(work_dir, name))
+    if workloads is None:
+        workloads = dict(PYTHON_WORKLOADS)
+        workloads.update(build_c_workloads(src_dir, work_dir))
+
+    results = []
+    for workload, command in workloads.items():
+        baseline = _median([measure(None, command, src_dir, work_dir) for _ in range(repeats)])
+        results.append({'collector': None, 'workload': workload, 'slowdown': 1.0, **baseline})
+        print(f"{workload:16} {'untraced':16} {baseline['wall_s']:8.2f}s")
+        for collector in collectors:
+            traced = _median([measure(collector, command, src_dir, work_dir)
+                              for _ in range(repeats)])
+            slowdown = traced['wall_s'] / baseline['wall_s'] if baseline['wall_s'] else None
+            results.append({'collector': collector, 'workload': workload, 'slowdown': slowdown,
+                            **traced})
+            print(f"{workload:16} {collector:16} {traced['wall_s']:8.2f}s  x{slowdown:.2f}"
+                  f"  lost {traced['events_lost']}")
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'kernel': platform.release(),
+        'cpus': os.cpu_count(),
+        'repeats': repeats,
+        'results': results,
+    }
+
+
+def save_results(report, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"bench_{report['created'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare(old, new, metric='slowdown'):
+    """Per (collector, workload) change of metric between two reports, new / old"""
+    before = {(r['collector'], r['workload']): r[metric] for r in old['results']}
+    changes = {}
+    for r in new['results']:
+        key = (r['collector'], r['workload'])
+        if before.get(key) and r[metric] is not None:
+            changes[key] = r[metric] / before[key]
+    return changes
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], json.loads(sys.argv[4]), sys.argv[3])
+        exit()
+    if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        if len(sys.argv) < 4:
+            print("Usage: python3 collector_bench.py --compare <old.json> <new.json>")
+            exit(1)
+        with open(sys.argv[2], 'r') as f:
+            old = json.load(f)
+        with open(sys.argv[3], 'r') as f:
+            new = json.load(f)
+        for (collector, workload), ratio in sorted(compare(old, new).items(), key=str):
+            flag = '  REGRESSION' if ratio > 1.05 else ''
+            print(f"{workload:16} {collector or 'untraced':16} slowdown x{ratio:.2f}{flag}")
+        exit()
+
+    # Collectors attach BPF programs, run as root
+    collectors = sys.argv[1:] or COLLECTORS
+    report = run_benchmarks(collectors)
+    print(f"Results written to {save_results(report)}")
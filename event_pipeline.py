@@ -0,0 +1,254 @@
+import ctypes
+import multiprocessing
+import queue
+import resource
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MERGE_SLACK = 0.05           # Seconds without records before a CPU counts as quiet
+MERGE_INTERVAL = 0.01        # Seconds between merge passes
+RING_CAPACITY = 1 << 20      # Records the shared-memory ring to a feature process holds
+
+# getrusage fields a feature process reports back, see EventPipeline.stage_usage
+STAGE_USAGE = ('ru_utime', 'ru_stime', 'ru_minflt', 'ru_majflt', 'ru_maxrss')
+
+
+class PerCpuQueues:
+    """One single-producer queue of raw records per CPU
+
+    stage() is the perf buffer callback: it copies the record's bytes and
+    appends them to its CPU's deque, nothing else. deque append and popleft
+    are atomic, so the poller and the merge stage never take a lock.
+    """
+
+    def __init__(self, dtype, n_cpus=None):
+        self.dtype = np.dtype(dtype)
+        if n_cpus is None:
+            # Callbacks get the CPU id, which can be past the online count
+            # when a CPU is offline, so size by the highest possible id
+            from bcc.utils import get_possible_cpus
+            n_cpus = max(get_possible_cpus()) + 1
+        self.queues = [deque() for _ in range(n_cpus)]
+
+    def stage(self, cpu, data, size):
+        self.queues[cpu].append(ctypes.string_at(data, self.dtype.itemsize))
+
+    def take(self, cpu):
+        """Everything queued for cpu so far, decoded in one go"""
+        q = self.queues[cpu]
+        chunks = [q.popleft() for _ in range(len(q))]
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.frombuffer(b''.join(chunks), dtype=self.dtype)
+
+
+class TimestampMerger:
+    """Merge per-CPU record streams into one stream ordered by time_field
+
+    Each CPU's stream is already in time order, so a record can go out once
+    every CPU has delivered something at least as recent. A CPU that
+    delivered nothing for slack seconds is quiet and stops holding the
+    others back until it delivers again.
+    """
+
+    def __init__(self, queues, time_field='timestamp', slack=MERGE_SLACK):
+        self.queues = queues
+        self.time_field = time_field
+        self.slack = slack
+        n_cpus = len(queues.queues)
+        self.pending = [np.empty(0, dtype=queues.dtype) for _ in range(n_cpus)]
+        self.last_seen = np.zeros(n_cpus, dtype=np.uint64)
+        self.last_delivery = np.full(n_cpus, -np.inf)
+
+    def poll(self, final=False):
+        """Records that are safe to release, in time order; final releases everything"""
+        now = time.monotonic()
+        for cpu in range(len(self.pending)):
+            batch = self.queues.take(cpu)
+            if len(batch):
+                self.pending[cpu] = (np.concatenate([self.pending[cpu], batch])
+                                     if len(self.pending[cpu]) else batch)
+                self.last_seen[cpu] = batch[self.time_field][-1]
+                self.last_delivery[cpu] = now
+
+        active = now - self.last_delivery <= self.slack
+        if final or not active.any():
+            watermark = np.iinfo(np.uint64).max
+        else:
+            watermark = int(self.last_seen[active].min())
+
+        released = []
+        for cpu, pending in enumerate(self.pending):
+            split = int(np.searchsorted(pending[self.time_field], watermark, side='right'))
+            if split:
+                released.append(pending[:split])
+                self.pending[cpu] = pending[split:]
+        if not released:
+            return np.empty(0, dtype=self.queues.dtype)
+        merged = np.concatenate(released)
+        return merged[np.argsort(merged[self.time_field], kind='stable')]
+
+
+class SharedRing:
+    """Single-producer single-consumer ring of records in shared memory
+
+    The header holds head, tail and a closed flag. The producer only moves
+    tail and the consumer only moves head, after the records are written or
+    copied out, so neither side needs a lock.
+    """
+
+    HEADER = 3  # head, tail, closed as uint64
+
+    def __init__(self, dtype, capacity=RING_CAPACITY, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        size = self.HEADER * 8 + capacity * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.state = np.ndarray(self.HEADER, dtype=np.uint64, buffer=self.shm.buf)
+        self.records = np.ndarray(capacity, dtype=self.dtype, buffer=self.shm.buf,
+                                  offset=self.HEADER * 8)
+        if name is None:
+            self.state[:] = 0
+
+    def write(self, batch):
+        """Copy batch in, waiting for room when the consumer is behind"""
+        start = 0
+        while start < len(batch):
+            head, tail = int(self.state[0]), int(self.state[1])
+            room = self.capacity - (tail - head)
+            if room == 0:
+                time.sleep(MERGE_INTERVAL / 10)
+                continue
+            n = min(room, len(batch) - start, self.capacity - tail % self.capacity)
+            self.records[tail % self.capacity:tail % self.capacity + n] = batch[start:start + n]
+            self.state[1] = tail + n
+            start += n
+
+    def read(self):
+        """Copy out everything written so far"""
+        head, tail = int(self.state[0]), int(self.state[1])
+        if head == tail:
+            return np.empty(0, dtype=self.dtype)
+        first = head % self.capacity
+        n = min(tail - head, self.capacity - first)
+        out = self.records[first:first + n].copy()
+        if tail - head > n:
+            out = np.concatenate([out, self.records[:tail - head - n]])
+        self.state[0] = tail
+        return out
+
+    def close(self):
+        self.state[2] = 1
+
+    def closed(self):
+        return bool(self.state[2])
+
+    def release(self, unlink=False):
+        del self.state, self.records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _run_stage_process(stage_factory, dtype, capacity, ring_name, results):
+    ring = SharedRing(dtype, capacity, name=ring_name)
+    stage = stage_factory()
+    while True:
+        # Check closed before reading so the last records are not missed
+        closed = ring.closed()
+        batch = ring.read()
+        if len(batch):
+            stage.consume(batch)
+        elif closed:
+            break
+        else:
+            time.sleep(MERGE_INTERVAL)
+    ring.release()
+    result = stage.result()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    results.send((result, {field: getattr(usage, field) for field in STAGE_USAGE}))
+
+
+class EventPipeline:
+    """perf buffer callback -> per-CPU queues -> timestamp merge -> feature stage
+
+    stage_factory builds an object with consume(batch) and result(). With
+    process=True it runs in a forked process fed through a SharedRing, so
+    feature work does not compete with the poller for the GIL; otherwise in
+    a thread fed through a queue of merged batches. Either way the stage
+    sees batches in timestamp order and stop() returns its result().
+
+    A feature process is a child of the collector, so its CPU time and
+    faults land in RUSAGE_CHILDREN rather than the collector's own usage.
+    After stop() its getrusage fields are in stage_usage, None with a thread.
+    """
+
+    def __init__(self, dtype, stage_factory, time_field='timestamp', n_cpus=None,
+                 process=False, capacity=RING_CAPACITY):
+        self.queues = PerCpuQueues(dtype, n_cpus)
+        self.merger = TimestampMerger(self.queues, time_field)
+        self.stage_factory = stage_factory
+        self.process = process
+        self.capacity = capacity
+        self.stopping = threading.Event()
+        self.merged = 0
+        self.stage_usage = None
+
+    @property
+    def callback(self):
+        return self.queues.stage
+
+    def start(self):
+        if self.process:
+            self.ring = SharedRing(self.queues.dtype, self.capacity)
+            self.results, child_end = multiprocessing.get_context('fork').Pipe(duplex=False)
+            self.worker = multiprocessing.get_context('fork').Process(
+                target=_run_stage_process,
+                args=(self.stage_factory, self.queues.dtype, self.capacity, self.ring.shm.name,
+                      child_end))
+            self.worker.start()
+            self.sink = self.ring.write
+        else:
+            self.stage = self.stage_factory()
+            self.batches = queue.SimpleQueue()
+            self.worker = threading.Thread(target=self._run_stage_thread, daemon=True)
+            self.worker.start()
+            self.sink = self.batches.put
+        self.merge_thread = threading.Thread(target=self._merge, daemon=True)
+        self.merge_thread.start()
+
+    def _merge(self):
+        while not self.stopping.is_set():
+            self._forward(self.merger.poll())
+            time.sleep(MERGE_INTERVAL)
+        self._forward(self.merger.poll(final=True))
+
+    def _forward(self, batch):
+        if len(batch):
+            self.merged += len(batch)
+            self.sink(batch)
+
+    def _run_stage_thread(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            self.stage.consume(batch)
+
+    def stop(self):
+        """Flush everything still queued through the stages and return the stage's result"""
+        self.stopping.set()
+        self.merge_thread.join()
+        if self.process:
+            self.ring.close()
+            result, self.stage_usage = self.results.recv()
+            self.worker.join()
+            self.ring.release(unlink=True)
+            return result
+        self.batches.put(None)
+        self.worker.join()
+        return self.stage.result()
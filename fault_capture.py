@@ -0,0 +1,138 @@
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+from fault_store import FAULT_DATA_DTYPE
+
+# File layout: fixed prefix, JSON description of the record dtype, zero
+# padding up to a 64-byte boundary, then packed records until end of file
+MAGIC = b'PFCAP\x00\x00\x00'
+VERSION = 1
+PREFIX = struct.Struct('<8sHIIII')  # magic, version, header_len, page_size, pid, record_size
+ALIGN = 64
+
+
+def _describe(dtype):
+    return {
+        'names': list(dtype.names),
+        'formats': [dtype.fields[name][0].str for name in dtype.names],
+        'offsets': [dtype.fields[name][1] for name in dtype.names],
+        'itemsize': dtype.itemsize,
+    }
+
+
+def _header(dtype, page_size, pid):
+    layout = json.dumps(_describe(dtype)).encode()
+    header_len = PREFIX.size + 4 + len(layout)
+    header_len += -header_len % ALIGN
+    prefix = PREFIX.pack(MAGIC, VERSION, header_len, page_size, pid, dtype.itemsize)
+    body = prefix + struct.pack('<I', len(layout)) + layout
+    return body + b'\x00' * (header_len - len(body))
+
+
+class CaptureWriter:
+    """Append packed fault records to a .pfcap file
+
+    Also works as a ColumnarBuffer spill target, full chunks are packed
+    into records and written synchronously.
+    """
+
+    def __init__(self, path, dtype=FAULT_DATA_DTYPE, page_size=4096, pid=0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.page_size = page_size
+        self.pid = pid
+        self.rows_written = 0
+        self.file = open(path, 'wb')
+        self.file.write(_header(self.dtype, page_size, pid))
+
+    def write(self, records):
+        """Write a structured array that already has the capture's dtype"""
+        np.ascontiguousarray(records, dtype=self.dtype).tofile(self.file)
+        self.rows_written += len(records)
+
+    def submit(self, columns):
+        n = len(next(iter(columns.values())))
+        records = np.zeros(n, dtype=self.dtype)
+        for name in self.dtype.names:
+            records[name] = columns[name]
+        self.write(records)
+
+    def close(self):
+        # The PID is often only known after the header went out, so rewrite it
+        self.file.seek(0)
+        self.file.write(_header(self.dtype, self.page_size, self.pid))
+        self.file.close()
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        prefix = f.read(PREFIX.size + 4)
+        magic, version, header_len, page_size, pid, record_size = PREFIX.unpack(prefix[:PREFIX.size])
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a fault capture")
+        if version != VERSION:
+            raise ValueError(f"Unsupported capture version {version}")
+        layout_len = struct.unpack('<I', prefix[PREFIX.size:])[0]
+        layout = json.loads(f.read(layout_len))
+    dtype = np.dtype(layout)
+    if dtype.itemsize != record_size:
+        raise ValueError(f"Record size {record_size} does not match its layout")
+    return {
+        'header_len': header_len,
+        'page_size': page_size,
+        'pid': pid,
+        'dtype': dtype,
+    }
+
+
+def open_capture(path):
+    """Header and a read-only memory-mapped structured array of the records"""
+    header = read_header(path)
+    n = (os.path.getsize(path) - header['header_len']) // header['dtype'].itemsize
+    if n == 0:
+        return header, np.empty(0, dtype=header['dtype'])
+    records = np.memmap(path, dtype=header['dtype'], mode='r',
+                        offset=header['header_len'], shape=(n,))
+    return header, records
+
+
+def capture_to_frame(path):
+    """DataFrame of the raw record fields, one column per struct field"""
+    _, records = open_capture(path)
+    return pd.DataFrame({name: np.asarray(records[name]) for name in records.dtype.names})
+
+
+def convert_csv(csv_path, out_path, dtype=FAULT_DATA_DTYPE, page_size=4096):
+    """Pack an existing only_pfs*.csv capture into the binary format"""
+    dtype = np.dtype(dtype)
+    df = pd.read_csv(csv_path, usecols=lambda name: name in dtype.names)
+    records = np.zeros(len(df), dtype=dtype)
+    for name in dtype.names:
+        if name in df.columns:
+            records[name] = df[name].to_numpy()
+        elif name == 'page_shift':
+            # Captures from before page_shift was recorded: base pages only
+            records[name] = page_size.bit_length() - 1
+        elif name == 'sample_weight':
+            # Captures from before in-kernel sampling: every fault recorded
+            records[name] = 1
+    pid = int(df['pid'].iloc[0]) if 'pid' in df.columns and len(df) else 0
+    writer = CaptureWriter(out_path, dtype, page_size, pid)
+    writer.write(records)
+    writer.close()
+    return writer.rows_written
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 fault_capture.py <only_pfs.csv> [out.pfcap]")
+        exit(1)
+    csv_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(csv_path)[0] + '.pfcap'
+    rows = convert_csv(csv_path, out_path)
+    print(f"Wrote {rows} records to {out_path} ({os.path.getsize(out_path)} bytes)")
@@ -0,0 +1,96 @@
+import ctypes
+
+import numpy as np
+import pandas as pd
+
+LATENCY_SLOTS = 64  # log2 buckets as bpf_log2l() numbers them, slot k holds [2^(k-1), 2^k) ns
+
+# vm_fault_t bits handle_mm_fault returns, see include/linux/mm_types.h
+VM_FAULT_OOM = 0x000001
+VM_FAULT_SIGBUS = 0x000002
+VM_FAULT_MAJOR = 0x000004
+VM_FAULT_HWPOISON = 0x000010
+VM_FAULT_HWPOISON_LARGE = 0x000020
+VM_FAULT_SIGSEGV = 0x000040
+VM_FAULT_RETRY = 0x000400
+VM_FAULT_FALLBACK = 0x000800
+VM_FAULT_ERROR = (VM_FAULT_OOM | VM_FAULT_SIGBUS | VM_FAULT_SIGSEGV | VM_FAULT_HWPOISON
+                  | VM_FAULT_HWPOISON_LARGE | VM_FAULT_FALLBACK)
+
+FAULT_OUTCOMES = ['minor', 'major', 'retry', 'error']
+
+# Included by collectors that time handle_mm_fault from entry to return.
+# The entry probe keeps its half-built record in a per-thread hash, the
+# return probe looks it up, fills in the service time and return code and
+# calls count_fault_latency(), which keeps a per-CPU log2 histogram so
+# summaries need no per-fault events. A thread handles one fault at a
+# time, so the thread id pairs entry and return.
+FAULT_TIMING = """
+BPF_PERCPU_ARRAY(fault_latency_hist, u64, LATENCY_SLOTS);
+
+static inline void count_fault_latency(u64 latency_ns) {
+    int slot = bpf_log2l(latency_ns);
+    if (slot >= LATENCY_SLOTS) {
+        slot = LATENCY_SLOTS - 1;
+    }
+    u64 *bucket = fault_latency_hist.lookup(&slot);
+    if (bucket) {
+        (*bucket)++;
+    }
+}
+"""
+
+
+def timing_cflags():
+    return [f'-DLATENCY_SLOTS={LATENCY_SLOTS}']
+
+
+def fault_outcome(vm_fault):
+    """Classify VM_FAULT_* return codes as FAULT_OUTCOMES, vectorized
+
+    An error wins over a retry, a retry over major, so 'major' and 'minor'
+    are faults that were actually resolved.
+    """
+    codes = np.asarray(vm_fault, dtype=np.uint64)
+    kind = np.zeros(len(codes), dtype=np.int64)
+    kind[(codes & np.uint64(VM_FAULT_MAJOR)) != 0] = 1
+    kind[(codes & np.uint64(VM_FAULT_RETRY)) != 0] = 2
+    kind[(codes & np.uint64(VM_FAULT_ERROR)) != 0] = 3
+    return pd.Categorical.from_codes(kind, FAULT_OUTCOMES)
+
+
+def read_latency_histogram(table, slots=LATENCY_SLOTS):
+    """Counts of the fault_latency_hist per-CPU array, summed over CPUs"""
+    return np.array([table.sum(ctypes.c_int(slot)).value for slot in range(slots)],
+                    dtype=np.int64)
+
+
+def histogram_frame(counts):
+    """One row per non-empty log2 bucket: [low_ns, high_ns) and its count"""
+    slots = np.flatnonzero(counts)
+    return pd.DataFrame({
+        'low_ns': np.left_shift(1, slots - 1, dtype=np.int64) * (slots > 0),
+        'high_ns': np.left_shift(1, slots, dtype=np.int64),
+        'count': counts[slots],
+    })
+
+
+def histogram_percentile(counts, q):
+    """Upper bound of the bucket holding the q-th percentile, in ns"""
+    total = counts.sum()
+    if total == 0:
+        return 0
+    slot = int(np.searchsorted(np.cumsum(counts), total * q / 100.0))
+    return 1 << min(slot, len(counts) - 1)
+
+
+def print_latency_summary(counts):
+    total = int(counts.sum())
+    print(f"\nFault service time ({total} faults):")
+    if total == 0:
+        return
+    print(f"  p50 < {histogram_percentile(counts, 50) / 1e3:.1f} us, "
+          f"p99 < {histogram_percentile(counts, 99) / 1e3:.1f} us")
+    for row in histogram_frame(counts).itertuples():
+        bar = '#' * max(1, int(40 * row.count / counts.max()))
+        print(f"  {row.low_ns:>12} -> {row.high_ns:<12} {row.count:>10} {bar}")
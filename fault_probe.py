@@ -0,0 +1,163 @@
+from fault_latency import FAULT_TIMING, timing_cflags
+from fault_sampling import SAMPLING_FILTER, FaultSampler
+from page_granularity import PAGE_SHIFT_HELPER, granularity_cflags
+from probe_backend import PROBE_HOOKS, backend_cflags
+from trace_scope import SCOPE_FILTER, TraceScope
+
+# BPF program behind page_trace_5.py, shared with the tools that consume its
+# fault_data_t stream live (see fault_store.FAULT_DATA_DTYPE for the layout).
+# Every probe backend calls record_fault(), so the records look the same.
+FAULT_PROBE = PAGE_SHIFT_HELPER + SCOPE_FILTER + SAMPLING_FILTER + FAULT_TIMING + """
+#include <uapi/linux/ptrace.h>
+#include <linux/mm.h>
+
+struct fault_data_t {
+    u64 page_id;           
+    u64 timestamp_ns;      
+    u64 is_write;         
+    u64 distance;         
+    u32 pid;              
+    u32 fault_flags;      
+    u64 vm_flags;         
+    u64 fault_count;      
+    u64 vma_start;        
+    u64 vma_end;          
+    u64 page_shift;        // Estimated shift of the page the fault maps (12, 21, ...)
+    u64 sample_weight;     // Faults this record stands for (see fault_sampling)
+    u64 fault_latency;     // ns spent in handle_mm_fault, paired backends only
+    u64 vm_fault;          // VM_FAULT_* code handle_mm_fault returned, paired backends only
+};
+
+#ifdef USE_RINGBUF
+BPF_RINGBUF_OUTPUT(events, RINGBUF_PAGES);
+BPF_PERCPU_ARRAY(lost_events, u64, 1);  // Records dropped on a full ring buffer
+#else
+BPF_PERF_OUTPUT(events);
+#endif
+// Faults per page of each process, virtual pages of different processes are unrelated
+struct pid_page_t {
+    u64 page_id;
+    u32 pid;
+};
+
+BPF_HASH(last_fault_page, u32, u64);    
+BPF_HASH(page_fault_count, struct pid_page_t, u64);   
+BPF_HASH(process_fault_count, u32, u64); 
+
+#ifdef PROBE_PAIRED
+// Record of the fault each thread is in, submitted once handle_mm_fault returns
+BPF_HASH(pending_fault, u32, struct fault_data_t);
+#endif
+
+static inline void submit_fault(void *ctx, struct fault_data_t *data) {
+#ifdef USE_RINGBUF
+    if (events.ringbuf_output(data, sizeof(*data), 0) < 0) {
+        u32 zero = 0;
+        u64 *lost = lost_events.lookup(&zero);
+        if (lost) {
+            (*lost)++;
+        }
+    }
+#else
+    events.perf_submit(ctx, data, sizeof(*data));
+#endif
+}
+
+// Builds the record of one fault and submits it, or with a paired backend
+// parks it until complete_fault() adds the service time and return code.
+// vma is NULL for the tracepoint backend, which passes the x86 error code
+// as flags.
+static inline int record_fault(void *ctx, struct vm_area_struct *vma, unsigned long address,
+                               unsigned int flags, u64 start_ns) {
+    u32 pid = bpf_get_current_pid_tgid() >> 32;
+    
+    // Only processes in the trace scope (PID set, process tree or cgroup)
+    if (!in_scope(pid)) {
+        return 0;
+    }
+    
+    // Only specific user flags, the tracepoint only sees user faults anyway
+    if (vma && flags != 629) {
+    return 0;
+    }
+
+    struct fault_data_t data = {};
+    
+    data.page_id = address / 4096;
+    data.timestamp_ns = start_ns;
+    data.pid = pid;
+    data.fault_flags = flags;
+    if (vma) {
+        data.is_write = !!(vma->vm_flags & 0x2);
+        data.vm_flags = vma->vm_flags;
+        data.vma_start = vma->vm_start;
+        data.vma_end = vma->vm_end;
+        data.page_shift = fault_page_shift(vma, address);
+    } else {
+        data.is_write = !!(flags & 0x2);  // X86_PF_WRITE
+        data.page_shift = 12;
+    }
+    
+    // Calculate distance from last fault
+    u64 *last_page = last_fault_page.lookup(&pid);
+    if (last_page) {
+        data.distance = data.page_id - *last_page;
+    }
+    last_fault_page.update(&pid, &data.page_id);
+    
+    // Update fault count for this page
+    struct pid_page_t page_key = {};
+    page_key.page_id = data.page_id;
+    page_key.pid = pid;
+    u64 *count = page_fault_count.lookup(&page_key);
+    if (count) {
+        (*count)++;
+    } else {
+        u64 initial = 1;
+        page_fault_count.update(&page_key, &initial);
+    }
+    data.fault_count = count ? *count : 1;
+    
+    // Distance and fault count above cover every fault, sampling only
+    // decides whether this one is submitted
+    data.sample_weight = sample_weight(pid, data.page_id);
+    if (!data.sample_weight) {
+        return 0;
+    }
+    
+#ifdef PROBE_PAIRED
+    u32 tid = bpf_get_current_pid_tgid();
+    pending_fault.update(&tid, &data);
+#else
+    submit_fault(ctx, &data);
+#endif
+    return 0;
+}
+
+#ifdef PROBE_PAIRED
+static inline int complete_fault(void *ctx, u64 ret) {
+    u32 tid = bpf_get_current_pid_tgid();
+    struct fault_data_t *data = pending_fault.lookup(&tid);
+    if (!data) {
+        return 0;
+    }
+    data->fault_latency = bpf_ktime_get_ns() - data->timestamp_ns;
+    data->vm_fault = ret;
+    count_fault_latency(data->fault_latency);
+    submit_fault(ctx, data);
+    pending_fault.delete(&tid);
+    return 0;
+}
+#endif
+""" + PROBE_HOOKS
+
+
+def probe_cflags(collector_mode='ringbuf', ringbuf_pages=256, scope=None, sampler=None,
+                 backend='kprobe'):
+    """Compiler flags selecting output path, scope, sampling and probe backend of FAULT_PROBE"""
+    cflags = granularity_cflags() + timing_cflags() + (scope or TraceScope()).cflags()
+    cflags += backend_cflags(backend)
+    cflags += (sampler or FaultSampler()).cflags()
+    if collector_mode == 'ringbuf':
+        cflags += ['-DUSE_RINGBUF', f'-DRINGBUF_PAGES={ringbuf_pages}']
+    return cflags
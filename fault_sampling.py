@@ -0,0 +1,127 @@
+import numpy as np
+
+SAMPLING_MODES = ('all', 'every_n', 'first_touch', 'token_bucket')
+MAX_SAMPLED_PAGES = 1 << 20  # Capacity of the first-touch LRU hash
+
+# Included by BPF programs that sample faults before submitting them.
+# sample_weight() returns 0 for a fault that is dropped, otherwise the
+# number of faults the record stands for: N for 1-in-N, 1 for the first
+# touch of a page, and for the token bucket the faults this CPU dropped
+# since its last record plus one. For every_n and token_bucket, summing the
+# weights of the records estimates the true fault count. first_touch drops
+# repeat faults without accounting for them, so its weights only count
+# distinct pages. every_n and token_bucket keep their counters per CPU, not
+# per process, so a record's weight includes faults of whatever else ran
+# on that CPU.
+SAMPLING_FILTER = """
+#if defined(SAMPLE_EVERY_N) || defined(SAMPLE_TOKEN_BUCKET)
+struct sample_state_t {
+    u64 skipped;   // Faults dropped since this CPU's last record
+    u64 tokens;    // Token bucket fill, in 1e-9 tokens
+    u64 last_ns;   // Last refill
+};
+BPF_PERCPU_ARRAY(sample_state, struct sample_state_t, 1);
+#endif
+
+#ifdef SAMPLE_FIRST_TOUCH
+struct sample_page_t {
+    u64 page_id;
+    u32 pid;
+};
+BPF_LRU_HASH(sampled_pages, struct sample_page_t, u8, SAMPLE_MAX_PAGES);
+#endif
+
+#define SAMPLE_TOKEN 1000000000ULL
+
+static inline u64 sample_weight(u32 pid, u64 page_id) {
+#if defined(SAMPLE_EVERY_N) || defined(SAMPLE_TOKEN_BUCKET)
+    int zero = 0;
+    struct sample_state_t *state = sample_state.lookup(&zero);
+    if (!state) {
+        return 1;
+    }
+#endif
+#if defined(SAMPLE_EVERY_N)
+    if (++state->skipped < SAMPLE_EVERY_N) {
+        return 0;
+    }
+    state->skipped = 0;
+    return SAMPLE_EVERY_N;
+#elif defined(SAMPLE_TOKEN_BUCKET)
+    // Refill at SAMPLE_RATE tokens/s, capping the idle time first so the
+    // product cannot overflow; a CPU idle that long has a full bucket anyway
+    u64 now = bpf_ktime_get_ns();
+    u64 elapsed = now - state->last_ns;
+    state->last_ns = now;
+    if (elapsed > SAMPLE_REFILL_NS) {
+        elapsed = SAMPLE_REFILL_NS;
+    }
+    state->tokens += elapsed * SAMPLE_RATE;
+    if (state->tokens > SAMPLE_BURST * SAMPLE_TOKEN) {
+        state->tokens = SAMPLE_BURST * SAMPLE_TOKEN;
+    }
+    if (state->tokens < SAMPLE_TOKEN) {
+        state->skipped++;
+        return 0;
+    }
+    state->tokens -= SAMPLE_TOKEN;
+    u64 weight = state->skipped + 1;
+    state->skipped = 0;
+    return weight;
+#elif defined(SAMPLE_FIRST_TOUCH)
+    struct sample_page_t key = {};
+    key.page_id = page_id;
+    key.pid = pid;
+    u8 one = 1;
+    // insert() fails when the page was already recorded
+    return sampled_pages.insert(&key, &one) == 0;
+#else
+    return 1;
+#endif
+}
+"""
+
+
+class FaultSampler:
+    """How a collector thins out faults in the kernel before submitting them
+
+    'all' keeps every fault, 'every_n' one in every_n per CPU,
+    'first_touch' the first fault of each page of a process, 'token_bucket'
+    at most rate records per second per CPU with bursts of up to burst.
+    """
+
+    def __init__(self, mode='all', every_n=16, rate=10000, burst=1000,
+                 max_pages=MAX_SAMPLED_PAGES):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode {mode!r}, expected one of {SAMPLING_MODES}")
+        if mode == 'every_n' and every_n < 1:
+            raise ValueError("every_n must be at least 1")
+        if mode == 'token_bucket' and (rate < 1 or burst < 1):
+            raise ValueError("Token bucket rate and burst must be at least 1")
+        self.mode = mode
+        self.every_n = every_n
+        self.rate = rate
+        self.burst = burst
+        self.max_pages = max_pages
+
+    def cflags(self):
+        if self.mode == 'every_n':
+            return [f'-DSAMPLE_EVERY_N={self.every_n}']
+        if self.mode == 'first_touch':
+            return ['-DSAMPLE_FIRST_TOUCH', f'-DSAMPLE_MAX_PAGES={self.max_pages}']
+        if self.mode == 'token_bucket':
+            refill_ns = -(-self.burst * 10**9 // self.rate)
+            return ['-DSAMPLE_TOKEN_BUCKET', f'-DSAMPLE_RATE={self.rate}ULL',
+                    f'-DSAMPLE_BURST={self.burst}ULL', f'-DSAMPLE_REFILL_NS={refill_ns}ULL']
+        return []
+
+
+def sample_weights(df, column='sample_weight'):
+    """Weight of every record as float64, 1 for captures taken without sampling
+
+    Weights come from per-CPU counters, so dividing a per-process gap by
+    them is only approximate when several processes fault on one CPU.
+    """
+    if column in df.columns:
+        return np.maximum(df[column].to_numpy().astype(np.float64), 1.0)
+    return np.ones(len(df))
@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 1 << 16  # Rows per chunk, each chunk is one array per column
+
+# Mirrors struct fault_data_t in fault_probe.py (104 bytes, no padding)
+FAULT_DATA_DTYPE = np.dtype([
+    ('page_id', np.uint64),
+    ('timestamp_ns', np.uint64),
+    ('is_write', np.uint64),
+    ('distance', np.uint64),
+    ('pid', np.uint32),
+    ('fault_flags', np.uint32),
+    ('vm_flags', np.uint64),
+    ('fault_count', np.uint64),
+    ('vma_start', np.uint64),
+    ('vma_end', np.uint64),
+    ('page_shift', np.uint64),
+    ('sample_weight', np.uint64),
+    ('fault_latency', np.uint64),
+    ('vm_fault', np.uint64),
+])
+
+# Mirrors struct fault_data_t in page_trace_4.py (padded to 56 bytes)
+BASIC_FAULT_DATA_DTYPE = np.dtype({
+    'names': ['page_id', 'timestamp_ns', 'is_write', 'distance', 'pid', 'page_shift',
+              'fault_latency', 'vm_fault'],
+    'formats': [np.uint64, np.uint64, np.uint64, np.uint64, np.uint32, np.uint32,
+                np.uint64, np.uint32],
+    'offsets': [0, 8, 16, 24, 32, 36, 40, 48],
+    'itemsize': 56,
+})
+
+# Mirrors struct data_t in page_trace_3.py, followed by the columns the
+# user-space handler derives per event
+ACCESS_DATA_DTYPE = np.dtype([
+    ('pid', np.uint64),
+    ('tid', np.uint64),
+    ('cpu', np.uint64),
+    ('page_id', np.uint64),
+    ('access_time_ns', np.uint64),
+    ('access_type', np.uint32),
+    ('fault_type', np.uint32),
+    ('vma_start', np.uint64),
+    ('vma_end', np.uint64),
+    ('vma_flags', np.uint32),
+    ('ip', np.uint64),
+    ('page_shift', np.uint32),
+    ('sample_weight', np.uint32),
+    ('inter_access_time_ns', np.int64),
+    ('access_frequency', np.int64),
+    ('read_count', np.int64),
+    ('write_count', np.int64),
+    ('page_fault', np.uint8),
+])
+
+# Mirrors struct data_t in time_analysis.py (40 bytes, no padding)
+TIME_FAULT_DTYPE = np.dtype([
+    ('timestamp', np.uint64),
+    ('page_id', np.uint64),
+    ('fault_type', np.uint64),
+    ('pid', np.uint32),
+    ('memory_pressure', np.uint32),
+    ('page_shift', np.uint64),
+])
+
+# Events as window.py's handler stores them, timestamp already in seconds
+WINDOW_EVENT_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('pid', np.uint32),
+    ('minor_faults', np.uint64),
+    ('major_faults', np.uint64),
+])
+
+# Mirrors struct page_stats_t in page_trace.py's aggregation mode (one per CPU)
+PAGE_STATS_DTYPE = np.dtype([
+    ('access_freq', np.uint64),
+    ('read_count', np.uint64),
+    ('write_count', np.uint64),
+    ('first_access_ns', np.uint64),
+    ('last_access_ns', np.uint64),
+    ('page_shift', np.uint64),
+])
+
+
+class ColumnarBuffer:
+    """Growable column store for fault events, one NumPy array per field
+
+    With a spill writer attached, full chunks are handed to it instead of
+    being kept, so only the chunk being filled stays in memory.
+    """
+
+    def __init__(self, dtype, chunk_size=CHUNK_SIZE, spill=None):
+        self.dtype = np.dtype(dtype)
+        self.names = self.dtype.names
+        self.chunk_size = chunk_size
+        self.spill = spill
+        self.sealed = {name: [] for name in self.names}
+        self.sealed_rows = 0
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self.current = [np.empty(self.chunk_size, dtype=self.dtype[name])
+                        for name in self.names]
+        self.fill = 0
+
+    def _seal(self):
+        # Chunks are never written again once sealed, so the writer can own them
+        if self.spill is not None:
+            self.spill.submit({name: column[:self.fill]
+                               for name, column in zip(self.names, self.current)})
+        else:
+            for name, column in zip(self.names, self.current):
+                self.sealed[name].append(column[:self.fill])
+        self.sealed_rows += self.fill
+        self._new_chunk()
+
+    def finish(self):
+        """Hand the partial chunk to the spill writer and wait for it to finish"""
+        if self.fill:
+            self._seal()
+        self.spill.close()
+
+    def __len__(self):
+        return self.sealed_rows + self.fill
+
+    def append(self, *values):
+        """Append one event, values given in dtype field order"""
+        i = self.fill
+        for column, value in zip(self.current, values):
+            column[i] = value
+        self.fill += 1
+        if self.fill == self.chunk_size:
+            self._seal()
+
+    def extend(self, records):
+        """Append a batch, e.g. a structured array decoded from a BPF buffer"""
+        n = len(records)
+        start = 0
+        while start < n:
+            take = min(self.chunk_size - self.fill, n - start)
+            for name, column in zip(self.names, self.current):
+                column[self.fill:self.fill + take] = records[name][start:start + take]
+            self.fill += take
+            start += take
+            if self.fill == self.chunk_size:
+                self._seal()
+
+    def columns(self):
+        """Contiguous arrays per column, chunks are merged once and kept merged
+
+        When spilling, only the rows not yet handed to the writer are returned.
+        """
+        if self.spill is not None:
+            return {name: column[:self.fill]
+                    for name, column in zip(self.names, self.current)}
+        if self.fill == 0 and self.sealed_rows == 0:
+            return {name: np.empty(0, dtype=self.dtype[name]) for name in self.names}
+        if self.sealed_rows == 0:
+            return {name: column[:self.fill]
+                    for name, column in zip(self.names, self.current)}
+
+        merged = {}
+        for name, column in zip(self.names, self.current):
+            merged[name] = np.concatenate(self.sealed[name] + [column[:self.fill]])
+        # Keep the merged arrays as a single sealed chunk so the data is not held twice
+        for name in self.names:
+            self.sealed[name] = [merged[name]]
+        self.sealed_rows = len(self)
+        self._new_chunk()
+        return merged
+
+    def to_frame(self):
+        """DataFrame that wraps the column arrays without copying them"""
+        return pd.DataFrame(self.columns(), copy=False)
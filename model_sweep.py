@@ -0,0 +1,116 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression, Ridge, Lasso
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+
+from window_dataset import WindowDataset
+
+# Same models and settings as the notebook's evaluate()
+MODELS = {
+    'Linear Regression': lambda: LinearRegression(),
+    'Ridge': lambda: Ridge(alpha=1.0),
+    'Lasso': lambda: Lasso(alpha=1.0),
+    'Random Forest': lambda: RandomForestRegressor(n_estimators=100, random_state=42),
+    'Gradient Boosting': lambda: GradientBoostingRegressor(n_estimators=100, random_state=42),
+}
+
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+
+def prepare_inputs(captures, window_sizes, work_dir):
+    """Write each capture's feature matrix and timestamps once as .npy files
+
+    Workers memory-map these instead of receiving pickled arrays, and every
+    window size of a capture shares the same base matrix.
+    """
+    inputs = {}
+    for capture, source in captures.items():
+        base_path = os.path.join(work_dir, f"{capture}_base.npy")
+        ts_path = os.path.join(work_dir, f"{capture}_timestamps.npy")
+        if isinstance(source, str):
+            dataset = WindowDataset.from_dataset(source, out=base_path)
+        else:
+            dataset = WindowDataset.from_frame(source, out=base_path)
+        dataset.base.flush()
+        np.save(ts_path, dataset.timestamps)
+        pids_path = None
+        if dataset.pids is not None:
+            pids_path = os.path.join(work_dir, f"{capture}_pids.npy")
+            np.save(pids_path, dataset.pids)
+        for window_size in window_sizes:
+            inputs[(capture, window_size)] = (base_path, ts_path, pids_path)
+    return inputs
+
+
+def _run_job(model_name, capture, window_size, base_path, ts_path, pids_path=None):
+    base = np.load(base_path, mmap_mode='r')
+    timestamps = np.load(ts_path, mmap_mode='r')
+    pids = np.load(pids_path) if pids_path else None
+    dataset = WindowDataset(base, timestamps, window_size, pids)
+    y = dataset.y
+
+    # Split indices rather than arrays so only the rows used are copied out of the mmap
+    train_idx, test_idx = train_test_split(np.arange(len(dataset)), test_size=TEST_SIZE,
+                                           random_state=RANDOM_STATE)
+    X_train, X_test = dataset.take(train_idx), dataset.take(test_idx)
+    y_train, y_test = y[train_idx], y[test_idx]
+
+    baseline_rmse = np.sqrt(mean_squared_error(y_test, np.full_like(y_test, y_train.mean())))
+
+    model = MODELS[model_name]()
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_time = time.perf_counter() - start
+
+    rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+    return {
+        'capture': capture,
+        'window_size': window_size,
+        'model': model_name,
+        'n_train': len(train_idx),
+        'n_test': len(test_idx),
+        'baseline_rmse': baseline_rmse,
+        'rmse': rmse,
+        'improvement_pct': (baseline_rmse - rmse) / baseline_rmse * 100,
+        'fit_time_s': fit_time,
+        'predict_us_per_sample': predict_time / len(test_idx) * 1e6,
+    }
+
+
+def run_sweep(captures, window_sizes=(3,), models=None, max_workers=None, work_dir=None):
+    """Fit every (model, capture, window_size) combination across a process pool
+
+    captures maps a name to a DataFrame or a spilled capture directory.
+    Returns one results row per job.
+    """
+    models = list(models or MODELS)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        inputs = prepare_inputs(captures, window_sizes, tmp)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_run_job, model_name, capture, window_size, *paths)
+                       for (capture, window_size), paths in inputs.items()
+                       for model_name in models]
+            rows = [future.result() for future in futures]
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    from captures import load_capture
+
+    results = run_sweep({name: load_capture(f"{name}.csv")
+                         for name in ['only_pfs', 'only_pfs2', 'only_pfs3']},
+                        window_sizes=[3, 5, 10])
+    results.to_csv('model_sweep_results.csv', index=False)
+    print(results.to_string(index=False))
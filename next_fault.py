@@ -1,51 +1,66 @@
 import pandas as pd
 import numpy as np
 
-df = pd.read_csv('only_pfs.csv')
+from captures import load_capture
+from fault_sampling import sample_weights
 
 def create_ml_dataset(df, window_size=4):
-    features = []
-    targets = []
-    
-    for i in range(window_size, len(df)):
-        # Get window of previous faults
-        window = df.iloc[i-window_size:i]
-        
-        # get rel features
-        feature_dict = {
-            f'latency_t-{j+1}': lat 
-            for j, lat in enumerate(reversed(window['fault_latency'].values))
-        }
-        
-        time_gaps = window['timestamp_ns'].diff().values[1:]  # Skip first NaN
-        for j, gap in enumerate(reversed(time_gaps)):
-            feature_dict[f'time_gap_t-{j+1}'] = gap
-            
-        page_distances = window['page_id'].diff().values[1:]  # Skip first NaN
-        for j, dist in enumerate(reversed(page_distances)):
-            feature_dict[f'page_distance_t-{j+1}'] = dist
-            
-        current_time = window['timestamp_ns'].iloc[-1]
-        next_time = df.iloc[i]['timestamp_ns']
-        target = next_time - current_time
-        
-        features.append(feature_dict)
-        targets.append(target)
-    
-    return pd.DataFrame(features), pd.Series(targets)
+    # Captures of several processes get windows per process, none spans two
+    if 'pid' in df.columns and df['pid'].nunique() > 1:
+        parts = [create_ml_dataset(group, window_size) for _, group in df.groupby('pid', sort=False)]
+        return (pd.concat([X for X, _ in parts], ignore_index=True),
+                pd.concat([y for _, y in parts], ignore_index=True))
+
+    # Sample i uses faults i-window_size..i-1, so every feature column is the
+    # base column shifted by a fixed offset; slicing replaces the per-row loop
+    n = len(df)
+    latency = df['fault_latency'].to_numpy()
+    timestamps = df['timestamp_ns'].to_numpy().astype(np.int64)
+    pages = df['page_id'].to_numpy().astype(np.int64)
+
+    # gaps[k] = timestamps[k+1] - timestamps[k], as float like Series.diff()
+    time_gaps = np.diff(timestamps).astype(np.float64)
+    page_distances = np.diff(pages).astype(np.float64)
 
-X, y = create_ml_dataset(df)
+    # A sampled record stands for sample_weight faults, so the gap before it
+    # spans about that many faults; rescale gaps and targets to one fault.
+    # Weights are counted per CPU, so with other processes faulting on the
+    # same CPUs the rescaling is approximate
+    weights = sample_weights(df)
+    sampled = bool(np.any(weights != 1))
+    if sampled:
+        time_gaps /= weights[1:]
+
+    features = {}
+    if n > window_size:
+        for j in range(1, window_size + 1):
+            features[f'latency_t-{j}'] = latency[window_size - j:n - j]
+        for j in range(1, window_size):
+            features[f'time_gap_t-{j}'] = time_gaps[window_size - j - 1:n - j - 1]
+        for j in range(1, window_size):
+            features[f'page_distance_t-{j}'] = page_distances[window_size - j - 1:n - j - 1]
+        targets = timestamps[window_size:] - timestamps[window_size - 1:-1]
+        if sampled:
+            targets = targets / weights[window_size:]
+    else:
+        targets = np.empty(0, dtype=np.int64)
+
+    return pd.DataFrame(features), pd.Series(targets)
 
-X.to_csv('ml_features.csv', index=False)
-pd.DataFrame({'time_to_next_fault': y}).to_csv('ml_targets.csv', index=False)
+if __name__ == '__main__':
+    # Either a capture CSV or a directory of spilled Parquet/Arrow parts
+    df = load_capture('only_pfs.csv')
 
-print(f"X shape: {X.shape}")
-print(f"Y.shape: {y.shape}")
-print("\nFeature columns:")
-print(X.columns.tolist())
-print("\nFeature statistics:")
-print(X.describe())
-print("\nTarget statistics:")
-print(y.describe())
+    X, y = create_ml_dataset(df)
 
+    X.to_csv('ml_features.csv', index=False)
+    pd.DataFrame({'time_to_next_fault': y}).to_csv('ml_targets.csv', index=False)
 
+    print(f"X shape: {X.shape}")
+    print(f"Y.shape: {y.shape}")
+    print("\nFeature columns:")
+    print(X.columns.tolist())
+    print("\nFeature statistics:")
+    print(X.describe())
+    print("\nTarget statistics:")
+    print(y.describe())
@@ -0,0 +1,218 @@
+import pickle
+import subprocess
+import time
+
+import numpy as np
+
+from captures import load_capture
+from fault_store import ColumnarBuffer
+
+WINDOW_SIZE = 4        # Faults per window, as in next_fault.create_ml_dataset
+REPLAY_FILE = None     # Capture to replay instead of attaching to the kernel
+MODEL_FILE = None      # Pickled {'time': model, 'page': model} trained offline
+WORKLOAD = ["python3", "workloadr.py"]
+LATENCY_SAMPLES = 1 << 16  # Most recent predict latencies kept for percentiles
+
+PREDICTION_DTYPE = np.dtype([
+    ('pid', np.uint32),
+    ('timestamp_ns', np.uint64),
+    ('page_id', np.uint64),
+    ('predicted_time_ns', np.float64),
+    ('predicted_page_id', np.float64),
+])
+
+
+class LinearScorer:
+    """Preloaded linear model, scored with one dot product instead of model.predict"""
+
+    def __init__(self, coef, intercept=0.0):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(np.ravel(model.coef_), np.ravel([model.intercept_])[0])
+
+    def predict(self, x):
+        return self.coef @ x + self.intercept
+
+    def update(self, x, target):
+        pass
+
+
+class OnlineLinearModel(LinearScorer):
+    """Linear model fitted on the fly with normalized LMS, no offline training needed"""
+
+    def __init__(self, n_features, step=0.5, eps=1.0):
+        super().__init__(np.zeros(n_features))
+        self.step = step
+        self.eps = eps
+
+    def update(self, x, target):
+        error = target - self.predict(x)
+        # Normalizing by |x|^2 (plus the bias input) keeps the step stable
+        # for ns-scale features
+        scale = self.step * error / (self.eps + x @ x + 1.0)
+        self.coef += scale * x
+        self.intercept += scale
+
+
+class ModelScorer:
+    """Fallback for non-linear models, goes through sklearn's predict per fault"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, x):
+        return float(self.model.predict(x[None, :])[0])
+
+    def update(self, x, target):
+        pass
+
+
+def make_scorer(model):
+    if hasattr(model, 'coef_'):
+        return LinearScorer.from_model(model)
+    return ModelScorer(model)
+
+
+class PidWindow:
+    """Last window_size faults of one process, kept as a ready-made feature vector
+
+    The layout matches next_fault.create_ml_dataset's columns: latency_t-1..w,
+    then time_gap_t-1..w-1, then page_distance_t-1..w-1.
+    """
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self.x = np.zeros(3 * window_size - 2)
+        self.seen = 0
+        self.last_ts = 0
+        self.last_page = 0
+
+    def push(self, timestamp_ns, page_id, latency):
+        w = self.window_size
+        x = self.x
+        x[1:w] = x[0:w - 1]
+        x[0] = latency
+        if self.seen > 0 and w > 1:
+            x[w + 1:2 * w - 1] = x[w:2 * w - 2]
+            x[w] = timestamp_ns - self.last_ts
+            x[2 * w:] = x[2 * w - 1:-1]
+            x[2 * w - 1] = page_id - self.last_page
+        self.last_ts = timestamp_ns
+        self.last_page = page_id
+        self.seen += 1
+
+    def ready(self):
+        return self.seen >= self.window_size
+
+
+class OnlinePredictor:
+    """Per-PID rolling windows that predict the next fault's time and page"""
+
+    def __init__(self, window_size=WINDOW_SIZE, time_model=None, page_model=None):
+        n_features = 3 * window_size - 2
+        self.window_size = window_size
+        self.time_model = time_model or OnlineLinearModel(n_features)
+        self.page_model = page_model or OnlineLinearModel(n_features)
+        self.windows = {}
+        self.predictions = ColumnarBuffer(PREDICTION_DTYPE)
+        self.latencies = np.zeros(LATENCY_SAMPLES, dtype=np.int64)
+        self.n_scored = 0
+
+    def on_fault(self, pid, timestamp_ns, page_id, latency=0):
+        window = self.windows.get(pid)
+        if window is None:
+            window = self.windows[pid] = PidWindow(self.window_size)
+
+        # The features from the previous fault now have their true targets
+        if window.ready():
+            self.time_model.update(window.x, timestamp_ns - window.last_ts)
+            self.page_model.update(window.x, page_id - window.last_page)
+
+        window.push(timestamp_ns, page_id, latency)
+        if not window.ready():
+            return None
+
+        start = time.perf_counter_ns()
+        predicted_time = window.last_ts + self.time_model.predict(window.x)
+        predicted_page = window.last_page + self.page_model.predict(window.x)
+        self.latencies[self.n_scored % LATENCY_SAMPLES] = time.perf_counter_ns() - start
+        self.n_scored += 1
+
+        self.predictions.append(pid, timestamp_ns, page_id, predicted_time, predicted_page)
+        return predicted_time, predicted_page
+
+    def latency_summary(self):
+        """p50/p99 of the predict step in microseconds over the recent faults"""
+        samples = self.latencies[:min(self.n_scored, LATENCY_SAMPLES)]
+        if len(samples) == 0:
+            return {'p50_us': 0.0, 'p99_us': 0.0, 'scored': 0}
+        p50, p99 = np.percentile(samples, [50, 99]) / 1e3
+        return {'p50_us': p50, 'p99_us': p99, 'scored': self.n_scored}
+
+
+def load_models(path):
+    with open(path, 'rb') as f:
+        models = pickle.load(f)
+    return make_scorer(models['time']), make_scorer(models['page'])
+
+
+def replay_capture(predictor, path):
+    """Feed a recorded capture through the predictor, no kernel access needed"""
+    df = load_capture(path)
+    pids = df['pid'].to_numpy().tolist()
+    timestamps = df['timestamp_ns'].to_numpy().astype(np.int64).tolist()
+    pages = df['page_id'].to_numpy().astype(np.int64).tolist()
+    if 'fault_latency' in df.columns:
+        latencies = df['fault_latency'].fillna(0).to_numpy().tolist()
+    else:
+        latencies = [0] * len(df)
+    for pid, ts, page, latency in zip(pids, timestamps, pages, latencies):
+        predictor.on_fault(pid, ts, page, latency)
+    return predictor.predictions.to_frame()
+
+
+def run_live(predictor):
+    """Score faults of WORKLOAD as page_trace_5's probe reports them"""
+    from bcc import BPF
+    from fault_probe import FAULT_PROBE, probe_cflags
+    from probe_backend import select_backend
+    from trace_scope import TraceScope
+
+    # fexit where available, else kprobes, both pair entry and return so
+    # the windows get real fault latencies
+    scope = TraceScope('tree')
+    b = BPF(text=FAULT_PROBE, cflags=probe_cflags('ringbuf', scope=scope,
+                                                  backend=select_backend('fexit', paired=True)))
+
+    def handle_event(ctx, data, size):
+        event = b["events"].event(data)
+        predictor.on_fault(event.pid, event.timestamp_ns, event.page_id, event.fault_latency)
+
+    b["events"].open_ring_buffer(handle_event)
+
+    workload_process = subprocess.Popen(WORKLOAD)
+    scope.add_pid(b, workload_process.pid)
+    print(f"Predicting page faults for PID: {workload_process.pid}")
+
+    while workload_process.poll() is None:
+        b.ring_buffer_poll(100)
+    b.ring_buffer_consume()
+    return predictor.predictions.to_frame()
+
+
+if __name__ == '__main__':
+    time_model, page_model = load_models(MODEL_FILE) if MODEL_FILE else (None, None)
+    predictor = OnlinePredictor(WINDOW_SIZE, time_model, page_model)
+
+    if REPLAY_FILE:
+        predictions = replay_capture(predictor, REPLAY_FILE)
+    else:
+        predictions = run_live(predictor)
+
+    predictions.to_csv('online_predictions.csv', index=False)
+    summary = predictor.latency_summary()
+    print(f"Scored {summary['scored']} faults")
+    print(f"Predict latency p50: {summary['p50_us']:.2f} us, p99: {summary['p99_us']:.2f} us")
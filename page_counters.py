@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+
+def first_seen_rows(pages):
+    """Unique pages in order of first appearance, and the row of every input page"""
+    uniq, first, inverse = np.unique(pages, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return uniq[order], rank[inverse.ravel()]
+
+
+class PageCounterTable:
+    """Sparse per-page event counters: one int64 row per distinct page
+
+    pages holds the page numbers in order of first appearance and counts
+    the matching rows, one column per event. Rows only exist for pages that
+    were seen, so memory grows with distinct pages, not with the address
+    range.
+    """
+
+    def __init__(self, columns, pages=None, counts=None):
+        self.columns = list(columns)
+        self.pages = np.empty(0, dtype=np.int64) if pages is None else np.asarray(pages, dtype=np.int64)
+        self.counts = (np.zeros((0, len(self.columns)), dtype=np.int64) if counts is None
+                       else np.asarray(counts, dtype=np.int64))
+
+    @classmethod
+    def from_samples(cls, columns, pages, column_idx, counts=None):
+        """Sum per-sample counts (1 each by default) into their page's row
+
+        column_idx gives each sample's column. Samples with column -1 still
+        create their page's row but add nothing.
+        """
+        pages = np.asarray(pages, dtype=np.int64)
+        column_idx = np.asarray(column_idx, dtype=np.int64)
+        counts = np.ones(len(pages), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        ordered, rows = first_seen_rows(pages)
+        table = np.zeros((len(ordered), len(columns)), dtype=np.int64)
+        valid = column_idx >= 0
+        np.add.at(table, (rows[valid], column_idx[valid]), counts[valid])
+        return cls(columns, ordered, table)
+
+    @classmethod
+    def merge(cls, tables):
+        """Fold partial tables, e.g. from parallel workers, in the order given
+
+        Rows keep the order in which pages first appear across the tables.
+        """
+        tables = list(tables)
+        columns = tables[0].columns
+        if any(table.columns != columns for table in tables):
+            raise ValueError("Cannot merge counter tables with different columns")
+        pages = np.concatenate([table.pages for table in tables])
+        ordered, rows = first_seen_rows(pages)
+        table = np.zeros((len(ordered), len(columns)), dtype=np.int64)
+        np.add.at(table, rows, np.concatenate([table.counts for table in tables]))
+        return cls(columns, ordered, table)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def to_frame(self, index_name='page'):
+        df = pd.DataFrame(self.counts, index=self.pages, columns=self.columns, copy=False)
+        df.index.name = index_name
+        return df
@@ -0,0 +1,103 @@
+import re
+
+import numpy as np
+
+BASE_SHIFT = 12  # page_id is always address >> 12, whatever the mapping size
+
+# Granularities every capture is keyed at, name -> page shift
+GRANULARITIES = {
+    '4k': 12,
+    '64k': 16,
+    '2m': 21,
+}
+
+THP_ENABLED = '/sys/kernel/mm/transparent_hugepage/enabled'
+MEMINFO = '/proc/meminfo'
+
+# Prepended to the collectors' BPF programs. fault_page_shift() estimates
+# the shift of the page the kernel maps for a fault: the hugetlb page size
+# for hugetlb VMAs, 2M where THP can back the aligned 2M range of an
+# anonymous VMA, 4K otherwise. THP eligibility is judged from the VMA flags
+# and the system-wide THP mode passed in through granularity_cflags(). It
+# is a guess made before the fault is handled: a THP allocation can fail
+# and fall back to 4K, and khugepaged can collapse 4K pages into 2M later.
+PAGE_SHIFT_HELPER = """
+#include <linux/mm.h>
+
+#ifndef HUGETLB_SHIFT
+#define HUGETLB_SHIFT 21
+#endif
+#define PF_VM_HUGETLB   0x00400000
+#define PF_VM_HUGEPAGE  0x20000000
+#define PF_VM_NOHUGEPAGE 0x40000000
+#define PF_PMD_SHIFT 21
+
+static inline u32 fault_page_shift(struct vm_area_struct *vma, unsigned long address) {
+    u64 vm_flags = vma->vm_flags;
+    if (vm_flags & PF_VM_HUGETLB) {
+        return HUGETLB_SHIFT;
+    }
+    if ((vm_flags & PF_VM_NOHUGEPAGE) || vma->vm_file) {
+        return 12;
+    }
+#ifndef THP_ALWAYS
+    if (!(vm_flags & PF_VM_HUGEPAGE)) {
+        return 12;
+    }
+#endif
+    u64 huge_start = address & ~((1ULL << PF_PMD_SHIFT) - 1);
+    if (huge_start >= vma->vm_start && huge_start + (1ULL << PF_PMD_SHIFT) <= vma->vm_end) {
+        return PF_PMD_SHIFT;
+    }
+    return 12;
+}
+"""
+
+
+def thp_mode(path=THP_ENABLED):
+    """Active transparent hugepage mode: 'always', 'madvise' or 'never'"""
+    try:
+        with open(path, 'r') as f:
+            match = re.search(r'\[(\w+)\]', f.read())
+    except OSError:
+        return 'never'
+    return match.group(1) if match else 'never'
+
+
+def hugetlb_shift(path=MEMINFO):
+    """Shift of the default hugetlb page size, 21 (2M) when it cannot be read"""
+    try:
+        with open(path, 'r') as f:
+            match = re.search(r'Hugepagesize:\s+(\d+) kB', f.read())
+    except OSError:
+        return 21
+    return int(match.group(1)).bit_length() - 1 + 10 if match else 21
+
+
+def granularity_cflags():
+    """Compiler flags describing this system's huge page setup to PAGE_SHIFT_HELPER"""
+    cflags = [f'-DHUGETLB_SHIFT={hugetlb_shift()}']
+    if thp_mode() == 'always':
+        cflags.append('-DTHP_ALWAYS')
+    return cflags
+
+
+def add_granularity_columns(df, page_column='page_id', shift_column='page_shift'):
+    """Key every fault at each of GRANULARITIES and at its estimated mapping size
+
+    Adds page_<name> for every granularity, mapping_page_id (the page
+    fault_page_shift() expects the kernel to map) and mapping_size in
+    bytes. Captures recorded before page_shift existed are treated as 4K
+    mappings.
+    """
+    page_ids = df[page_column].to_numpy().astype(np.uint64)
+    for name, shift in GRANULARITIES.items():
+        df[f'page_{name}'] = page_ids >> np.uint64(shift - BASE_SHIFT)
+    if shift_column in df.columns:
+        shifts = df[shift_column].to_numpy().astype(np.uint64)
+        shifts = np.maximum(shifts, np.uint64(BASE_SHIFT))
+    else:
+        shifts = np.full(len(df), BASE_SHIFT, dtype=np.uint64)
+    df['mapping_page_id'] = page_ids >> (shifts - np.uint64(BASE_SHIFT))
+    df['mapping_size'] = np.uint64(1) << shifts
+    return df
@@ -0,0 +1,236 @@
+from collections import OrderedDict
+
+import numpy as np
+
+PAGE_HISTORY_PAGES = 1 << 20  # Pages tracked before the least recently faulted is evicted
+PAGE_GAPS = 4                 # Inter-fault gaps kept per page, newest first
+
+
+def page_record_dtype(gaps=PAGE_GAPS):
+    """One page's record as PageHistory.get() returns it, gaps newest first"""
+    return np.dtype([
+        ('page_id', np.uint64),
+        ('count', np.int64),      # Faults, weighted by sample_weight
+        ('first_ns', np.uint64),
+        ('last_ns', np.uint64),
+        ('reads', np.int64),
+        ('writes', np.int64),
+        ('gaps', np.int64, (gaps,)),  # 0-padded past the gaps seen so far
+    ])
+
+
+PAGE_RECORD_DTYPE = page_record_dtype()
+
+
+class PageHistory:
+    """page_id -> fault count, first/last fault time, reads/writes and recent gaps
+
+    Records live in fixed-size NumPy columns, one row per page, and a hash
+    maps page_id to its row in least recently faulted order. A new page
+    past capacity evicts the least recently faulted one, and with max_age_ns
+    pages that have not faulted for that long are evicted as well, so
+    memory stays at capacity rows whatever the trace touches. An evicted
+    page that faults again starts a new record.
+    """
+
+    def __init__(self, capacity=PAGE_HISTORY_PAGES, gaps=PAGE_GAPS, max_age_ns=None):
+        self.capacity = capacity
+        self.max_age_ns = max_age_ns
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.first_ns = np.zeros(capacity, dtype=np.uint64)
+        self.last_ns = np.zeros(capacity, dtype=np.uint64)
+        self.reads = np.zeros(capacity, dtype=np.int64)
+        self.writes = np.zeros(capacity, dtype=np.int64)
+        self.gaps = np.zeros((capacity, gaps), dtype=np.int64)  # Ring, see gap_fill
+        self.gap_fill = np.zeros(capacity, dtype=np.int64)       # Gaps ever recorded
+        self.rows = OrderedDict()  # page_id -> row, least recently faulted first
+        self.free = []
+        self.used = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, page_id):
+        return page_id in self.rows
+
+    def _expire(self, now_ns):
+        while self.rows:
+            row = next(iter(self.rows.values()))
+            if now_ns - int(self.last_ns[row]) <= self.max_age_ns:
+                break
+            self._evict()
+
+    def _evict(self):
+        _, row = self.rows.popitem(last=False)
+        self.free.append(row)
+        self.evicted += 1
+
+    def _allocate(self, page_id, timestamp_ns):
+        if self.free:
+            row = self.free.pop()
+        elif self.used < self.capacity:
+            row = self.used
+            self.used += 1
+        else:
+            self._evict()
+            row = self.free.pop()
+        self.count[row] = 0
+        self.first_ns[row] = timestamp_ns
+        self.reads[row] = 0
+        self.writes[row] = 0
+        self.gap_fill[row] = 0
+        self.rows[page_id] = row
+        return row
+
+    def _push_gap(self, row, gap):
+        self.gaps[row, self.gap_fill[row] % self.gaps.shape[1]] = gap
+        self.gap_fill[row] += 1
+
+    def record(self, page_id, timestamp_ns, is_write=False, weight=1):
+        """Account one fault, returns (gap, count, reads, writes) after it
+
+        gap is the ns since the page last faulted, 0 on its first fault.
+        """
+        if self.max_age_ns is not None:
+            self._expire(timestamp_ns)
+        row = self.rows.get(page_id)
+        if row is None:
+            row = self._allocate(page_id, timestamp_ns)
+            gap = 0
+        else:
+            self.rows.move_to_end(page_id)
+            gap = timestamp_ns - int(self.last_ns[row])
+            self._push_gap(row, gap)
+        self.last_ns[row] = timestamp_ns
+        count = int(self.count[row]) + weight
+        self.count[row] = count
+        if is_write:
+            writes = int(self.writes[row]) + weight
+            self.writes[row] = writes
+            return gap, count, int(self.reads[row]), writes
+        reads = int(self.reads[row]) + weight
+        self.reads[row] = reads
+        return gap, count, reads, int(self.writes[row])
+
+    def record_batch(self, page_ids, timestamps_ns, is_write=None, weights=None):
+        """Account faults in timestamp order at once, returns each one's gap
+
+        Gaps and per-page totals within the batch are computed vectorized,
+        then folded into the index one page at a time. Eviction only
+        happens between pages being folded in, so the batch's own gaps are
+        exact however many pages it touches.
+        """
+        page_ids = np.asarray(page_ids, dtype=np.uint64)
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        n = len(page_ids)
+        weights = np.ones(n, dtype=np.int64) if weights is None \
+            else np.asarray(weights, dtype=np.int64)
+        writes = np.zeros(n, dtype=bool) if is_write is None \
+            else np.asarray(is_write).astype(bool)
+        gaps = np.zeros(n, dtype=np.int64)
+        if n == 0:
+            return gaps
+
+        # Group each page's faults together, in time order within the page
+        order = np.argsort(page_ids, kind='stable')
+        pages = page_ids[order]
+        times = timestamps_ns[order]
+        starts = np.flatnonzero(np.r_[True, pages[1:] != pages[:-1]])
+        ends = np.r_[starts[1:], n]
+        sorted_gaps = np.r_[0, np.diff(times)]
+        sorted_gaps[starts] = 0
+        counts = np.add.reduceat(weights[order], starts)
+        write_counts = np.add.reduceat(weights[order] * writes[order], starts)
+
+        # Fold pages in by their last fault so the hash stays in LRU order
+        for k in np.argsort(times[ends - 1], kind='stable').tolist():
+            start, end = int(starts[k]), int(ends[k])
+            page_id = int(pages[start])
+            if self.max_age_ns is not None:
+                self._expire(int(times[start]))
+            row = self.rows.get(page_id)
+            if row is None:
+                row = self._allocate(page_id, int(times[start]))
+            else:
+                self.rows.move_to_end(page_id)
+                sorted_gaps[start] = int(times[start]) - int(self.last_ns[row])
+                self._push_gap(row, int(sorted_gaps[start]))
+            # Only the newest gaps fit, the ring skips over the rest
+            kept = max(start + 1, end - self.gaps.shape[1])
+            self.gap_fill[row] += kept - start - 1
+            for gap in sorted_gaps[kept:end].tolist():
+                self._push_gap(row, gap)
+            self.last_ns[row] = int(times[end - 1])
+            self.count[row] += counts[k]
+            self.writes[row] += write_counts[k]
+            self.reads[row] += counts[k] - write_counts[k]
+
+        gaps[order] = sorted_gaps
+        return gaps
+
+    def last_fault(self, page_id):
+        """ns timestamp of the page's last fault, None if it is not tracked"""
+        row = self.rows.get(page_id)
+        return None if row is None else int(self.last_ns[row])
+
+    def _recent_gaps(self, rows):
+        """Gaps of rows newest first, 0-padded past the gaps each has seen"""
+        size = self.gaps.shape[1]
+        fill = self.gap_fill[rows][:, None]
+        age = np.arange(size)
+        recent = self.gaps[rows[:, None], (fill - 1 - age) % size]
+        return np.where(age < fill, recent, 0)
+
+    def last_gaps(self, page_id):
+        """The page's most recent inter-fault gaps, newest first"""
+        row = self.rows.get(page_id)
+        if row is None:
+            return np.empty(0, dtype=np.int64)
+        return self._recent_gaps(np.array([row]))[0, :min(int(self.gap_fill[row]),
+                                                          self.gaps.shape[1])]
+
+    def to_records(self, page_ids=None):
+        """Records of page_ids, or of every tracked page least recently faulted first"""
+        if page_ids is None:
+            page_ids = list(self.rows)
+        page_ids = [page_id for page_id in page_ids if page_id in self.rows]
+        rows = np.fromiter((self.rows[page_id] for page_id in page_ids), dtype=np.int64,
+                           count=len(page_ids))
+        records = np.zeros(len(rows), dtype=page_record_dtype(self.gaps.shape[1]))
+        records['page_id'] = page_ids
+        for name in ('count', 'first_ns', 'last_ns', 'reads', 'writes'):
+            records[name] = getattr(self, name)[rows]
+        records['gaps'] = self._recent_gaps(rows)
+        return records
+
+    def get(self, page_id):
+        """The page's record, None if it is not tracked"""
+        records = self.to_records([page_id])
+        return records[0] if len(records) else None
+
+
+def page_fault_gaps(df):
+    """ns since each fault's page last faulted, 0 on a page's first fault
+
+    Only the gaps are needed, so this is a grouped diff over the whole
+    capture rather than a PageHistory, and nothing is evicted. Pages of
+    different processes are unrelated, so gaps are per (pid, page_id).
+    Faults must be in timestamp order.
+    """
+    page_ids = df['page_id'].to_numpy().astype(np.uint64)
+    timestamps = df['timestamp_ns'].to_numpy().astype(np.int64)
+    gaps = np.zeros(len(df), dtype=np.int64)
+    if len(df) == 0:
+        return gaps
+    # lexsort is stable, so each page's faults stay in time order
+    keys = (page_ids, df['pid'].to_numpy()) if 'pid' in df.columns else (page_ids,)
+    order = np.lexsort(keys)
+    same = np.ones(len(df), dtype=bool)
+    for key in keys:
+        key = key[order]
+        same[1:] &= key[1:] == key[:-1]
+    same[0] = False
+    sorted_gaps = np.r_[0, np.diff(timestamps[order])]
+    gaps[order] = np.where(same, sorted_gaps, 0)
+    return gaps
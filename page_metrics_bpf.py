@@ -4,6 +4,9 @@ from bcc import BPF
 import csv
 import time
 
+from fault_latency import (FAULT_TIMING, fault_outcome, print_latency_summary,
+                           read_latency_histogram, timing_cflags)
+
 # Define eBPF program
 prog = """
 #include <uapi/linux/ptrace.h>
@@ -16,40 +19,56 @@ struct page_access {
     u64 addr;
     u32 access_type; // 0: Read, 1: Write
     u64 timestamp;
+    u64 latency_ns;  // handle_mm_fault entry to return
+    u32 vm_fault;    // VM_FAULT_* code it returned
 };
 
+// Faults still being handled, keyed by thread
+BPF_HASH(pending_access, u64, struct page_access);
+
 // BPF hash map to store page access counts
 BPF_HASH(page_access_map, u64, struct page_access);
 
 // kprobe to track page accesses
-int kprobe_handle_mm_fault(struct pt_regs *ctx, struct mm_struct *mm, unsigned long address, unsigned int flags, unsigned int type) {
+int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma, unsigned long address, unsigned int flags) {
     u64 pid_tid = bpf_get_current_pid_tgid();
     
     struct page_access pa = {};
     pa.pid = pid_tid >> 32;
     pa.tid = pid_tid;
     pa.addr = address;
-    pa.access_type = (type & VM_WRITE) ? 1 : 0; // Determine write or read
+    pa.access_type = (vma->vm_flags & VM_WRITE) ? 1 : 0; // Determine write or read
     pa.timestamp = bpf_ktime_get_ns();
     
-    page_access_map.update(&pid_tid, &pa);
+    pending_access.update(&pid_tid, &pa);
     
     return 0;
 }
 
-// kretprobe to clean up
-int kretprobe_handle_mm_fault(struct pt_regs *ctx) {
+// kretprobe completes the thread's pending access with its service time
+int kretprobe__handle_mm_fault(struct pt_regs *ctx) {
+    u64 pid_tid = bpf_get_current_pid_tgid();
+    struct page_access *pa = pending_access.lookup(&pid_tid);
+    if (!pa) {
+        return 0;
+    }
+    pa->latency_ns = bpf_ktime_get_ns() - pa->timestamp;
+    pa->vm_fault = PT_REGS_RC(ctx);
+    count_fault_latency(pa->latency_ns);
+    page_access_map.update(&pid_tid, pa);
+    pending_access.delete(&pid_tid);
     return 0;
 }
 """
 
 # Initialize BPF
-b = BPF(text=prog)
+b = BPF(text=FAULT_TIMING + prog, cflags=timing_cflags())
 print("Collecting page access data... Press Ctrl-C to stop.")
 
 # Open CSV file for logging
 with open('page_access_log.csv', 'w', newline='') as csvfile:
-    fieldnames = ['PID', 'TID', 'Page_Number', 'Address', 'Access_Type', 'Timestamp_ns']
+    fieldnames = ['PID', 'TID', 'Page_Number', 'Address', 'Access_Type', 'Timestamp_ns',
+                  'Latency_ns', 'Outcome']
     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
     writer.writeheader()
     
@@ -68,7 +87,9 @@ with open('page_access_log.csv', 'w', newline='') as csvfile:
                     'Page_Number': page_number,
                     'Address': hex(pa.addr),
                     'Access_Type': 'WRITE' if pa.access_type else 'READ',
-                    'Timestamp_ns': pa.timestamp
+                    'Timestamp_ns': pa.timestamp,
+                    'Latency_ns': pa.latency_ns,
+                    'Outcome': fault_outcome([pa.vm_fault])[0]
                 })
                 # Remove the entry after logging
                 b["page_access_map"].delete(key)
@@ -76,3 +97,4 @@ with open('page_access_log.csv', 'w', newline='') as csvfile:
             time.sleep(1)
     except KeyboardInterrupt:
         print("Data collection stopped.")
+        print_latency_summary(read_latency_histogram(b["fault_latency_hist"]))
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+from fault_store import PAGE_STATS_DTYPE
+
+NO_ACCESS = np.iinfo(np.uint64).max
+
+
+class PageStatsTable:
+    """Per-page counters drained in bulk from a per-CPU BPF hash of page_stats_t"""
+
+    def __init__(self, table):
+        self.table = table
+        self.stats = None
+        self.drains = 0
+
+    def _read_and_delete(self):
+        try:
+            return list(self.table.items_lookup_and_delete_batch())
+        except Exception:
+            # Kernels before 5.6 lack batch ops, updates between the read and
+            # the delete of a key are lost on this path
+            items = list(self.table.items())
+            for key, _ in items:
+                try:
+                    del self.table[key]
+                except KeyError:
+                    pass
+            return items
+
+    def drain(self):
+        """Move everything the kernel has counted since the last drain into self.stats"""
+        items = self._read_and_delete()
+        self.drains += 1
+        if not items:
+            return 0
+
+        page_ids = np.fromiter((key.value for key, _ in items), dtype=np.uint64, count=len(items))
+        per_cpu = np.frombuffer(b''.join(bytes(value) for _, value in items),
+                                dtype=PAGE_STATS_DTYPE).reshape(len(items), -1)
+
+        # Sum counters over CPUs, first/last only count CPUs that saw the page
+        active = per_cpu['access_freq'] > 0
+        frame = pd.DataFrame({
+            'page_id': page_ids,
+            'access_frequency': per_cpu['access_freq'].sum(axis=1),
+            'read_count': per_cpu['read_count'].sum(axis=1),
+            'write_count': per_cpu['write_count'].sum(axis=1),
+            'first_access_time_ns': np.where(active, per_cpu['first_access_ns'], NO_ACCESS).min(axis=1),
+            'last_access_time_ns': per_cpu['last_access_ns'].max(axis=1),
+            'page_shift': per_cpu['page_shift'].max(axis=1),
+        })
+        self._merge(frame)
+        return len(frame)
+
+    def _merge(self, frame):
+        if self.stats is None:
+            self.stats = frame
+            return
+        # A page drained in several intervals is folded back into one row
+        self.stats = pd.concat([self.stats, frame]).groupby('page_id', as_index=False).agg({
+            'access_frequency': 'sum',
+            'read_count': 'sum',
+            'write_count': 'sum',
+            'first_access_time_ns': 'min',
+            'last_access_time_ns': 'max',
+            'page_shift': 'max',
+        })
+
+    def to_frame(self):
+        """Per-page feature table, one row per page that faulted"""
+        if self.stats is None:
+            return pd.DataFrame(columns=['page_id', 'access_frequency', 'read_count', 'write_count',
+                                         'first_access_time_ns', 'last_access_time_ns',
+                                         'page_shift', 'mean_inter_access_time_ns'])
+        df = self.stats.sort_values('page_id').reset_index(drop=True)
+        span = (df['last_access_time_ns'] - df['first_access_time_ns']).astype(np.float64)
+        repeats = df['access_frequency'].astype(np.float64) - 1
+        df['mean_inter_access_time_ns'] = np.where(repeats > 0, span / repeats.where(repeats > 0, 1), 0)
+        return df
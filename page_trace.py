@@ -5,15 +5,42 @@ import threading
 import subprocess
 import ctypes
 
-bpf_program = """
+from page_granularity import PAGE_SHIFT_HELPER, add_granularity_columns, granularity_cflags
+from page_stats import PageStatsTable
+
+# Aggregation-only mode keeps per-page counters in one per-CPU BPF hash and
+# drains it in bulk every DRAIN_INTERVAL_S instead of emitting every fault
+AGGREGATE_ONLY = False
+DRAIN_INTERVAL_S = 1.0
+# Capacity of the per-page stats hash. Each page costs 48 bytes per possible
+# CPU, 48 MB per CPU when full; entries are only allocated as pages fault
+# (BPF_F_NO_PREALLOC), so an idle or small trace costs next to nothing.
+MAX_PAGES = 1 << 20
+
+bpf_program = PAGE_SHIFT_HELPER + """
 #include <uapi/linux/ptrace.h>
 #include <linux/mm.h>
 
+#ifdef AGGREGATE_ONLY
+// Per-page counters, one copy per CPU so updates need no atomics. Not
+// preallocated, a preallocated per-CPU hash pins MAX_PAGES values per CPU
+struct page_stats_t {
+    u64 access_freq;
+    u64 read_count;
+    u64 write_count;
+    u64 first_access_ns;
+    u64 last_access_ns;
+    u64 page_shift;  // Estimated shift of the page the faults map (12, 21, ...)
+};
+
+BPF_F_TABLE("percpu_hash", u64, struct page_stats_t, page_stats, MAX_PAGES, BPF_F_NO_PREALLOC);
+#else
 // Struct for events
 struct data_t {
     u64 page_id;
     u64 access_time_ns;
     u64 access_type; // 0 for read, 1 for write
+    u64 page_shift;  // Estimated shift of the page the fault maps (12, 21, ...)
 };
 
 // Define perf output
@@ -24,12 +51,36 @@ BPF_HASH(page_access_freq, u64, u64);
 BPF_HASH(page_last_access, u64, u64);
 BPF_HASH(page_read_count, u64, u64);
 BPF_HASH(page_write_count, u64, u64);
-
-// Kprobe for handle_pte_fault (memory access)
-int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
-                            unsigned long address, unsigned int flags) {
-    u64 page_id = address / 4096; // Assuming 4KB pages
+#endif
+
+// Kprobe for handle_pte_fault (memory access), which takes a single
+// struct vm_fault * since 4.11
+int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_fault *vmf) {
+    struct vm_area_struct *vma = vmf->vma;
+    unsigned long address = vmf->address;
+    u64 page_id = address / 4096; // 4KB units, the mapped size is in page_shift
     u64 timestamp = bpf_ktime_get_ns();
+    u64 page_shift = fault_page_shift(vma, address);
+
+#ifdef AGGREGATE_ONLY
+    struct page_stats_t empty = {};
+    struct page_stats_t *stats = page_stats.lookup_or_try_init(&page_id, &empty);
+    if (!stats) {
+        return 0;
+    }
+    if (stats->access_freq == 0) {
+        stats->first_access_ns = timestamp;
+    }
+    stats->access_freq++;
+    stats->last_access_ns = timestamp;
+    stats->page_shift = page_shift;
+    if (vma->vm_flags & 0x2) { // VM_WRITE flag
+        stats->write_count++;
+    } else {
+        stats->read_count++;
+    }
+    return 0;
+#else
     
     // Update access frequency
     u64 *freq = page_access_freq.lookup(&page_id);
@@ -71,17 +122,22 @@ int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.page_id = page_id;
     data.access_time_ns = timestamp;
     data.access_type = access_type;
+    data.page_shift = page_shift;
     events.perf_submit(ctx, &data, sizeof(data));
 
     return 0;
+#endif
 }
 """
 
 # Initialize bpf
-b = BPF(text = bpf_program)
+cflags = [f'-DMAX_PAGES={MAX_PAGES}'] + granularity_cflags()
+if AGGREGATE_ONLY:
+    cflags.append('-DAGGREGATE_ONLY')
+b = BPF(text = bpf_program, cflags=cflags)
 
 columns = ['page_id', 'access_frequency', 'last_access_time_ns', 'read_count', 'write_count', 
-          'inter_access_time_ns', 'access_type', 'page_fault']
+          'inter_access_time_ns', 'access_type', 'page_shift', 'page_fault']
 df = pd.DataFrame(columns=columns)
 
 last_access_dict = {}
@@ -136,18 +192,28 @@ def handle_event(cpu, data, size):
         write_cnt,
         inter_access_time_ns,
         access_type,
+        event.page_shift,
         page_fault
     ]
 
-# Attach event handler
-b["events"].open_perf_buffer(handle_event)
+stop_polling = threading.Event()
+
+if AGGREGATE_ONLY:
+    page_stats = PageStatsTable(b["page_stats"])
+
+    def poll_events():
+        while not stop_polling.wait(DRAIN_INTERVAL_S):
+            page_stats.drain()
+else:
+    # Attach event handler
+    b["events"].open_perf_buffer(handle_event)
 
-def poll_events():
-    while True:
-        try:
-            b.perf_buffer_poll()
-        except KeyboardInterrupt:
-            exit()
+    def poll_events():
+        while not stop_polling.is_set():
+            try:
+                b.perf_buffer_poll(timeout=100)
+            except KeyboardInterrupt:
+                exit()
 
 # Start a thread to read BFS maps
 thread = threading.Thread(target=poll_events)
@@ -163,5 +229,18 @@ subprocess.run(["python3", "workload10.py"])
 
 # Let events be processed
 time.sleep(5)
-df.to_csv('page_fault_dataset.csv', index=False)
-print("Dataset saved to 'page_fault_dataset.csv'")
+stop_polling.set()
+thread.join()
+
+if AGGREGATE_ONLY:
+    page_stats.drain()
+    stats_df = page_stats.to_frame()
+    stats_df['page_fault'] = (stats_df['page_id'] % 10 == 0).astype(int)
+    add_granularity_columns(stats_df)
+    stats_df.to_csv('page_access_stats.csv', index=False)
+    print(f"Drained {len(stats_df)} pages in {page_stats.drains} bulk reads")
+    print("Dataset saved to 'page_access_stats.csv'")
+else:
+    add_granularity_columns(df)
+    df.to_csv('page_fault_dataset.csv', index=False)
+    print("Dataset saved to 'page_fault_dataset.csv'")
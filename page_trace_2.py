@@ -6,7 +6,9 @@ import subprocess
 import ctypes
 import numpy as np
 
-bpf_program = """
+from page_granularity import PAGE_SHIFT_HELPER, add_granularity_columns, granularity_cflags
+
+bpf_program = PAGE_SHIFT_HELPER + """
 #include <uapi/linux/ptrace.h>
 #include <linux/mm.h>
 
@@ -15,6 +17,7 @@ struct data_t {
     u64 fault_time_ns;
     u64 fault_type;     // Read or write fault
     u64 fault_distance; // Distance from last fault (in pages)
+    u64 page_shift;     // Estimated shift of the page the fault maps (12, 21, ...)
 };
 
 BPF_PERF_OUTPUT(events);
@@ -25,8 +28,10 @@ BPF_HASH(last_fault_time, u64, u64);         // Last fault time per page
 BPF_HASH(last_fault_page, u64, u64);         // Last page that faulted
 BPF_HASH(sequential_faults, u64, u64);       // Count of sequential faults per page
 
-int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
-                            unsigned long address, unsigned int flags) {
+// handle_pte_fault() takes a single struct vm_fault * since 4.11
+int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_fault *vmf) {
+    struct vm_area_struct *vma = vmf->vma;
+    unsigned long address = vmf->address;
     u64 page_id = address / 4096;
     u64 timestamp = bpf_ktime_get_ns();
     
@@ -69,6 +74,7 @@ int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.fault_time_ns = timestamp;
     data.fault_type = (vma->vm_flags & 0x2) ? 1 : 0;  // 1 for write, 0 for read
     data.fault_distance = fault_distance;
+    data.page_shift = fault_page_shift(vma, address);
     events.perf_submit(ctx, &data, sizeof(data));
 
     return 0;
@@ -76,11 +82,12 @@ int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
 """
 
 # Initialize BPF
-b = BPF(text=bpf_program)
+b = BPF(text=bpf_program, cflags=granularity_cflags())
 
 # Define columns for fault analysis
 columns = [
     'page_id',
+    'page_shift',
     'fault_count',
     'fault_type',
     'fault_distance',
@@ -124,6 +131,7 @@ def handle_event(cpu, data, size):
     # Add to DataFrame
     df.loc[len(df)] = [
         page_id,
+        event.page_shift,
         fault_count,
         event.fault_type,
         event.fault_distance,
@@ -155,7 +163,8 @@ subprocess.run(["python3", "workload10.py"])
 
 time.sleep(5)
 
-# Save raw data
+# Save raw data, keyed at every page granularity
+add_granularity_columns(df)
 df.to_csv('page_fault_2.csv', index=False)
 
 # Perform statistical analysis
@@ -1,17 +1,34 @@
 from bcc import BPF
-import pandas as pd
 import time
 import threading
 import subprocess
 import ctypes
 import os
 
-# Define page size and shift based on system architecture (typically 4KB pages)
+from fault_sampling import SAMPLING_FILTER, FaultSampler
+from fault_store import ColumnarBuffer, ACCESS_DATA_DTYPE
+from page_granularity import PAGE_SHIFT_HELPER, add_granularity_columns, granularity_cflags
+from page_history import PageHistory
+
+# Base page size and shift, page_id is always in 4 KB units. The size of the
+# page each fault actually maps (THP, hugetlb) is recorded as page_shift.
 PAGE_SIZE = 4096    # 4 KB
 PAGE_SHIFT = 12     # Number of bits to shift for 4 KB pages
 
+# In-kernel sampling, see fault_sampling.FaultSampler. With anything but
+# 'all' each record carries the number of faults it stands for and the
+# per-page counts below add that weight instead of 1.
+SAMPLING = 'all'
+SAMPLE_EVERY_N = 16
+SAMPLE_RATE = 10000
+SAMPLE_BURST = 1000
+
+# Pages whose fault history is kept; past that the least recently faulted
+# page is evicted and starts over if it faults again
+PAGE_HISTORY_PAGES = 1 << 20
+
 # eBPF program to attach to handle_mm_fault and collect comprehensive page fault data
-bpf_program = f"""
+bpf_program = PAGE_SHIFT_HELPER + SAMPLING_FILTER + f"""
 #include <uapi/linux/ptrace.h>
 #include <linux/mm.h>
 #include <linux/sched.h>
@@ -33,6 +50,8 @@ struct data_t {{
     u64 vma_end;
     u32 vma_flags;
     u64 ip; // Instruction pointer
+    u32 page_shift; // Estimated shift of the page the fault maps (12, 21, ...)
+    u32 sample_weight; // Faults this record stands for
 }};
 
 // Perf buffer for events
@@ -47,6 +66,12 @@ int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.pid = bpf_get_current_pid_tgid() >> 32;
     data.tid = bpf_get_current_pid_tgid() & 0xFFFFFFFF;
 
+    // Drop unsampled faults before doing any other work for them
+    data.sample_weight = sample_weight(data.pid, address >> PAGE_SHIFT);
+    if (!data.sample_weight) {{
+        return 0;
+    }}
+
     // Get CPU ID
     data.cpu = bpf_get_smp_processor_id();
 
@@ -67,6 +92,7 @@ int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.vma_start = vma->vm_start;
     data.vma_end = vma->vm_end;
     data.vma_flags = vma->vm_flags;
+    data.page_shift = fault_page_shift(vma, address);
 
     // Get Instruction Pointer (optional, may add overhead)
     data.ip = PT_REGS_IP(ctx);
@@ -79,36 +105,15 @@ int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
 """
 
 # Initialize BPF
-b = BPF(text=bpf_program)
-
-# Define DataFrame columns
-columns = [
-    'pid',
-    'tid',
-    'cpu',
-    'page_id',
-    'access_time_ns',
-    'access_type',
-    'fault_type',
-    'vma_start',
-    'vma_end',
-    'vma_flags',
-    'ip',
-    'inter_access_time_ns',
-    'access_frequency',
-    'read_count',
-    'write_count',
-    'page_fault'
-]
-
-# Initialize a list to store records for efficient accumulation
-df_records = []
-
-# Dictionaries to track additional features
-last_access_dict = {}
-access_freq_map = {}
-read_count_map = {}
-write_count_map = {}
+sampler = FaultSampler(SAMPLING, SAMPLE_EVERY_N, SAMPLE_RATE, SAMPLE_BURST)
+b = BPF(text=bpf_program, cflags=granularity_cflags() + sampler.cflags())
+
+# Columnar store for records, fields follow ACCESS_DATA_DTYPE order:
+# the data_t fields, then the features derived in handle_event
+df_records = ColumnarBuffer(ACCESS_DATA_DTYPE)
+
+# Per-page counts and last fault time behind the derived features
+page_history = PageHistory(PAGE_HISTORY_PAGES)
 
 # Event handler function
 def handle_event(cpu, data, size):
@@ -116,53 +121,39 @@ def handle_event(cpu, data, size):
     page_id = event.page_id
     access_time_ns = event.access_time_ns
     access_type = event.access_type
+    weight = event.sample_weight
 
-    # Update access frequency
-    freq = access_freq_map.get(page_id, 0) + 1
-    access_freq_map[page_id] = freq
-
-    # Update read/write counts
-    if access_type == 0:
-        read_cnt = read_count_map.get(page_id, 0) + 1
-        read_count_map[page_id] = read_cnt
-    else:
-        write_cnt = write_count_map.get(page_id, 0) + 1
-        write_count_map[page_id] = write_cnt
-
-    # Fetch last access time
-    last_time = last_access_dict.get(page_id, access_time_ns)
-
-    # Calculate inter-access time
-    inter_access_time_ns = access_time_ns - last_time if page_id in last_access_dict else 0
-    last_access_dict[page_id] = access_time_ns
+    # Update access frequency and read/write counts, scaled up by the
+    # faults sampling dropped, and get the time since the page's last access
+    inter_access_time_ns, freq, read_cnt, write_cnt = page_history.record(
+        page_id, access_time_ns, access_type, weight)
 
     # Determine if this access causes a fault based on your workload pattern
     # For example, every 10th page access causes a fault
     # Adjust this logic based on your actual workload behavior
     page_fault = 1 if (page_id % 10 == 0 and event.fault_type == 1) else 0
 
-    # Create a record dictionary
-    record = {
-        'pid': event.pid,
-        'tid': event.tid,
-        'cpu': event.cpu,
-        'page_id': page_id,
-        'access_time_ns': access_time_ns,
-        'access_type': access_type,
-        'fault_type': event.fault_type,
-        'vma_start': event.vma_start,
-        'vma_end': event.vma_end,
-        'vma_flags': event.vma_flags,
-        'ip': event.ip,
-        'inter_access_time_ns': inter_access_time_ns,
-        'access_frequency': freq,
-        'read_count': read_count_map.get(page_id, 0),
-        'write_count': write_count_map.get(page_id, 0),
-        'page_fault': page_fault
-    }
-
-    # Append the record to the list
-    df_records.append(record)
+    # Append the record to the column store
+    df_records.append(
+        event.pid,
+        event.tid,
+        event.cpu,
+        page_id,
+        access_time_ns,
+        access_type,
+        event.fault_type,
+        event.vma_start,
+        event.vma_end,
+        event.vma_flags,
+        event.ip,
+        event.page_shift,
+        weight,
+        inter_access_time_ns,
+        freq,
+        read_cnt,
+        write_cnt,
+        page_fault
+    )
 
 # Attach event handler
 b["events"].open_perf_buffer(handle_event)
@@ -198,17 +189,9 @@ subprocess.run(["python3", workload_script])
 # Allow some time for events to be processed after workload completion
 time.sleep(5)
 
-# Convert the list of records to a DataFrame
-try:
-    df = pd.DataFrame(df_records, columns=columns)
-except ValueError as ve:
-    print(f"ValueError while creating DataFrame: {ve}")
-    print("Attempting to find mismatched records...")
-    # Identify records with missing or extra fields
-    for idx, record in enumerate(df_records):
-        if len(record) != len(columns):
-            print(f"Record {idx} has {len(record)} fields: {record}")
-    exit(1)
+# Hand the record columns to pandas without copying them
+df = df_records.to_frame()
+add_granularity_columns(df)
 
 # Save the collected data to a CSV file
 df.to_csv('page_fault_dataset.csv', index=False)
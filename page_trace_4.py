@@ -1,11 +1,20 @@
 from bcc import BPF
-import pandas as pd
 import time
 import threading
 import subprocess
 import ctypes
 
-bpf_program = """
+from fault_latency import (FAULT_TIMING, fault_outcome, print_latency_summary,
+                           read_latency_histogram, timing_cflags)
+from fault_store import ColumnarBuffer, BASIC_FAULT_DATA_DTYPE
+from page_granularity import PAGE_SHIFT_HELPER, add_granularity_columns, granularity_cflags
+from spill_writer import SpillWriter
+
+# Set to a directory to stream Parquet parts there during the capture
+# instead of holding every fault in RAM until exit
+SPILL_DIR = None
+
+bpf_program = PAGE_SHIFT_HELPER + FAULT_TIMING + """
 #include <uapi/linux/ptrace.h>
 #include <linux/mm.h>
 
@@ -15,10 +24,14 @@ struct fault_data_t {
     u64 is_write;          // Was it a write fault?
     u64 distance;          // Distance from last fault (in pages)
     u32 pid;              // Process ID that caused the fault
+    u32 page_shift;       // Estimated shift of the page the fault maps (12, 21, ...)
+    u64 fault_latency;    // ns from handle_mm_fault entry to return
+    u32 vm_fault;         // VM_FAULT_* code it returned
 };
 
 BPF_PERF_OUTPUT(events);
 BPF_HASH(last_fault_page, u32, u64);  // Track last page that faulted per process
+BPF_HASH(pending_fault, u32, struct fault_data_t);  // Fault each thread is in, until it returns
 
 int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
                             unsigned long address, unsigned int flags) {
@@ -28,6 +41,7 @@ int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.timestamp_ns = bpf_ktime_get_ns();
     data.is_write = !!(vma->vm_flags & 0x2);  // Check VM_WRITE flag
     data.pid = bpf_get_current_pid_tgid() >> 32;
+    data.page_shift = fault_page_shift(vma, address);
     
     // Calculate distance from last fault
     u64 *last_page = last_fault_page.lookup(&data.pid);
@@ -38,33 +52,55 @@ int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     // Update last fault page
     last_fault_page.update(&data.pid, &data.page_id);
     
-    events.perf_submit(ctx, &data, sizeof(data));
+    // Submitted by the return probe, once the service time is known
+    u32 tid = bpf_get_current_pid_tgid();
+    pending_fault.update(&tid, &data);
+    return 0;
+}
+
+int kretprobe__handle_mm_fault(struct pt_regs *ctx) {
+    u32 tid = bpf_get_current_pid_tgid();
+    struct fault_data_t *data = pending_fault.lookup(&tid);
+    if (!data) {
+        return 0;
+    }
+    data->fault_latency = bpf_ktime_get_ns() - data->timestamp_ns;
+    data->vm_fault = PT_REGS_RC(ctx);
+    count_fault_latency(data->fault_latency);
+    events.perf_submit(ctx, data, sizeof(*data));
+    pending_fault.delete(&tid);
     return 0;
 }
 """
 
 # Initialize BPF
-b = BPF(text=bpf_program)
+b = BPF(text=bpf_program, cflags=granularity_cflags() + timing_cflags())
 
-# Store fault data
-fault_data = []
+# Store fault data, one NumPy column per fault_data_t field
+spill = SpillWriter(SPILL_DIR, BASIC_FAULT_DATA_DTYPE) if SPILL_DIR else None
+fault_data = ColumnarBuffer(BASIC_FAULT_DATA_DTYPE, spill=spill)
 
 def handle_event(cpu, data, size):
     event = b["events"].event(data)
-    fault_data.append({
-        'page_id': event.page_id,
-        'timestamp_ns': event.timestamp_ns,
-        'is_write': event.is_write,
-        'distance': event.distance,
-        'pid': event.pid
-    })
+    fault_data.append(
+        event.page_id,
+        event.timestamp_ns,
+        event.is_write,
+        event.distance,
+        event.pid,
+        event.page_shift,
+        event.fault_latency,
+        event.vm_fault
+    )
 
 b["events"].open_perf_buffer(handle_event)
 
+stop_polling = threading.Event()
+
 def poll_events():
-    while True:
+    while not stop_polling.is_set():
         try:
-            b.perf_buffer_poll()
+            b.perf_buffer_poll(timeout=100)
         except KeyboardInterrupt:
             exit()
 
@@ -80,15 +116,26 @@ print('Starting workload:')
 subprocess.run(["python3", "workload10.py"])
 
 time.sleep(5)
+stop_polling.set()
+thread.join()
+
+print_latency_summary(read_latency_histogram(b["fault_latency_hist"]))
+
+if spill is not None:
+    fault_data.finish()
+    print(f"Spilled {spill.rows_written} page faults to {SPILL_DIR}/")
+    exit()
 
 # Create DataFrame
-df = pd.DataFrame(fault_data)
+df = fault_data.to_frame()
 
 if len(df) > 0:
     print(f"Length of data frame: {len(df)}")
     # Add derived features
     df['time_since_last_fault'] = df['timestamp_ns'].diff()
     df['is_10th_page'] = (df['page_id'] % 10 == 0).astype(int)
+    df['fault_outcome'] = fault_outcome(df['vm_fault'].to_numpy())
+    add_granularity_columns(df)
     
     # Save dataset
     df.to_csv('only_pfs.csv', index=False)
@@ -98,6 +145,8 @@ if len(df) > 0:
     print(f"Number of 10th page faults: {df['is_10th_page'].sum()}")
     print(f"Average distance between faults: {df['distance'].mean():.2f} pages")
     print(f"Average time between faults: {df['time_since_last_fault'].mean()/1e6:.2f} ms")
+    print(f"Average fault service time: {df['fault_latency'].mean()/1e3:.2f} us")
+    print(df['fault_outcome'].value_counts())
     
     print("\nFeature Statistics:")
     print(df.describe())
@@ -1,11 +1,54 @@
 from bcc import BPF
-import pandas as pd
 import time
 import threading
 import subprocess
-import ctypes
 import os
 
+from captures import add_fault_features
+from fault_capture import CaptureWriter
+from fault_latency import print_latency_summary, read_latency_histogram
+from fault_probe import FAULT_PROBE, probe_cflags
+from fault_sampling import FaultSampler
+from fault_store import ColumnarBuffer, FAULT_DATA_DTYPE
+from probe_backend import PAIRED_BACKENDS, select_backend
+from ringbuf_collector import RingBufferCollector
+from spill_writer import SpillWriter
+from trace_scope import TraceScope
+
+# Collector mode: 'perf' hands every fault to a Python callback through
+# BPF_PERF_OUTPUT, 'ringbuf' drains a BPF ring buffer in batches
+COLLECTOR_MODE = 'ringbuf'
+RINGBUF_PAGES = 256  # Ring buffer size in pages, must be a power of 2
+
+# Which processes to trace: 'tree' follows the workload and everything it
+# forks, 'pids' only the workload plus SCOPE_PIDS, 'cgroup' every process in
+# SCOPE_CGROUP (a cgroup v2 path or id)
+SCOPE = 'tree'
+SCOPE_PIDS = []
+SCOPE_CGROUP = None
+
+# In-kernel sampling for workloads that fault too fast to record every
+# fault: 'all', 'every_n' (1 in SAMPLE_EVERY_N per CPU), 'first_touch' (first
+# fault of each page) or 'token_bucket' (SAMPLE_RATE records/s per CPU,
+# bursts of SAMPLE_BURST). Records carry the weight to rescale counts with.
+SAMPLING = 'all'
+SAMPLE_EVERY_N = 16
+SAMPLE_RATE = 10000
+SAMPLE_BURST = 1000
+
+# How the probe hooks page faults: 'fexit', 'fentry', 'tracepoint' or
+# 'kprobe'. fexit and kprobe also see the return, so they record
+# fault_latency and the VM_FAULT_* code. 'auto' takes fexit where the kernel
+# supports it and kprobes otherwise, a backend the kernel lacks falls back
+# the same way. The tracepoint sees no VMA, see probe_backend.BACKEND_LIMITS.
+PROBE_BACKEND = 'auto'
+
+# Set to a directory to stream Parquet parts there during the capture
+# instead of holding every fault in RAM until exit
+SPILL_DIR = None
+# Or set to a .pfcap path to stream packed fault_data_t records to one binary file
+RAW_CAPTURE = None
+
 # Store the workload PID globally
 WORKLOAD_PID = 0
 
@@ -14,106 +57,63 @@ def get_workload_pid(proc):
     WORKLOAD_PID = proc.pid
     print(f"Workload PID: {WORKLOAD_PID}")
 
-bpf_program = """
-#include <uapi/linux/ptrace.h>
-#include <linux/mm.h>
-
-BPF_HASH(target_pid, u32, u32, 1);
-
-struct fault_data_t {
-    u64 page_id;           
-    u64 timestamp_ns;      
-    u64 is_write;         
-    u64 distance;         
-    u32 pid;              
-    u32 fault_flags;      
-    u64 vm_flags;         
-    u64 fault_count;      
-    u64 vma_start;        
-    u64 vma_end;          
-};
-
-BPF_PERF_OUTPUT(events);
-BPF_HASH(last_fault_page, u32, u64);    
-BPF_HASH(page_fault_count, u64, u64);   
-BPF_HASH(process_fault_count, u32, u64); 
-
-int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
-                            unsigned long address, unsigned int flags) {
-    u32 pid = bpf_get_current_pid_tgid() >> 32;
-    
-    // Look up our target PID
-    u32 key = 0;
-    u32 *workload_pid = target_pid.lookup(&key);
-    if (!workload_pid || pid != *workload_pid) {
-        return 0;
-    }
-    
-    // Only specific user flags
-    if (flags != 629) {
-    return 0;
-    }
-
-    struct fault_data_t data = {};
-    
-    data.page_id = address / 4096;
-    data.timestamp_ns = bpf_ktime_get_ns();
-    data.is_write = !!(vma->vm_flags & 0x2);
-    data.pid = pid;
-    data.fault_flags = flags;
-    data.vm_flags = vma->vm_flags;
-    data.vma_start = vma->vm_start;
-    data.vma_end = vma->vm_end;
-    
-    // Calculate distance from last fault
-    u64 *last_page = last_fault_page.lookup(&pid);
-    if (last_page) {
-        data.distance = data.page_id - *last_page;
-    }
-    last_fault_page.update(&pid, &data.page_id);
-    
-    // Update fault count for this page
-    u64 *count = page_fault_count.lookup(&data.page_id);
-    if (count) {
-        (*count)++;
-    } else {
-        u64 initial = 1;
-        page_fault_count.update(&data.page_id, &initial);
-    }
-    data.fault_count = count ? *count : 1;
-    
-    events.perf_submit(ctx, &data, sizeof(data));
-    return 0;
-}
-"""
 
 # Initialize BPF
-b = BPF(text=bpf_program)
-
-# Store fault data
-fault_data = []
+scope = TraceScope(SCOPE, SCOPE_PIDS, SCOPE_CGROUP)
+sampler = FaultSampler(SAMPLING, SAMPLE_EVERY_N, SAMPLE_RATE, SAMPLE_BURST)
+backend = select_backend(PROBE_BACKEND)
+print(f"Probe backend: {backend}")
+b = BPF(text=FAULT_PROBE, cflags=probe_cflags(COLLECTOR_MODE, RINGBUF_PAGES, scope, sampler,
+                                              backend))
+scope.attach(b)
+
+# Store fault data, one NumPy column per fault_data_t field
+spill = None
+if SPILL_DIR:
+    spill = SpillWriter(SPILL_DIR, FAULT_DATA_DTYPE)
+elif RAW_CAPTURE:
+    spill = CaptureWriter(RAW_CAPTURE, FAULT_DATA_DTYPE, page_size=4096)
+fault_data = ColumnarBuffer(FAULT_DATA_DTYPE, spill=spill)
+perf_lost = 0
 
 def handle_event(cpu, data, size):
     event = b["events"].event(data)
-    fault_data.append({
-        'page_id': event.page_id,
-        'timestamp_ns': event.timestamp_ns,
-        'is_write': event.is_write,
-        'distance': event.distance,
-        'pid': event.pid,
-        'fault_flags': event.fault_flags,
-        'vm_flags': event.vm_flags,
-        'fault_count': event.fault_count,
-        'vma_start': event.vma_start,
-        'vma_end': event.vma_end
-    })
-
-b["events"].open_perf_buffer(handle_event)
+    fault_data.append(
+        event.page_id,
+        event.timestamp_ns,
+        event.is_write,
+        event.distance,
+        event.pid,
+        event.fault_flags,
+        event.vm_flags,
+        event.fault_count,
+        event.vma_start,
+        event.vma_end,
+        event.page_shift,
+        event.sample_weight,
+        event.fault_latency,
+        event.vm_fault
+    )
+
+def handle_lost(lost):
+    global perf_lost
+    perf_lost += lost
+
+collector = None
+if COLLECTOR_MODE == 'ringbuf':
+    collector = RingBufferCollector(b, fault_data)
+else:
+    b["events"].open_perf_buffer(handle_event, lost_cb=handle_lost)
+
+stop_polling = threading.Event()
 
 def poll_events():
-    while True:
+    while not stop_polling.is_set():
         try:
-            b.perf_buffer_poll()
+            if collector is not None:
+                collector.poll(timeout=100)
+            else:
+                b.perf_buffer_poll(timeout=100)
         except KeyboardInterrupt:
             exit()
 
@@ -129,35 +129,64 @@ print('Starting workload...')
 workload_process = subprocess.Popen(["python3", "workloadr.py"]) # changed
 get_workload_pid(workload_process)
 
-# Update the PID in kernel space
-pid_key = ctypes.c_uint(0)
-pid_value = ctypes.c_uint(WORKLOAD_PID)
-b["target_pid"][pid_key] = pid_value
-
-print(f"Tracking page faults for PID: {WORKLOAD_PID}")
+# Add the workload to the in-kernel PID set
+if SCOPE == 'cgroup':
+    print(f"Tracking page faults in cgroup: {SCOPE_CGROUP}")
+else:
+    scope.add_pid(b, WORKLOAD_PID)
+    print(f"Tracking page faults for PID: {WORKLOAD_PID}"
+          + (" and its children" if SCOPE == 'tree' else ""))
 
 # Wait for workload to complete
 workload_process.wait()
 time.sleep(1)  # Give time for last events
+stop_polling.set()
+thread.join()
+
+if collector is not None:
+    collector.drain()
+    lost_events = collector.lost_events()
+else:
+    lost_events = perf_lost
+
+print(f"Lost events: {lost_events}")
+if lost_events:
+    print("WARNING: capture is incomplete, increase RINGBUF_PAGES or the perf buffer size")
+
+# Summarized in the kernel, so it is complete even if events were lost
+if backend in PAIRED_BACKENDS:
+    print_latency_summary(read_latency_histogram(b["fault_latency_hist"]))
+
+if spill is not None:
+    if RAW_CAPTURE and not SPILL_DIR:
+        spill.pid = WORKLOAD_PID
+    fault_data.finish()
+    print(f"\nSpilled {spill.rows_written} page faults to {SPILL_DIR or RAW_CAPTURE}")
+    print("Derived features are added when it is read with captures.load_capture")
+    exit()
 
 # Create DataFrame
-df = pd.DataFrame(fault_data)
+df = fault_data.to_frame()
 
 if len(df) > 0:
     print(f"\nCollected {len(df)} page faults")
+    if SAMPLING in ('every_n', 'token_bucket'):
+        print(f"Sampled ({SAMPLING}), standing for about {int(df['sample_weight'].sum())} faults")
+    elif SAMPLING == 'first_touch':
+        print("Sampled (first_touch), repeat faults of a page were not counted")
     print("\nUnique fault flags seen:")
     print(df['fault_flags'].unique())
 
     print("\nFlag combinations and their counts:")
     flag_counts = df['fault_flags'].value_counts()
     print(flag_counts)
+
+    if df['pid'].nunique() > 1:
+        print("\nFaults per process:")
+        print(df['pid'].value_counts())
     
     if len(df) > 0:
-        df['time_since_last_fault'] = df['timestamp_ns'].diff()
-        df['offset_in_vma'] = df['page_id']*4096 - df['vma_start']
-        df['vma_size'] = df['vma_end'] - df['vma_start']
-        df['relative_position'] = df['offset_in_vma'] / df['vma_size']
-        df['sequential_access'] = (df['distance'] == 1).astype(int)
+        df = add_fault_features(df)
         
         df.to_csv('only_pfs3.csv', index=False)
         print("\nFeature Statistics:")
@@ -0,0 +1,208 @@
+import struct
+
+import numpy as np
+
+from perf_parse import (BUILD_EVENTS, count_events, count_samples, event_columns,
+                        events_frame, samples_frame)
+
+# perf.data file layout, see tools/perf/util/header.h in the kernel tree
+MAGIC = b'PERFILE2'
+FILE_HEADER = struct.Struct('<8sQQQQQQQQ')  # magic, size, attr_size, attrs, data, event_types
+EVENT_HEADER = struct.Struct('<IHH')  # type, misc, size
+ATTR_PREFIX = struct.Struct('<IIQQQQQ')  # type, size, config, period, sample_type, read_format, flags
+
+PERF_RECORD_SAMPLE = 9
+
+# Sample fields in the order the kernel writes them. Everything after
+# PERF_SAMPLE_PERIOD has a variable size and is skipped.
+SAMPLE_FIELDS = [
+    (1 << 16, [('identifier', '<u8')]),  # PERF_SAMPLE_IDENTIFIER
+    (1 << 0, [('ip', '<u8')]),
+    (1 << 1, [('pid', '<u4'), ('tid', '<u4')]),
+    (1 << 2, [('time', '<u8')]),
+    (1 << 3, [('addr', '<u8')]),
+    (1 << 6, [('id', '<u8')]),
+    (1 << 9, [('stream_id', '<u8')]),
+    (1 << 7, [('cpu', '<u4'), ('cpu_res', '<u4')]),
+    (1 << 8, [('period', '<u8')]),
+]
+PERF_SAMPLE_ADDR = 1 << 3
+PERF_SAMPLE_ID = 1 << 6
+PERF_SAMPLE_PERIOD = 1 << 8
+PERF_SAMPLE_IDENTIFIER = 1 << 16
+ATTR_FREQ = 1 << 10  # attr.freq, period holds sample_freq instead of sample_period
+
+SAMPLE_DTYPE = np.dtype([
+    ('ip', np.uint64),
+    ('pid', np.uint32),
+    ('tid', np.uint32),
+    ('time', np.uint64),
+    ('addr', np.uint64),
+    ('cpu', np.uint32),
+    ('period', np.uint64),
+    ('event', np.int32),  # Index into the events list
+])
+
+# Event names as perf script prints them
+HARDWARE_EVENTS = ['cycles', 'instructions', 'cache-references', 'cache-misses', 'branches',
+                   'branch-misses', 'bus-cycles', 'stalled-cycles-frontend',
+                   'stalled-cycles-backend', 'ref-cycles']
+SOFTWARE_EVENTS = ['cpu-clock', 'task-clock', 'page-faults', 'context-switches',
+                   'cpu-migrations', 'minor-faults', 'major-faults', 'alignment-faults',
+                   'emulation-faults', 'dummy']
+HW_CACHES = ['L1-dcache', 'L1-icache', 'LLC', 'dTLB', 'iTLB', 'branch', 'node']
+HW_CACHE_OPS = [('load', 'loads'), ('store', 'stores'), ('prefetch', 'prefetches')]
+
+BATCH = 1 << 16  # Samples gathered per step, bounds the index matrix
+
+
+def event_name(attr_type, config, exclude_user, exclude_kernel, exclude_hv):
+    """Name perf script prints for an event, with the ':u' modifier for user-only events"""
+    if attr_type == 0 and config < len(HARDWARE_EVENTS):
+        name = HARDWARE_EVENTS[config]
+    elif attr_type == 1 and config < len(SOFTWARE_EVENTS):
+        name = SOFTWARE_EVENTS[config]
+    elif attr_type == 3 and (config & 0xff) < len(HW_CACHES) and (config >> 8 & 0xff) < len(HW_CACHE_OPS):
+        cache, (op, ops) = HW_CACHES[config & 0xff], HW_CACHE_OPS[config >> 8 & 0xff]
+        name = f"{cache}-{ops}" if config >> 16 & 0xff == 0 else f"{cache}-{op}-misses"
+    else:
+        name = f"raw-{attr_type}-{config:#x}"
+    if not exclude_user and exclude_kernel and exclude_hv:
+        name += ':u'
+    return name
+
+
+def read_events(path):
+    """File header and one dict per recorded event: name, sample_type and sample ids
+
+    period is the event's fixed sample_period (perf record -c), 1 when it
+    was sampled by frequency.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        if header[:8] != MAGIC:
+            raise ValueError(f"{path} is not a little-endian perf.data file")
+        _, size, attr_size, attrs_off, attrs_size, data_off, data_size, _, _ = FILE_HEADER.unpack(header)
+        if size < FILE_HEADER.size:
+            raise ValueError("Piped perf.data is not supported, record to a file")
+
+        events = []
+        for offset in range(attrs_off, attrs_off + attrs_size, attr_size):
+            f.seek(offset)
+            entry = f.read(attr_size)
+            attr_type, _, config, period, sample_type, _, flags = ATTR_PREFIX.unpack_from(entry)
+            ids_off, ids_size = struct.unpack_from('<QQ', entry, attr_size - 16)
+            f.seek(ids_off)
+            ids = np.frombuffer(f.read(ids_size), dtype='<u8')
+            events.append({
+                'name': event_name(attr_type, config, flags >> 4 & 1, flags >> 5 & 1, flags >> 6 & 1),
+                'type': attr_type,
+                'config': config,
+                'sample_type': sample_type,
+                'period': 1 if flags & ATTR_FREQ or not period else period,
+                'ids': ids,
+            })
+    return {'data_offset': data_off, 'data_size': data_size}, events
+
+
+def _sample_offsets(buf, start, end):
+    """Offsets of every PERF_RECORD_SAMPLE in the data section"""
+    offsets = []
+    pos = start
+    unpack = EVENT_HEADER.unpack_from
+    while pos + EVENT_HEADER.size <= end:
+        record_type, _, size = unpack(buf, pos)
+        if size == 0:
+            break
+        if record_type == PERF_RECORD_SAMPLE:
+            offsets.append(pos)
+        pos += size
+    return np.array(offsets, dtype=np.int64)
+
+
+def read_samples(path):
+    """Decode every sample of a perf.data file into a SAMPLE_DTYPE array
+
+    Returns the events list from read_events and the samples, whose
+    'event' field indexes it. Fields the recording did not sample are zero.
+    Without PERF_SAMPLE_PERIOD each sample stands for its event's fixed
+    period, as perf script prints it.
+    """
+    header, events = read_events(path)
+    sample_types = {event['sample_type'] for event in events}
+    if len(sample_types) != 1:
+        raise ValueError("Events recorded with different sample types are not supported")
+    sample_type = sample_types.pop()
+    if len(events) > 1 and not sample_type & (PERF_SAMPLE_ID | PERF_SAMPLE_IDENTIFIER):
+        raise ValueError("Samples of several events carry no id to tell them apart")
+
+    raw_dtype = np.dtype([field for bit, fields in SAMPLE_FIELDS if sample_type & bit
+                          for field in fields])
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    start = header['data_offset']
+    end = start + header['data_size'] if header['data_size'] else len(buf)
+    offsets = _sample_offsets(buf, start, end) + EVENT_HEADER.size
+
+    raw = np.empty(len(offsets), dtype=raw_dtype)
+    columns = np.arange(raw_dtype.itemsize)
+    for i in range(0, len(offsets), BATCH):
+        batch = offsets[i:i + BATCH]
+        raw[i:i + len(batch)] = buf[batch[:, None] + columns].view(raw_dtype).ravel()
+
+    samples = np.zeros(len(raw), dtype=SAMPLE_DTYPE)
+    for name in raw_dtype.names:
+        if name in SAMPLE_DTYPE.names:
+            samples[name] = raw[name]
+
+    if len(events) > 1:
+        ids = np.concatenate([event['ids'] for event in events])
+        owners = np.concatenate([np.full(len(event['ids']), i) for i, event in enumerate(events)])
+        order = np.argsort(ids)
+        sample_ids = raw['identifier' if 'identifier' in raw_dtype.names else 'id']
+        found = np.minimum(np.searchsorted(ids[order], sample_ids), len(ids) - 1)
+        known = ids[order][found] == sample_ids
+        samples['event'] = np.where(known, owners[order][found], -1)
+    if not sample_type & PERF_SAMPLE_PERIOD:
+        # Samples of unknown events (event -1) take the trailing 1
+        periods = np.array([event['period'] for event in events] + [1], dtype=np.uint64)
+        samples['period'] = periods[samples['event']]
+    return events, samples
+
+
+def _addresses(events, samples, address):
+    if address is None:
+        address = 'addr' if events[0]['sample_type'] & PERF_SAMPLE_ADDR else 'ip'
+    return samples[address]
+
+
+def parse_samples(path, vmas, address=None):
+    """perf_parse.parse_samples straight from perf.data
+
+    Like parser.py, only samples of ':u' events count and each adds its
+    period. address picks the sample field used as the access address,
+    'addr' when the recording has it (perf record -d), 'ip' otherwise.
+    """
+    events, samples = read_samples(path)
+    names = [event['name'] for event in events]
+    user_only = np.array([name.endswith(':u') for name in names] + [False])
+    columns = np.append(event_columns([name.split(':')[0] for name in names]), -1)
+    counted = user_only[samples['event']]
+
+    result = count_samples(_addresses(events, samples, address)[counted],
+                           samples['period'][counted], columns[samples['event'][counted]],
+                           vmas)
+    result['lines'] = len(samples)
+    return samples_frame([result])
+
+
+def parse_events(path, page_size=4096, address=None, vmas=None):
+    """perf_parse.parse_events straight from perf.data"""
+    events, samples = read_samples(path)
+    classes = np.full(len(events) + 1, len(BUILD_EVENTS), dtype=np.int64)
+    for i, event in enumerate(events):
+        for j, (needle, _) in enumerate(BUILD_EVENTS):
+            if needle.decode() in event['name']:
+                classes[i] = j
+                break
+    return events_frame([count_events(_addresses(events, samples, address),
+                                      classes[samples['event']], page_size, vmas)])
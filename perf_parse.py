@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from page_counters import PageCounterTable
+
+KERNEL_ADDR_MIN = 0xffffffff00000000
+MIN_PARALLEL_BYTES = 8 << 20  # Smaller dumps are parsed in-process
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_BYTES = 64 << 20  # Bounds each worker's memory on multi-GB dumps
+
+# parser.py: counters kept per page, events are matched after lower() and '-' -> '_'
+PARSER_EVENTS = ['page_faults', 'tlb_load_misses', 'tlb_store_misses', 'cache_misses',
+                 'cache_references']
+
+# build_dataset.py: substring checked per line, first one in this order wins
+BUILD_EVENTS = [
+    (b'page-faults', 'page_faults'),
+    (b'dTLB-load-misses', 'tlb_load_misses'),
+    (b'dTLB-store-misses', 'tlb_store_misses'),
+    (b'cache-misses', 'cache_misses'),
+    (b'cache-references', 'cache_references'),
+    (b'context-switches', 'context_switches'),
+    (b'instructions', 'instructions'),
+    (b'branches', 'branches'),
+    (b'branch-misses', 'branch_misses'),
+]
+BUILD_ADDRESS_EVENTS = 5  # The first entries of BUILD_EVENTS are attributed to a page
+BUILD_PAGE_COLUMNS = [name for _, name in BUILD_EVENTS[:BUILD_ADDRESS_EVENTS]]
+
+# Both patterns run over a whole chunk instead of line by line. '[^\S\n]'
+# for '\s' and the line-consuming suffix give at most one match per line,
+# the same one re.search(line) would find.
+SAMPLE_PATTERN = re.compile(
+    rb':[^\S\n]+(\d+)[^\S\n]+([\w-]+):u:[^\S\n]+([0-9a-fA-F]+)[^\n]*')
+ADDRESS_PATTERN = re.compile(
+    rb':[^\S\n]+\d+[^\S\n]+\S+:[^\S\n]+([0-9a-fA-F]+)[^\n]*')
+# Every BUILD_EVENTS substring in a chunk, lines take the first in list order
+BUILD_EVENT_PATTERN = re.compile(b'|'.join(re.escape(needle) for needle, _ in BUILD_EVENTS))
+BUILD_EVENT_INDEX = {needle: i for i, (needle, _) in enumerate(BUILD_EVENTS)}
+
+
+def chunk_ranges(path, n_chunks):
+    """Split a file into about n_chunks byte ranges that start and end on line boundaries"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n_chunks):
+            offset = size * i // n_chunks
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset)
+            f.readline()  # Move to the start of the next line
+            offset = f.tell()
+            if offset >= size:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _read(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def _count_lines(chunk):
+    if not chunk:
+        return 0
+    return chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1)
+
+
+def event_columns(names):
+    """PARSER_EVENTS column of each event name, -1 for events parser.py does not count"""
+    keys = [name.decode() if isinstance(name, bytes) else name for name in names]
+    return np.array([
+        PARSER_EVENTS.index(key) if key in PARSER_EVENTS else -1
+        for key in (key.lower().replace('-', '_') for key in keys)
+    ], dtype=np.int64)
+
+
+def count_samples(addrs, counts, columns, vmas):
+    """parser.py's per-page aggregation of decoded samples
+
+    addrs are the sample addresses, counts the per-sample count added to the
+    event's counter and columns the PARSER_EVENTS column of each sample.
+    Pages are vmas' dense page ids, addresses outside every VMA are dropped.
+    """
+    addrs = np.asarray(addrs, dtype=np.uint64)
+    kernel = addrs > np.uint64(KERNEL_ADDR_MIN)
+    result = {'kernel': int(kernel.sum()), 'user': int(len(addrs) - kernel.sum())}
+
+    # parser.py creates the row of every mapped page, even for events it does not count
+    pages = np.where(kernel, -1, vmas.page_ids(addrs))
+    mapped = pages >= 0
+    result['table'] = PageCounterTable.from_samples(
+        PARSER_EVENTS, pages[mapped], np.asarray(columns)[mapped],
+        np.asarray(counts, dtype=np.int64)[mapped])
+    return result
+
+
+def count_events(addrs, classes, page_size, vmas=None):
+    """build_dataset.py's aggregation, classes index BUILD_EVENTS (len(BUILD_EVENTS) for none)
+
+    Samples of the address events count once on their page, the rest only
+    add to the global counts. Pages are absolute page numbers, or vmas'
+    dense page ids when given (unmapped addresses are then dropped).
+    """
+    classes = np.asarray(classes, dtype=np.int64)
+    result = {
+        'global': np.bincount(classes, minlength=len(BUILD_EVENTS) + 1)[BUILD_ADDRESS_EVENTS:len(BUILD_EVENTS)],
+    }
+    keep = classes < BUILD_ADDRESS_EVENTS
+    addrs = np.asarray(addrs, dtype=np.uint64)[keep]
+    if vmas is None:
+        pages = (addrs // np.uint64(page_size)).astype(np.int64)
+    else:
+        pages = vmas.page_ids(addrs)
+        keep[keep] = pages >= 0
+        pages = pages[pages >= 0]
+    result['table'] = PageCounterTable.from_samples(BUILD_PAGE_COLUMNS, pages, classes[keep])
+    return result
+
+
+def _parse_sample_chunk(path, start, end, vmas):
+    chunk = _read(path, start, end)
+    matches = SAMPLE_PATTERN.findall(chunk)
+    counts = np.array([m[0] for m in matches]).astype(np.int64)
+    addrs = np.array([int(m[2], 16) for m in matches], dtype=np.uint64)
+    names, name_idx = np.unique(np.array([m[1] for m in matches]), return_inverse=True)
+    result = count_samples(addrs, counts, event_columns(names)[name_idx], vmas)
+    result['lines'] = _count_lines(chunk)
+    return result
+
+
+def _parse_build_chunk(path, start, end, page_size, vmas):
+    chunk = _read(path, start, end)
+    newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+
+    # Event class of every line with an event: index of the first BUILD_EVENTS
+    # substring it contains. Lines are numbered by the newlines before them.
+    hits = [(m.start(), BUILD_EVENT_INDEX[m.group()])
+            for m in BUILD_EVENT_PATTERN.finditer(chunk)]
+    hit_lines = np.searchsorted(newlines, np.array([pos for pos, _ in hits], dtype=np.int64))
+    hit_classes = np.array([i for _, i in hits], dtype=np.int64)
+    order = np.lexsort((hit_classes, hit_lines))
+    lines, first = np.unique(hit_lines[order], return_index=True)
+    line_class = hit_classes[order][first]
+
+    # Address of those lines, at most one ADDRESS_PATTERN match per line. A
+    # sentinel past the last line keeps every lookup in range.
+    found = [(m.start(), int(m.group(1), 16)) for m in ADDRESS_PATTERN.finditer(chunk)]
+    addr_lines = np.r_[np.searchsorted(newlines, np.array([pos for pos, _ in found],
+                                                          dtype=np.int64)), len(newlines) + 1]
+    addrs = np.r_[np.array([addr for _, addr in found], dtype=np.uint64), np.uint64(0)]
+    at = np.searchsorted(addr_lines, lines)
+    matched = addr_lines[at] == lines
+    line_addrs = np.where(matched, addrs[at], np.uint64(0))
+
+    # Address events on a line without an address are dropped, as in build_dataset.py
+    line_class[~matched & (line_class < BUILD_ADDRESS_EVENTS)] = len(BUILD_EVENTS)
+    result = count_events(line_addrs, line_class, page_size, vmas)
+    result['lines'] = _count_lines(chunk)
+    return result
+
+
+def _run(func, path, args, workers):
+    size = os.path.getsize(path)
+    workers = workers or os.cpu_count() or 1
+    n_chunks = max(workers * CHUNKS_PER_WORKER, -(-size // MAX_CHUNK_BYTES))
+    ranges = chunk_ranges(path, n_chunks)
+    if workers == 1 or size < MIN_PARALLEL_BYTES:
+        return [func(path, start, end, *args) for start, end in ranges]
+    # fork, so workers do not re-run the calling script (parser.py and
+    # build_dataset.py do their work at import time)
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(func, path, start, end, *args) for start, end in ranges]
+        return [future.result() for future in futures]
+
+
+def samples_frame(results):
+    """Merge count_samples results into parser.py's DataFrame and summary"""
+    df = PageCounterTable.merge(r['table'] for r in results).to_frame('page_number')
+    summary = {
+        'lines': sum(r['lines'] for r in results),
+        'kernel': sum(r['kernel'] for r in results),
+        'user': sum(r['user'] for r in results),
+    }
+    return df, summary
+
+
+def events_frame(results):
+    """Merge count_events results into build_dataset.py's page counts and global counts"""
+    df = PageCounterTable.merge(r['table'] for r in results).to_frame('page')
+    global_counts = dict(zip([name for _, name in BUILD_EVENTS[BUILD_ADDRESS_EVENTS:]],
+                             np.sum([r['global'] for r in results], axis=0).tolist()))
+    return df, global_counts
+
+
+def parse_samples(path, vmas, workers=None):
+    """parser.py's per-page counters for samples inside vmas (a vma_map.VmaMap)"""
+    return samples_frame(_run(_parse_sample_chunk, path, (vmas,), workers))
+
+
+def parse_events(path, page_size=4096, workers=None, vmas=None):
+    """build_dataset.py's per-page event counts, keyed by absolute page number
+    or by vmas' dense page ids"""
+    return events_frame(_run(_parse_build_chunk, path, (page_size, vmas), workers))
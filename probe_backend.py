@@ -0,0 +1,98 @@
+# Ways to hook page faults, cheapest first
+PROBE_BACKENDS = ('fexit', 'fentry', 'tracepoint', 'kprobe')
+
+# Order 'auto' tries them in, kprobes work on every kernel. The tracepoint
+# loses fields (see BACKEND_LIMITS) and is only used when asked for.
+AUTO_ORDER = ('fexit', 'kprobe')
+
+# Backends that see handle_mm_fault return as well, and so its service time
+# and return code
+PAIRED_BACKENDS = ('fexit', 'kprobe')
+
+# What a backend's records lack compared to a paired one
+BACKEND_LIMITS = {
+    'fentry': "fault_latency and vm_fault are 0",
+    'tracepoint': ("no VMA: vm_flags, vma_start and vma_end are 0 and page_shift is 12, "
+                   "is_write comes from the error code; fault_latency and vm_fault are 0"),
+}
+
+# Attach points for a program that defines
+#   record_fault(ctx, vma, address, flags, start_ns)
+# and, when PROBE_PAIRED is set, complete_fault(ctx, ret) for the return.
+# Exactly one backend is compiled in, picked by backend_cflags().
+# fentry/fexit need BTF (kernel 5.5+) and see the same arguments as the
+# kprobe. The exceptions:page_fault_user tracepoint (x86) fires before the
+# VMA is looked up, so it passes no VMA and the hardware error code as
+# flags.
+PROBE_HOOKS = """
+#if defined(PROBE_FEXIT)
+KFUNC_PROBE(handle_mm_fault, struct vm_area_struct *vma, unsigned long address,
+            unsigned int flags, struct pt_regs *regs) {
+    return record_fault(ctx, vma, address, flags, bpf_ktime_get_ns());
+}
+
+KRETFUNC_PROBE(handle_mm_fault, struct vm_area_struct *vma, unsigned long address,
+               unsigned int flags, struct pt_regs *regs, vm_fault_t ret) {
+    return complete_fault(ctx, ret);
+}
+#elif defined(PROBE_FENTRY)
+KFUNC_PROBE(handle_mm_fault, struct vm_area_struct *vma, unsigned long address,
+            unsigned int flags, struct pt_regs *regs) {
+    return record_fault(ctx, vma, address, flags, bpf_ktime_get_ns());
+}
+#elif defined(PROBE_TRACEPOINT)
+TRACEPOINT_PROBE(exceptions, page_fault_user) {
+    return record_fault(args, NULL, args->address, args->error_code, bpf_ktime_get_ns());
+}
+#else
+int kprobe__handle_mm_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
+                            unsigned long address, unsigned int flags) {
+    return record_fault(ctx, vma, address, flags, bpf_ktime_get_ns());
+}
+
+int kretprobe__handle_mm_fault(struct pt_regs *ctx) {
+    return complete_fault(ctx, PT_REGS_RC(ctx));
+}
+#endif
+"""
+
+
+def backend_available(backend):
+    """Whether the running kernel supports backend"""
+    if backend not in PROBE_BACKENDS:
+        raise ValueError(f"Unknown probe backend {backend!r}, expected one of {PROBE_BACKENDS}")
+    if backend == 'kprobe':
+        return True
+    from bcc import BPF
+    if backend in ('fexit', 'fentry'):
+        return BPF.support_kfunc()
+    return BPF.tracepoint_exists('exceptions', 'page_fault_user')
+
+
+def select_backend(preferred='auto', paired=False):
+    """preferred if the kernel supports it, else the first available of AUTO_ORDER
+
+    paired only accepts backends that time the fault (PAIRED_BACKENDS).
+    Prints a warning when the backend's records lack fields.
+    """
+    if paired and preferred not in ('auto',) + PAIRED_BACKENDS:
+        raise ValueError(f"Probe backend {preferred!r} does not time faults, "
+                         f"expected one of {PAIRED_BACKENDS}")
+    if preferred != 'auto' and backend_available(preferred):
+        backend = preferred
+    else:
+        backend = next(backend for backend in AUTO_ORDER if backend_available(backend))
+        if preferred != 'auto':
+            print(f"WARNING: probe backend {preferred!r} is not supported here, using {backend!r}")
+    if backend in BACKEND_LIMITS:
+        print(f"WARNING: probe backend {backend!r} records {BACKEND_LIMITS[backend]}")
+    return backend
+
+
+def backend_cflags(backend):
+    if backend not in PROBE_BACKENDS:
+        raise ValueError(f"Unknown probe backend {backend!r}, expected one of {PROBE_BACKENDS}")
+    cflags = [] if backend == 'kprobe' else [f'-DPROBE_{backend.upper()}']
+    if backend in PAIRED_BACKENDS:
+        cflags.append('-DPROBE_PAIRED')
+    return cflags
@@ -0,0 +1,328 @@
+import ctypes
+import os
+import re
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+from captures import load_capture
+from fault_capture import open_capture
+
+# C field types used by the collectors' BPF structs
+C_TYPES = {
+    'u64': ctypes.c_uint64,
+    'u32': ctypes.c_uint32,
+    'u16': ctypes.c_uint16,
+    'u8': ctypes.c_uint8,
+    's64': ctypes.c_int64,
+    's32': ctypes.c_int32,
+    'int': ctypes.c_int32,
+}
+
+# Capture columns that feed struct fields with a different name
+FIELD_ALIASES = {
+    'timestamp': 'timestamp_ns',
+    'ts': 'timestamp_ns',
+    'access_time_ns': 'timestamp_ns',
+    'fault_time_ns': 'timestamp_ns',
+    'access_type': 'is_write',
+    'fault_type': 'is_write',
+    'fault_distance': 'distance',
+    'vma_flags': 'vm_flags',
+}
+
+# Fields a capture has no column for; every replayed record counts as one fault
+FIELD_DEFAULTS = {
+    'minor_faults': 1,
+    'page_shift': 12,
+    'sample_weight': 1,
+}
+
+# fault_type is read/write in most structs, but page_trace_3 keeps read/write
+# in access_type and uses fault_type for minor/major, which its probe always
+# records as 1
+MINOR_MAJOR_FIELDS = {'fault_type': 1}
+
+POLL_BATCH = 4096  # Most records delivered by a single poll call
+
+
+def parse_event_struct(bpf_text):
+    """ctypes Structure for the struct a BPF program submits as its event"""
+    submitted = re.search(r'struct\s+(\w+)\s+data\s*=', bpf_text)
+    if submitted is None:
+        raise ValueError("No 'struct <name> data' event found in BPF program")
+    name = submitted.group(1)
+    body = re.search(r'struct\s+%s\s*\{(.*?)\};' % name, bpf_text, re.S)
+    if body is None:
+        raise ValueError(f"Definition of struct {name} not found")
+
+    fields = []
+    for line in body.group(1).splitlines():
+        line = line.split('//')[0].strip()
+        match = re.match(r'(\w+)\s+(\w+)\s*;', line)
+        if match:
+            fields.append((match.group(2), C_TYPES[match.group(1)]))
+    return type(name, (ctypes.Structure,), {'_fields_': fields})
+
+
+def load_events(path, struct):
+    """Records of a capture file or directory laid out in struct's memory layout"""
+    dtype = np.dtype(struct)
+    if path.endswith('.bin'):
+        return np.fromfile(path, dtype=dtype)
+    if path.endswith('.pfcap'):
+        _, records = open_capture(path)
+        if records.dtype == dtype:
+            return np.array(records)
+
+    aliases, defaults = dict(FIELD_ALIASES), dict(FIELD_DEFAULTS)
+    if 'access_type' in dtype.names:
+        for name, value in MINOR_MAJOR_FIELDS.items():
+            aliases.pop(name, None)
+            defaults[name] = value
+
+    df = load_capture(path)
+    records = np.zeros(len(df), dtype=dtype)
+    for name in dtype.names:
+        column = name if name in df.columns else aliases.get(name)
+        if column in df.columns:
+            records[name] = df[column].fillna(0).to_numpy()
+        elif name in defaults:
+            records[name] = defaults[name]
+    return records
+
+
+class ReplayTable:
+    """Dict-backed stand-in for a BCC map, lookups miss unless the script wrote them"""
+
+    def __init__(self, bpf, name):
+        self.bpf = bpf
+        self.name = name
+        self.values = {}
+
+    def _key(self, key):
+        return getattr(key, 'value', key)
+
+    def __getitem__(self, key):
+        return self.values[self._key(key)]
+
+    def __setitem__(self, key, value):
+        self.values[self._key(key)] = value
+
+    def __delitem__(self, key):
+        del self.values[self._key(key)]
+
+    def items(self):
+        return list(self.values.items())
+
+    def items_lookup_and_delete_batch(self):
+        return iter([])
+
+    def sum(self, key):
+        return ctypes.c_uint64(0)
+
+    def event(self, data):
+        return ctypes.cast(data, ctypes.POINTER(self.bpf.struct)).contents
+
+    def open_perf_buffer(self, callback, page_cnt=8, lost_cb=None):
+        self.bpf.callbacks.append(lambda ptr, size: callback(0, ptr, size))
+
+    def open_ring_buffer(self, callback, ctx=None):
+        self.bpf.callbacks.append(lambda ptr, size: callback(ctx, ptr, size))
+
+
+class ReplayBPF:
+    """Stand-in for bcc.BPF that delivers recorded events to the script's callbacks
+
+    speed=None replays as fast as possible, 1.0 at the recorded pace and
+    N at N times the recorded pace. Nothing is delivered before start().
+    """
+
+    def __init__(self, records, struct, speed=None):
+        self.struct = struct
+        self.records = records
+        self.speed = speed
+        self.tables = {}
+        self.callbacks = []
+        self.position = 0
+        self.started_at = None
+        self.handler_time = 0.0
+
+        timestamps = self._timestamps(records)
+        self.offsets = (timestamps - timestamps[0]) / 1e9 if len(timestamps) else timestamps
+
+    def _timestamps(self, records):
+        for name in ('timestamp_ns', 'timestamp', 'ts', 'access_time_ns', 'fault_time_ns'):
+            if name in records.dtype.names:
+                return records[name].astype(np.float64)
+        return np.zeros(len(records))
+
+    def __getitem__(self, name):
+        if name not in self.tables:
+            self.tables[name] = ReplayTable(self, name)
+        return self.tables[name]
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def done(self):
+        return self.position >= len(self.records)
+
+    def _due(self):
+        """Index one past the last record whose recorded time has come"""
+        end = min(self.position + POLL_BATCH, len(self.records))
+        if self.speed is None:
+            return end
+        elapsed = (time.perf_counter() - self.started_at) * self.speed
+        return min(int(np.searchsorted(self.offsets, elapsed, side='right')), end)
+
+    def _poll(self, timeout=-1):
+        if self.started_at is None or self.done():
+            if timeout and timeout > 0:
+                time.sleep(timeout / 1000)
+            return
+        due = self._due()
+        if due == self.position and self.speed is not None:
+            wait = (self.offsets[self.position] / self.speed
+                    - (time.perf_counter() - self.started_at))
+            if timeout is not None and timeout >= 0:
+                wait = min(wait, timeout / 1000)
+            time.sleep(max(wait, 0))
+            due = self._due()
+
+        base = self.records.ctypes.data
+        size = self.records.dtype.itemsize
+        start = time.perf_counter()
+        for i in range(self.position, due):
+            ptr = ctypes.c_void_p(base + i * size)
+            for callback in self.callbacks:
+                callback(ptr, size)
+        self.handler_time += time.perf_counter() - start
+        self.position = due
+
+    def perf_buffer_poll(self, timeout=-1):
+        self._poll(timeout)
+
+    def ring_buffer_poll(self, timeout=-1):
+        self._poll(timeout)
+
+    def ring_buffer_consume(self):
+        self._poll(0)
+
+    def stats(self):
+        return {
+            'events': self.position,
+            'handler_s': self.handler_time,
+            'events_per_s': self.position / self.handler_time if self.handler_time else 0.0,
+        }
+
+
+class ReplayWorkload:
+    """Takes the place of the workload process, it runs until the replay is drained"""
+
+    def __init__(self, bpf):
+        self.bpf = bpf
+        self.pid = os.getpid()
+        self.returncode = None
+        bpf.start()
+
+    def poll(self):
+        if self.bpf.done():
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout=None):
+        while self.poll() is None:
+            time.sleep(0.01)
+        return self.returncode
+
+
+def _is_workload(args):
+    args = args if isinstance(args, (list, tuple)) else [args]
+    return any(os.path.basename(str(arg)).startswith('workload') for arg in args)
+
+
+def run_script(script, capture, speed=None, workdir=None):
+    """Run a collector script against a recorded capture instead of the kernel
+
+    The script's BPF object becomes a ReplayBPF over the capture and its
+    workload launch waits for the replay to drain, so the script's own
+    handlers, polling and post-processing run unchanged. Output files land in
+    workdir (a new temporary directory by default). Returns the ReplayBPF,
+    whose stats() give handler throughput.
+    """
+    script = os.path.abspath(script)
+    capture = os.path.abspath(capture)
+    workdir = workdir or tempfile.mkdtemp(prefix='replay_')
+    script_dir = os.path.dirname(script)
+    state = {}
+
+    def fake_bpf(text='', cflags=None, **kwargs):
+        struct = parse_event_struct(text)
+        state['bpf'] = ReplayBPF(load_events(capture, struct), struct, speed)
+        return state['bpf']
+
+    # Probe backend selection asks for kernel features, a replay has none
+    fake_bpf.support_kfunc = lambda: False
+    fake_bpf.tracepoint_exists = lambda category, event: False
+
+    real_run, real_popen = subprocess.run, subprocess.Popen
+
+    def fake_run(args, *a, **kw):
+        if _is_workload(args):
+            ReplayWorkload(state['bpf']).wait()
+            return subprocess.CompletedProcess(args, 0)
+        return real_run(args, *a, **kw)
+
+    def fake_popen(args, *a, **kw):
+        if _is_workload(args):
+            return ReplayWorkload(state['bpf'])
+        return real_popen(args, *a, **kw)
+
+    # Collectors that check for their workload script should find it
+    for name in os.listdir(script_dir):
+        if name.startswith('workload') and not os.path.exists(os.path.join(workdir, name)):
+            os.symlink(os.path.join(script_dir, name), os.path.join(workdir, name))
+
+    bcc = types.ModuleType('bcc')
+    bcc.BPF = fake_bpf
+    bcc.utils = types.ModuleType('bcc.utils')
+    bcc.utils.get_possible_cpus = lambda: list(range(os.cpu_count()))
+    saved_bcc = sys.modules.get('bcc')
+    saved_utils = sys.modules.get('bcc.utils')
+    saved_cwd = os.getcwd()
+    sys.modules['bcc'] = bcc
+    sys.modules['bcc.utils'] = bcc.utils
+    sys.path.insert(0, script_dir)
+    subprocess.run, subprocess.Popen = fake_run, fake_popen
+    os.chdir(workdir)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        os.chdir(saved_cwd)
+        subprocess.run, subprocess.Popen = real_run, real_popen
+        sys.path.remove(script_dir)
+        for name, saved in (('bcc', saved_bcc), ('bcc.utils', saved_utils)):
+            if saved is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = saved
+    return state.get('bpf')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python3 replay.py <collector.py> <capture> [speed]")
+        exit(1)
+    speed = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    bpf = run_script(sys.argv[1], sys.argv[2], speed)
+    stats = bpf.stats()
+    print(f"\nReplayed {stats['events']} events, handlers ran at "
+          f"{stats['events_per_s']:.0f} events/s")
@@ -0,0 +1,53 @@
+import ctypes
+import numpy as np
+
+from fault_store import ColumnarBuffer, FAULT_DATA_DTYPE
+
+BATCH_SIZE = 65536  # Records staged before a batch is decoded
+
+
+class RingBufferCollector:
+    """Drain a BPF ring buffer in batches instead of decoding one event at a time"""
+
+    def __init__(self, b, store=None, map_name='events', lost_map='lost_events',
+                 dtype=FAULT_DATA_DTYPE, batch_size=BATCH_SIZE):
+        self.b = b
+        self.store = store if store is not None else ColumnarBuffer(dtype)
+        self.dtype = dtype
+        self.lost_map = lost_map
+        self.record_size = dtype.itemsize
+
+        # Preallocated staging area, raw records are copied straight into it
+        self.batch = np.zeros(batch_size, dtype=dtype)
+        self.batch_addr = self.batch.ctypes.data
+        self.pending = 0
+
+        b[map_name].open_ring_buffer(self._stage)
+
+    def _stage(self, ctx, data, size):
+        # Only a memmove per event, decoding happens per batch in _flush
+        if self.pending == len(self.batch):
+            self._flush()
+        offset = self.batch_addr + self.pending * self.record_size
+        ctypes.memmove(offset, data, min(size, self.record_size))
+        self.pending += 1
+
+    def _flush(self):
+        if self.pending == 0:
+            return
+        self.store.extend(self.batch[:self.pending])
+        self.pending = 0
+
+    def poll(self, timeout=100):
+        """Wait for records, then decode everything the poll staged as one batch"""
+        self.b.ring_buffer_poll(timeout)
+        self._flush()
+
+    def drain(self):
+        """Consume whatever is left in the ring buffer without blocking"""
+        self.b.ring_buffer_consume()
+        self._flush()
+
+    def lost_events(self):
+        """Number of records the BPF side could not reserve in the ring buffer"""
+        return self.b[self.lost_map].sum(ctypes.c_int(0)).value
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+
+ROWS_PER_FILE = 1 << 20  # Rotate to a new file after this many rows
+QUEUE_DEPTH = 16         # Batches buffered between the poller and the writer
+
+
+class SpillWriter:
+    """Background thread that streams record batches to rotating Parquet or Arrow IPC files"""
+
+    def __init__(self, out_dir, dtype, fmt='parquet', rows_per_file=ROWS_PER_FILE,
+                 queue_depth=QUEUE_DEPTH):
+        if fmt not in ('parquet', 'arrow'):
+            raise ValueError(f"Unknown spill format: {fmt}")
+        # Imported here so collectors that never spill run without pyarrow
+        import pyarrow as pa
+        self.pa = pa
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.rows_per_file = rows_per_file
+        self.schema = pa.schema([(name, pa.from_numpy_dtype(dtype[name]))
+                                 for name in dtype.names])
+
+        # Bounded so a slow disk pushes back on the poller instead of growing RAM
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.writer = None
+        self.file_index = 0
+        self.file_rows = 0
+        self.rows_written = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, columns):
+        """Queue a batch given as {column name: array}, blocks while the queue is full"""
+        if self.error is not None:
+            raise self.error
+        self.queue.put(columns)
+
+    def close(self):
+        """Write out everything queued so far and close the current file"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            columns = self.queue.get()
+            if columns is None:
+                break
+            if self.error is not None:
+                continue  # Keep draining so submit() never blocks forever
+            try:
+                self._write(columns)
+            except Exception as e:
+                self.error = e
+        try:
+            self._close_file()
+        except Exception as e:
+            self.error = self.error or e
+
+    def _open_file(self):
+        path = os.path.join(self.out_dir, f"part-{self.file_index:05d}.{self.fmt}")
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc as ipc
+            self.writer = ipc.new_file(path, self.schema)
+
+    def _close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.file_index += 1
+            self.file_rows = 0
+
+    def _write(self, columns):
+        pa = self.pa
+        batch = pa.record_batch([pa.array(columns[name]) for name in self.schema.names],
+                                schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        if self.writer is None:
+            self._open_file()
+        self.writer.write_batch(batch)
+        self.file_rows += batch.num_rows
+        self.rows_written += batch.num_rows
+
+        # Finished files are complete on disk, a crash only loses the open one
+        if self.file_rows >= self.rows_per_file:
+            self._close_file()
@@ -0,0 +1,103 @@
+import struct
+
+import numpy as np
+import pytest
+
+import perf_data
+import perf_parse
+from vma_map import VmaMap
+
+BASE = 0x7f0000000000
+PAGES = 64
+HEADER_SIZE = 104  # perf_file_header with its adds_features bitmap
+ATTR_SIZE = 128    # PERF_ATTR_SIZE_VER7
+EXCLUDE_KERNEL_HV = 1 << 5 | 1 << 6  # ':u' events
+SAMPLE_TYPE = 1 << 0 | 1 << 1 | 1 << 2 | 1 << 6 | 1 << 7  # ip, tid, time, id, cpu
+
+# (attr type, config, name perf script prints)
+EVENTS = [
+    (1, 2, 'page-faults:u'),
+    (3, 3 | 0 << 8 | 1 << 16, 'dTLB-load-misses:u'),
+    (0, 3, 'cache-misses:u'),
+    (0, 1, 'instructions:u'),
+]
+
+
+def write_recording(tmp_path, samples, sample_type, fixed_period=1):
+    """perf.data of samples (event, ip, period) and the perf script text of it
+
+    The text has one line per sample in the layout perf script prints with
+    -F comm,tid,cpu,time,period,event,ip,sym.
+    """
+    data = bytearray()
+    # A non-sample record the decoder has to skip
+    comm = struct.pack('<II16s', 1000, 1000, b'workload')
+    data += perf_data.EVENT_HEADER.pack(3, 0, perf_data.EVENT_HEADER.size + len(comm)) + comm
+    lines = []
+    for i, (event, ip, period) in enumerate(samples):
+        body = struct.pack('<QIIQQII', ip, 1000, 1000, i * 1000, event + 1, 0, 0)
+        if sample_type & perf_data.PERF_SAMPLE_PERIOD:
+            body += struct.pack('<Q', period)
+        else:
+            period = fixed_period
+        data += perf_data.EVENT_HEADER.pack(perf_data.PERF_RECORD_SAMPLE, 2,
+                                           perf_data.EVENT_HEADER.size + len(body)) + body
+        lines.append(f"        workload  1000 [000]     {i / 1e6:.6f}:"
+                     f"{period:>11} {EVENTS[event][2]}:      {ip:x} [unknown]\n")
+
+    ids_off = HEADER_SIZE
+    attrs_off = ids_off + 8 * len(EVENTS)
+    data_off = attrs_off + (ATTR_SIZE + 16) * len(EVENTS)
+    ids = b''.join(struct.pack('<Q', i + 1) for i in range(len(EVENTS)))
+    attrs = bytearray()
+    for i, (attr_type, config, _) in enumerate(EVENTS):
+        attr = perf_data.ATTR_PREFIX.pack(attr_type, ATTR_SIZE, config, fixed_period,
+                                          sample_type, 0, EXCLUDE_KERNEL_HV)
+        attrs += attr.ljust(ATTR_SIZE, b'\0') + struct.pack('<QQ', ids_off + 8 * i, 8)
+    header = perf_data.FILE_HEADER.pack(perf_data.MAGIC, HEADER_SIZE, ATTR_SIZE + 16,
+                                        attrs_off, len(attrs), data_off, len(data), 0, 0)
+
+    perf_path = tmp_path / 'perf.data'
+    perf_path.write_bytes(header.ljust(HEADER_SIZE, b'\0') + ids + attrs + data)
+    text_path = tmp_path / 'perf_output.txt'
+    text_path.write_text(''.join(lines))
+    return str(perf_path), str(text_path)
+
+
+def random_samples(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    events = rng.integers(len(EVENTS), size=n)
+    ips = BASE + rng.integers(PAGES * 4096, size=n).astype(np.uint64)
+    ips[::50] = 0xffffffff81000000  # Kernel addresses are counted but not paged
+    periods = rng.integers(1, 10000, size=n)
+    return list(zip(events.tolist(), ips.tolist(), periods.tolist()))
+
+
+@pytest.mark.parametrize('sample_type, fixed_period', [
+    (SAMPLE_TYPE | perf_data.PERF_SAMPLE_PERIOD, 1),  # perf record -F, period per sample
+    (SAMPLE_TYPE, 2500),                              # perf record -c 2500
+])
+def test_parse_samples_matches_perf_script(tmp_path, sample_type, fixed_period):
+    perf_path, text_path = write_recording(tmp_path, random_samples(), sample_type,
+                                           fixed_period)
+    vmas = VmaMap.window(BASE, PAGES)
+    df, summary = perf_data.parse_samples(perf_path, vmas)
+    expected_df, expected_summary = perf_parse.parse_samples(text_path, vmas, workers=1)
+    assert summary == expected_summary
+    assert df.equals(expected_df)
+
+
+def test_parse_events_matches_perf_script(tmp_path):
+    perf_path, text_path = write_recording(tmp_path, random_samples(seed=1),
+                                           SAMPLE_TYPE | perf_data.PERF_SAMPLE_PERIOD)
+    df, global_counts = perf_data.parse_events(perf_path)
+    expected_df, expected_counts = perf_parse.parse_events(text_path, workers=1)
+    assert global_counts == expected_counts
+    assert df.equals(expected_df)
+
+
+def test_fixed_period_without_period_field(tmp_path):
+    perf_path, _ = write_recording(tmp_path, random_samples(n=10), SAMPLE_TYPE, 2500)
+    events, samples = perf_data.read_samples(perf_path)
+    assert [event['period'] for event in events] == [2500] * len(EVENTS)
+    assert (samples['period'] == 2500).all()
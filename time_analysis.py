@@ -1,12 +1,16 @@
 from bcc import BPF
+import ctypes
 import pandas as pd
 import time
 import threading
 import subprocess
-import ctypes
-from collections import defaultdict
+from collections import deque
+
+from event_pipeline import EventPipeline
+from fault_store import TIME_FAULT_DTYPE
+from page_granularity import PAGE_SHIFT_HELPER, granularity_cflags
 
-bpf_program = """
+bpf_program = PAGE_SHIFT_HELPER + """
 #include <uapi/linux/ptrace.h>
 #include <linux/mm.h>
 
@@ -16,34 +20,52 @@ struct data_t {
     u64 fault_type;         // Read or write fault
     u32 pid;                // Process ID
     u32 memory_pressure;    // Current memory pressure indicator
+    u64 page_shift;         // Estimated shift of the page the fault maps (12, 21, ...)
 };
 
 BPF_PERF_OUTPUT(events);
 
+// Faults per time window, a per-CPU ring indexed by window % WINDOW_SLOTS.
+// A slot belongs to the window it was last counted for and restarts when
+// the ring comes round, so user space reads windows without clearing them.
+struct window_count_t {
+    u64 window;
+    u64 count;
+};
+BPF_PERCPU_ARRAY(fault_count_window, struct window_count_t, WINDOW_SLOTS);
+
 // Track system-wide memory stats
-BPF_HASH(fault_count_window, u64, u64);  // Faults per time window
 BPF_HASH(last_fault_time, u64, u64);     // Last fault time
 BPF_HASH(process_fault_count, u32, u64); // Faults per process
 BPF_HASH(total_faults, u64, u64);        // Total fault counter
 
-int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
-                            unsigned long address, unsigned int flags) {
+// handle_pte_fault() takes a single struct vm_fault * since 4.11
+int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_fault *vmf) {
+    struct vm_area_struct *vma = vmf->vma;
+    unsigned long address = vmf->address;
     u64 timestamp = bpf_ktime_get_ns();
     u32 pid = bpf_get_current_pid_tgid() >> 32;
     u64 pid64 = (u64)pid;  // Convert pid to u64
     
-    // Calculate current time window (1ms windows)
-    u64 window = timestamp / 1000000;
+    // Calculate current time window
+    u64 window = timestamp / WINDOW_NS;
     
     // Update fault count for current window
-    u64 *count = fault_count_window.lookup(&window);
+    u32 slot = window % WINDOW_SLOTS;
+    struct window_count_t *count = fault_count_window.lookup(&slot);
     if (count) {
-        (*count)++;
-    } else {
-        u64 initial = 1;
-        fault_count_window.update(&window, &initial);
+        if (count->window != window) {
+            count->window = window;
+            count->count = 0;
+        }
+        count->count++;
     }
     
+#ifdef WINDOW_ONLY
+    // The window counts are all user space reads in this mode
+    return 0;
+#endif
+    
     // Update process fault count
     u64 *proc_count = process_fault_count.lookup(&pid);
     if (proc_count) {
@@ -71,6 +93,7 @@ int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
     data.page_id = address / 4096;
     data.fault_type = (vma->vm_flags & 0x2) ? 1 : 0;
     data.pid = pid;
+    data.page_shift = fault_page_shift(vma, address);
     
     // Get current total faults as a simple memory pressure indicator
     total = total_faults.lookup(&zero);
@@ -84,93 +107,231 @@ int kprobe__handle_pte_fault(struct pt_regs *ctx, struct vm_area_struct *vma,
 
 WINDOW_SIZE_MS = 1  # 10ms windows
 HISTORY_WINDOWS = 5   # Look at last 5 windows for prediction
+FEATURE_PROCESS = True  # Compute features in a separate process instead of a thread
+
+# Build features from the kernel's per-window counts instead of streaming
+# every fault. Windows are read once closed, every DRAIN_INTERVAL seconds;
+# the in-kernel ring must cover more than that many windows.
+WINDOW_ONLY = False
+WINDOW_SLOTS = 4096
+DRAIN_INTERVAL = 0.1
 
 class WindowTracker:
-    def __init__(self):
-        self.windows = defaultdict(int)  # {window_id: fault_count}
+    """Fault counts of the current window and features over the ones before it
+
+    Only windows of the last HISTORY_WINDOWS that saw faults are kept, so
+    memory does not grow with the length of the trace, and each feature is
+    maintained incrementally: running sums for the total and the trend,
+    monotonic deques for the max and min. Features for a window cost O(1)
+    however large HISTORY_WINDOWS is.
+
+    Faults must arrive in timestamp order from a single thread, which the
+    event pipeline's merge stage guarantees, so there is no locking.
+    """
+
+    def __init__(self, history=HISTORY_WINDOWS, window_ms=WINDOW_SIZE_MS):
+        self.history = history
+        self.window_ns = window_ms * 1000000
         self.current_window = 0
+        self.current_count = 0
+        self.past = deque()           # (window_id, count) of history windows with faults
+        self.past_sum = 0
+        self.past_weighted = 0        # Sum of window_id * count over self.past
+        self.past_max = deque()       # Decreasing counts, front is the history max
+        self.past_min = deque()       # Increasing counts, front is the history min
+        self.late_faults = 0
         self.window_features = []
         self.labels = []
-        self.lock = threading.Lock()  # Add lock for synchronization
         self.processing_complete = False
-    
+
+    def _push(self, window_id, count):
+        self.past.append((window_id, count))
+        self.past_sum += count
+        self.past_weighted += window_id * count
+        while self.past_max and self.past_max[-1][1] <= count:
+            self.past_max.pop()
+        self.past_max.append((window_id, count))
+        while self.past_min and self.past_min[-1][1] >= count:
+            self.past_min.pop()
+        self.past_min.append((window_id, count))
+
+    def _evict(self, oldest):
+        """Drop history windows before oldest"""
+        while self.past and self.past[0][0] < oldest:
+            window_id, count = self.past.popleft()
+            self.past_sum -= count
+            self.past_weighted -= window_id * count
+            if self.past_max[0][0] == window_id:
+                self.past_max.popleft()
+            if self.past_min[0][0] == window_id:
+                self.past_min.popleft()
+
+    def _advance(self, window_id):
+        if self.current_count:
+            self._push(self.current_window, self.current_count)
+        self._evict(window_id - self.history)
+        self.current_window = window_id
+        self.current_count = 0
+
+    def _finish_window(self, next_window_faults):
+        features = self._create_features(self.current_window)
+        if features is not None:
+            self.window_features.append(features)
+            self.labels.append(1 if next_window_faults > 0 else 0)
+
     def update(self, timestamp_ns):
-        with self.lock:
-            window_id = timestamp_ns // (WINDOW_SIZE_MS * 1000000)
-            
-            if window_id > self.current_window:
-                # Create feature vector for previous window
-                if self.current_window > 0:
-                    features = self._create_features(self.current_window)
-                    if features is not None:
-                        next_window_faults = self.windows[self.current_window + 1]
-                        self.window_features.append(features)
-                        self.labels.append(1 if next_window_faults > 0 else 0)
-                
-                self.current_window = window_id
+        window_id = timestamp_ns // self.window_ns
+        
+        if window_id > self.current_window:
+            # Create feature vector for previous window, the fault that
+            # closes it is the first of the window it falls in
+            if self.current_window > 0:
+                self._finish_window(1 if window_id == self.current_window + 1 else 0)
+            self._advance(window_id)
     
     def add_fault(self, timestamp_ns):
-        with self.lock:
-            window_id = timestamp_ns // (WINDOW_SIZE_MS * 1000000)
-            self.windows[window_id] += 1
+        window_id = timestamp_ns // self.window_ns
+        if window_id > self.current_window:
+            self._advance(window_id)
+        elif window_id < self.current_window:
+            # Arrived after its window closed (later than the merge slack),
+            # counted in the current window rather than rewriting history
+            self.late_faults += 1
+        self.current_count += 1
+
+    def observe(self, timestamp_ns):
+        """Account one fault: close the windows it ends, then count it"""
+        self.update(timestamp_ns)
+        self.add_fault(timestamp_ns)
+
+    def observe_window(self, window_id, count):
+        """Account count faults of a whole window, windows in increasing order"""
+        self.update(window_id * self.window_ns)
+        if window_id == self.current_window:
+            self.current_count += count
+        else:
+            self.late_faults += count
     
     def _create_features(self, window_id):
-        if window_id <= HISTORY_WINDOWS:
+        if window_id <= self.history:
             return None
-            
+
+        # Windows without faults are not stored, they count as 0
+        count = self.current_count
+        oldest = self.past[0][1] if self.past and self.past[0][0] == window_id - self.history else 0
+        # trend weights window_id - i by i + 1 for i < history, i.e. window j by
+        # window_id - j + 1, over [window_id - history + 1, window_id]
+        span_sum = self.past_sum - oldest + count
+        span_weighted = (self.past_weighted - (window_id - self.history) * oldest
+                         + window_id * count)
         features = {
-            'faults_current': self.windows[window_id],
-            'total_faults_history': sum(self.windows[window_id - i] for i in range(1, HISTORY_WINDOWS + 1)),
-            'max_faults_history': max(self.windows[window_id - i] for i in range(1, HISTORY_WINDOWS + 1)),
-            'min_faults_history': min(self.windows[window_id - i] for i in range(1, HISTORY_WINDOWS + 1)),
-            'trend': sum((i + 1) * self.windows[window_id - i] for i in range(HISTORY_WINDOWS)) / HISTORY_WINDOWS,
+            'faults_current': count,
+            'total_faults_history': self.past_sum,
+            'max_faults_history': self.past_max[0][1] if self.past_max else 0,
+            'min_faults_history': self.past_min[0][1] if len(self.past) == self.history else 0,
+            'trend': ((window_id + 1) * span_sum - span_weighted) / self.history,
             'window_id': window_id
         }
         return features
     
     def complete_processing(self):
         """Mark processing as complete and handle the last window"""
-        with self.lock:
-            self.processing_complete = True
-            # Process the last window if needed
-            if self.current_window > 0:
-                features = self._create_features(self.current_window)
-                if features is not None:
-                    next_window_faults = self.windows[self.current_window + 1]
-                    self.window_features.append(features)
-                    self.labels.append(1 if next_window_faults > 0 else 0)
+        self.processing_complete = True
+        # Process the last window if needed
+        if self.current_window > 0:
+            self._finish_window(0)
     
     def get_dataset(self):
         """Get aligned features and labels"""
-        with self.lock:
-            if len(self.window_features) > len(self.labels):
-                self.window_features = self.window_features[:len(self.labels)]
-            elif len(self.labels) > len(self.window_features):
-                self.labels = self.labels[:len(self.window_features)]
-                
-            return self.window_features.copy(), self.labels.copy()  # Return copies to be thread-safe
+        if len(self.window_features) > len(self.labels):
+            self.window_features = self.window_features[:len(self.labels)]
+        elif len(self.labels) > len(self.window_features):
+            self.labels = self.labels[:len(self.window_features)]
+            
+        return self.window_features.copy(), self.labels.copy()
+
+
+class WindowCountReader:
+    """Reads closed windows out of the fault_count_window per-CPU ring
+
+    Slots are summed over CPUs at read time, counting only CPUs whose slot
+    still belongs to the window being read.
+    """
+
+    def __init__(self, table, slots=WINDOW_SLOTS, window_ns=WINDOW_SIZE_MS * 1000000):
+        self.table = table
+        self.slots = slots
+        self.window_ns = window_ns
+        self.cursor = time.monotonic_ns() // window_ns  # Same clock as bpf_ktime_get_ns
+        self.overrun = 0
+
+    def drain(self, final=False):
+        """(window_id, count) of every window with faults closed since the last drain"""
+        now = time.monotonic_ns() // self.window_ns
+        # Faults are counted just after they are stamped, so leave the
+        # previous window one drain to settle unless this is the last one
+        end = now + 1 if final else now - 1
+        if end - self.cursor > self.slots:
+            self.overrun += end - self.slots - self.cursor
+            self.cursor = end - self.slots
+        counts = []
+        for window_id in range(self.cursor, end):
+            per_cpu = self.table[ctypes.c_int(window_id % self.slots)]
+            count = sum(value.count for value in per_cpu if value.window == window_id)
+            if count:
+                counts.append((window_id, count))
+        self.cursor = max(self.cursor, end)
+        return counts
+
+
+class WindowStage:
+    """Feature stage of the event pipeline, it owns the WindowTracker"""
+
+    def __init__(self):
+        self.tracker = WindowTracker()
+
+    def consume(self, batch):
+        for timestamp in batch['timestamp'].tolist():
+            self.tracker.observe(timestamp)
+
+    def result(self):
+        self.tracker.complete_processing()
+        features, labels = self.tracker.get_dataset()
+        return features, labels, self.tracker.late_faults
 
 # Initialize BPF
-b = BPF(text=bpf_program)
+cflags = granularity_cflags() + [f'-DWINDOW_NS={WINDOW_SIZE_MS * 1000000}ULL',
+                                 f'-DWINDOW_SLOTS={WINDOW_SLOTS}']
+if WINDOW_ONLY:
+    cflags.append('-DWINDOW_ONLY')
+b = BPF(text=bpf_program, cflags=cflags)
 
-# Initialize window tracker
-tracker = WindowTracker()
+stop_polling = threading.Event()
 
-def handle_event(cpu, data, size):
-    event = b["events"].event(data)
-    if not tracker.processing_complete:
-        tracker.update(event.timestamp)
-        tracker.add_fault(event.timestamp)
+if WINDOW_ONLY:
+    # No per-fault events, the tracker reads the kernel's window counts
+    tracker = WindowTracker()
+    reader = WindowCountReader(b["fault_count_window"])
 
-b["events"].open_perf_buffer(handle_event)
+    def poll_events():
+        while not stop_polling.wait(DRAIN_INTERVAL):
+            for window_id, count in reader.drain():
+                tracker.observe_window(window_id, count)
+        for window_id, count in reader.drain(final=True):
+            tracker.observe_window(window_id, count)
+else:
+    # The perf callback only queues raw records per CPU; a merge thread puts
+    # them in timestamp order and the feature stage feeds the WindowTracker
+    pipeline = EventPipeline(TIME_FAULT_DTYPE, WindowStage, process=FEATURE_PROCESS)
+    b["events"].open_perf_buffer(pipeline.callback)
+    pipeline.start()
 
-def poll_events():
-    while True:
-        try:
-            b.perf_buffer_poll()
-        except KeyboardInterrupt:
-            tracker.complete_processing()
-            exit()
+    def poll_events():
+        while not stop_polling.is_set():
+            try:
+                b.perf_buffer_poll(timeout=100)
+            except KeyboardInterrupt:
+                exit()
 
 # Start polling thread
 thread = threading.Thread(target=poll_events)
@@ -185,12 +346,22 @@ subprocess.run(["python3", "workload10.py"])
 
 # Make sure all processing is complete
 time.sleep(1)
-tracker.complete_processing()
+stop_polling.set()
+thread.join()
 
 print("\nCollecting dataset...")
-features, labels = tracker.get_dataset()
+if WINDOW_ONLY:
+    tracker.complete_processing()
+    features, labels = tracker.get_dataset()
+    late_faults = tracker.late_faults
+    if reader.overrun:
+        print(f"Windows overwritten before they were read: {reader.overrun}")
+else:
+    features, labels, late_faults = pipeline.stop()
 
 print(f"Features collected: {len(features)}")
+if late_faults:
+    print(f"Faults delivered after their window closed: {late_faults}")
 print(f"Labels collected: {len(labels)}")
 
 if len(features) != len(labels):
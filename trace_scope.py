@@ -0,0 +1,98 @@
+import ctypes
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+MAX_TRACED_PIDS = 4096  # Capacity of the traced_pids hash
+
+SCOPE_MODES = ('pids', 'tree', 'cgroup')
+
+# Included by BPF programs that filter on a TraceScope. in_scope() is the
+# only check the fault probe makes, so processes outside the scope cost one
+# hash lookup (or one helper call for cgroups). In tree mode the fork
+# tracepoint adds children of traced processes and the exit tracepoint
+# removes tasks again, so the set follows the whole process tree.
+SCOPE_FILTER = """
+#ifdef SCOPE_CGROUP
+BPF_ARRAY(target_cgroup, u64, 1);
+#else
+BPF_HASH(traced_pids, u32, u8, MAX_TRACED_PIDS);
+#endif
+
+static inline int in_scope(u32 pid) {
+#ifdef SCOPE_CGROUP
+    int zero = 0;
+    u64 *cgroup = target_cgroup.lookup(&zero);
+    return cgroup && *cgroup && bpf_get_current_cgroup_id() == *cgroup;
+#else
+    return traced_pids.lookup(&pid) != NULL;
+#endif
+}
+
+#ifdef SCOPE_TREE
+TRACEPOINT_PROBE(sched, sched_process_fork) {
+    u32 parent = bpf_get_current_pid_tgid() >> 32;
+    if (traced_pids.lookup(&parent)) {
+        u32 child = args->child_pid;
+        u8 one = 1;
+        traced_pids.update(&child, &one);
+    }
+    return 0;
+}
+
+TRACEPOINT_PROBE(sched, sched_process_exit) {
+    u32 pid = args->pid;
+    traced_pids.delete(&pid);
+    return 0;
+}
+#endif
+"""
+
+
+def cgroup_id(cgroup):
+    """Kernel id of a cgroup v2 group, given as an id or a path (relative to CGROUP_ROOT)"""
+    if isinstance(cgroup, int):
+        return cgroup
+    path = cgroup if os.path.isabs(cgroup) else os.path.join(CGROUP_ROOT, cgroup)
+    return os.stat(path).st_ino
+
+
+class TraceScope:
+    """Processes a probe traces: a PID set, process trees or one cgroup
+
+    'pids' traces exactly the PIDs added, 'tree' also every process they
+    fork from then on, 'cgroup' everything running in the cgroup.
+    """
+
+    def __init__(self, mode='tree', pids=(), cgroup=None, max_pids=MAX_TRACED_PIDS):
+        if mode not in SCOPE_MODES:
+            raise ValueError(f"Unknown scope mode {mode!r}, expected one of {SCOPE_MODES}")
+        if mode == 'cgroup' and cgroup is None:
+            raise ValueError("Scope mode 'cgroup' needs a cgroup")
+        self.mode = mode
+        self.pids = list(pids)
+        self.cgroup = cgroup
+        self.max_pids = max_pids
+
+    def cflags(self):
+        if self.mode == 'cgroup':
+            return ['-DSCOPE_CGROUP']
+        cflags = [f'-DMAX_TRACED_PIDS={self.max_pids}']
+        if self.mode == 'tree':
+            cflags.append('-DSCOPE_TREE')
+        return cflags
+
+    def attach(self, b):
+        """Write the scope into the loaded program's maps"""
+        if self.mode == 'cgroup':
+            b["target_cgroup"][ctypes.c_int(0)] = ctypes.c_uint64(cgroup_id(self.cgroup))
+            return
+        for pid in self.pids:
+            self.add_pid(b, pid)
+
+    def add_pid(self, b, pid):
+        """Start tracing pid (and in tree mode its future children)"""
+        if self.mode == 'cgroup':
+            raise ValueError("A cgroup scope has no PID set")
+        if pid not in self.pids:
+            self.pids.append(pid)
+        b["traced_pids"][ctypes.c_uint(pid)] = ctypes.c_uint8(1)
@@ -0,0 +1,141 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# start-end perms offset dev inode [path]
+MAPS_LINE = re.compile(r'^([0-9a-f]+)-([0-9a-f]+)\s+(\S+)\s+([0-9a-f]+)\s+\S+\s+\d+\s*(.*)$')
+
+
+class VmaMap:
+    """Sorted, non-overlapping VMAs of a process for vectorized address lookups
+
+    Every page of every VMA gets a dense page id: the VMA's first page id
+    plus the page's offset within it. Lookups binary-search the sorted VMA
+    starts, so millions of addresses resolve in one searchsorted call.
+    """
+
+    def __init__(self, starts, ends, perms=None, paths=None, page_size=4096):
+        order = np.argsort(np.asarray(starts, dtype=np.uint64), kind='stable')
+        self.starts = np.asarray(starts, dtype=np.uint64)[order]
+        self.ends = np.asarray(ends, dtype=np.uint64)[order]
+        if np.any(self.starts[1:] < self.ends[:-1]):
+            raise ValueError("VMAs overlap, build the map with VmaMap.merge")
+        n = len(self.starts)
+        self.perms = np.asarray(perms if perms is not None else [''] * n, dtype=object)[order]
+        self.paths = np.asarray(paths if paths is not None else [''] * n, dtype=object)[order]
+        self.page_size = page_size
+
+        pages = -(-(self.ends - self.starts).astype(np.int64) // page_size)
+        self.first_page = np.cumsum(pages) - pages
+        self.num_pages = int(pages.sum())
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def window(cls, base_addr, num_pages, page_size=4096):
+        """One VMA covering [base_addr, base_addr + num_pages pages), parser.py's old window"""
+        return cls([base_addr], [base_addr + num_pages * page_size], page_size=page_size)
+
+    @classmethod
+    def from_proc_maps(cls, source, page_size=4096):
+        """Parse a /proc/<pid>/maps snapshot, source is a pid or a path to a saved copy"""
+        path = f"/proc/{source}/maps" if isinstance(source, int) else source
+        starts, ends, perms, paths = [], [], [], []
+        with open(path, 'r') as f:
+            for line in f:
+                match = MAPS_LINE.match(line.strip())
+                if match:
+                    starts.append(int(match.group(1), 16))
+                    ends.append(int(match.group(2), 16))
+                    perms.append(match.group(3))
+                    paths.append(match.group(5))
+        return cls(starts, ends, perms, paths, page_size)
+
+    @classmethod
+    def from_capture(cls, df, page_size=4096):
+        """VMAs from the vma_start/vma_end fields a BPF collector reported
+
+        Captures span the whole run, so VMAs that were resized or remapped
+        overlap. The most recently reported one wins.
+        """
+        bounds = df[['vma_start', 'vma_end']].to_numpy(dtype=np.uint64)
+        bounds = bounds[bounds[:, 1] > bounds[:, 0]]
+        # Last report of each distinct VMA, in reporting order
+        _, last = np.unique(bounds[::-1], axis=0, return_index=True)
+        bounds = bounds[::-1][np.sort(last)][::-1]
+        return cls.merge([cls([start], [end], page_size=page_size) for start, end in bounds],
+                         page_size)
+
+    @classmethod
+    def merge(cls, maps, page_size=None):
+        """Union of several maps, e.g. successive maps snapshots
+
+        Where VMAs overlap, the one from the later map wins and the earlier
+        one is cut around it.
+        """
+        maps = list(maps)
+        page_size = page_size or maps[0].page_size
+        starts = np.concatenate([m.starts for m in maps])
+        ends = np.concatenate([m.ends for m in maps])
+        perms = np.concatenate([m.perms for m in maps])
+        paths = np.concatenate([m.paths for m in maps])
+        if len(starts) == 0:
+            return cls([], [], page_size=page_size)
+
+        # Paint every elementary segment with the last VMA covering it
+        bounds = np.unique(np.concatenate([starts, ends]))
+        owner = np.full(len(bounds) - 1, -1, dtype=np.int64)
+        first = np.searchsorted(bounds, starts)
+        last = np.searchsorted(bounds, ends)
+        for i in range(len(starts)):
+            owner[first[i]:last[i]] = i
+
+        # Join neighbouring segments of the same VMA
+        keep = owner >= 0
+        seg_start, seg_end, seg_owner = bounds[:-1][keep], bounds[1:][keep], owner[keep]
+        new = np.ones(len(seg_owner), dtype=bool)
+        new[1:] = (seg_owner[1:] != seg_owner[:-1]) | (seg_start[1:] != seg_end[:-1])
+        group = np.cumsum(new) - 1
+        group_end = np.zeros(int(new.sum()), dtype=np.uint64)
+        group_end[group] = seg_end
+        return cls(seg_start[new], group_end, perms[seg_owner[new]], paths[seg_owner[new]], page_size)
+
+    def lookup(self, addrs):
+        """Index of the VMA holding each address, -1 where none does"""
+        addrs = np.asarray(addrs, dtype=np.uint64)
+        idx = np.searchsorted(self.starts, addrs, side='right') - 1
+        found = idx >= 0
+        found[found] = addrs[found] < self.ends[idx[found]]
+        return np.where(found, idx, -1)
+
+    def resolve(self, addrs):
+        """(vma index, page offset within the VMA) of each address, (-1, -1) if unmapped"""
+        addrs = np.asarray(addrs, dtype=np.uint64)
+        vma = self.lookup(addrs)
+        mapped = vma >= 0
+        offsets = np.full(len(addrs), -1, dtype=np.int64)
+        offsets[mapped] = ((addrs[mapped] - self.starts[vma[mapped]])
+                           // np.uint64(self.page_size)).astype(np.int64)
+        return vma, offsets
+
+    def page_ids(self, addrs):
+        """Dense page id of each address, -1 if unmapped"""
+        vma, offsets = self.resolve(addrs)
+        ids = np.full(len(vma), -1, dtype=np.int64)
+        mapped = vma >= 0
+        ids[mapped] = self.first_page[vma[mapped]] + offsets[mapped]
+        return ids
+
+    def describe(self, page_ids):
+        """VMA and page offset behind each dense page id, one row per id"""
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        vma = np.searchsorted(self.first_page, page_ids, side='right') - 1
+        return pd.DataFrame({
+            'vma_start': self.starts[vma],
+            'vma_end': self.ends[vma],
+            'vma_perms': self.perms[vma],
+            'vma_path': self.paths[vma],
+            'page_offset': page_ids - self.first_page[vma],
+        })
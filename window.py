@@ -5,9 +5,16 @@ import threading
 from collections import defaultdict
 import pandas as pd
 
+from captures import load_capture
+from fault_store import ColumnarBuffer, WINDOW_EVENT_DTYPE
+from spill_writer import SpillWriter
+from window_levels import RESOLUTIONS, multi_resolution_frames
+
 # Configuration
-WINDOW_SIZE = '250ms'  # Adjust this value as needed ('100ms', '250ms', '500ms', etc.)
+WINDOW_SIZE = '250ms'  # Window of page_fault_dataset.csv ('100ms', '250ms', '500ms', etc.)
+WINDOW_SIZES = RESOLUTIONS  # Every size also gets page_fault_dataset_<size>.csv
 PREDICTION_HORIZON = 1  # Number of windows to look ahead for labeling
+SPILL_DIR = None  # Directory to stream raw events to as Parquet parts during the run
 
 # BPF program
 bpf_text = """
@@ -46,27 +53,30 @@ TRACEPOINT_PROBE(mm, mm_page_fault) {
 b = BPF(text=bpf_text)
 
 # Data storage
-data_records = []
+spill = SpillWriter(SPILL_DIR, WINDOW_EVENT_DTYPE) if SPILL_DIR else None
+data_records = ColumnarBuffer(WINDOW_EVENT_DTYPE, spill=spill)
 
 # Event handler
 def handle_event(cpu, data, size):
     event = b["page_faults"].event(data)
     timestamp = event.ts / 1e9  # Convert ns to seconds
-    data_records.append({
-        'timestamp': timestamp,
-        'pid': event.pid,
-        'minor_faults': event.minor_faults,
-        'major_faults': event.major_faults
-    })
+    data_records.append(
+        timestamp,
+        event.pid,
+        event.minor_faults,
+        event.major_faults
+    )
 
 # Register event handler
 b["page_faults"].open_perf_buffer(handle_event)
 
+stop_polling = threading.Event()
+
 # Function to poll BPF events
 def run_bpf():
-    while True:
+    while not stop_polling.is_set():
         try:
-            b.perf_buffer_poll()
+            b.perf_buffer_poll(timeout=100)
         except KeyboardInterrupt:
             exit()
 
@@ -81,33 +91,29 @@ subprocess.run(["python3", "workload10.py"])
 time.sleep(2)
 
 # Stop the BPF thread
-bpf_thread.join(timeout=1)
+stop_polling.set()
+bpf_thread.join()
 
-# Convert to DataFrame
-df = pd.DataFrame(data_records)
+# Convert to DataFrame, reading the spilled parts back if the run streamed them
+if spill is not None:
+    data_records.finish()
+    df = load_capture(SPILL_DIR, columns=['timestamp', 'minor_faults', 'major_faults'])
+else:
+    df = data_records.to_frame()
 
 # Check if DataFrame is not empty
 if df.empty:
     print("No data collected.")
     exit()
 
-# Set timestamp as index
-df.set_index('timestamp', inplace=True)
-
-# Resample into configurable windows
-windowed = df.resample(WINDOW_SIZE).sum().fillna(0)
-
-# Create labels based on prediction horizon
-windowed['label'] = (windowed['minor_faults'].shift(-PREDICTION_HORIZON) +
-                     windowed['major_faults'].shift(-PREDICTION_HORIZON)).apply(lambda x: 1 if x > 0 else 0)
-
-# Drop the last 'prediction_horizon' rows with NaN labels
-windowed = windowed.iloc[:-PREDICTION_HORIZON]
-
-# Feature engineering (example)
-windowed['minor_faults_avg'] = windowed['minor_faults'].rolling(window=5).mean().fillna(0)
-windowed['major_faults_avg'] = windowed['major_faults'].rolling(window=5).mean().fillna(0)
-
-# Save dataset
-windowed.to_csv('page_fault_dataset.csv', index=True)
-print("Dataset saved to 'page_fault_dataset.csv'")
+# Sum into windows of every size at once, then label and average each
+levels = multi_resolution_frames(df, ['minor_faults', 'major_faults'],
+                                 sorted(set(WINDOW_SIZES) | {WINDOW_SIZE}, key=pd.Timedelta),
+                                 horizon=PREDICTION_HORIZON)
+
+# Save datasets
+for size, windowed in levels.items():
+    windowed.to_csv(f'page_fault_dataset_{size}.csv', index=True)
+levels[WINDOW_SIZE].to_csv('page_fault_dataset.csv', index=True)
+print(f"Dataset saved to 'page_fault_dataset.csv', per window size to "
+      f"'page_fault_dataset_<size>.csv' for {', '.join(levels)}")
@@ -0,0 +1,204 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from captures import add_fault_features, open_dataset
+
+# Per-fault columns concatenated for every fault in a window, in the order
+# the notebook's create_ml_dataset used
+WINDOW_COLUMNS = [
+    'timestamp_ns',
+    'page_id',
+    'is_write',
+    'distance',
+    'vm_flags',
+    'vma_start',
+    'time_since_last_fault',
+    'vma_size',
+    'relative_position',
+    'sequential_access',
+]
+
+# Absolute columns are stored relative to the first fault; a shift does not
+# change what the models can learn. The matrix is float64 by default: in
+# float32 a rebased timestamp_ns is only good to ~600 ns over 10 s of trace
+# and pages of heap, mmap and stack, ~1e10 pages apart, lose whole pages.
+REBASE_COLUMNS = ['timestamp_ns', 'page_id', 'vma_start']
+
+CHUNK_ROWS = 1 << 16
+
+
+class WindowDataset:
+    """Sliding-window samples over one capture, backed by a single feature matrix
+
+    Sample k is faults k..k+window_size-1 flattened row by row, its target is
+    the timestamp of fault k+window_size. X is a strided view, no sample is
+    materialized until it is sliced out.
+
+    With pids (the process of each row, rows grouped by process) only
+    windows whose faults and target all belong to one process are samples.
+    Those are not evenly strided, so X is then a gathered copy; take() and
+    chunks() copy only the samples asked for.
+    """
+
+    def __init__(self, base, timestamps, window_size=3, pids=None):
+        self.base = base
+        self.timestamps = timestamps
+        self.window_size = window_size
+        self.pids = pids
+        self.starts = None
+        if pids is not None:
+            pids = np.asarray(pids)
+            self.starts = np.flatnonzero(pids[:-window_size] == pids[window_size:]) \
+                if len(pids) > window_size else np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, df, window_size=3, columns=WINDOW_COLUMNS, dtype=np.float64,
+                   rebase=True, out=None, by_pid=None):
+        """Build from a capture DataFrame, optionally into a memory-mapped .npy at out
+
+        by_pid keeps windows inside one process, by default whenever the
+        capture holds faults of several processes.
+        """
+        if by_pid is None:
+            by_pid = 'pid' in df.columns and df['pid'].nunique() > 1
+        pids = None
+        if by_pid:
+            df = df.iloc[np.argsort(df['pid'].to_numpy(), kind='stable')]
+            pids = df['pid'].to_numpy()
+        base = _allocate(len(df), len(columns), dtype, out)
+        origin = _origin(df, columns) if rebase and len(df) else None
+        for start in range(0, len(df), CHUNK_ROWS):
+            part = df.iloc[start:start + CHUNK_ROWS]
+            base[start:start + len(part)] = _block(part, columns, origin)
+        timestamps = df['timestamp_ns'].to_numpy().astype(np.int64)
+        return cls(base, timestamps, window_size, pids)
+
+    @classmethod
+    def from_dataset(cls, path, window_size=3, columns=WINDOW_COLUMNS, dtype=np.float64,
+                     rebase=True, out=None, by_pid=None):
+        """Build from a spilled capture directory one record batch at a time
+
+        by_pid works as in from_frame: a first pass reads only the pid
+        column to find where each row goes once grouped by process, and
+        the batches are then written straight to those rows.
+        """
+        dataset = open_dataset(path)
+        n = dataset.count_rows()
+        base = _allocate(n, len(columns), dtype, out)
+        timestamps = np.empty(n, dtype=np.int64)
+
+        pids = dest = None
+        if 'pid' in dataset.schema.names and (by_pid or by_pid is None):
+            all_pids = dataset.to_table(columns=['pid']).column('pid').to_numpy()
+            if by_pid or len(np.unique(all_pids)) > 1:
+                order = np.argsort(all_pids, kind='stable')
+                dest = np.empty(n, dtype=np.int64)
+                dest[order] = np.arange(n)
+                pids = all_pids[order]
+
+        origin = None
+        prev_ts = {}  # pid -> timestamp of its last fault in earlier batches
+        start = 0
+        for batch in dataset.to_batches():
+            part = batch.to_pandas()
+            if len(part) == 0:
+                continue
+            keys = part['pid'].to_numpy().astype(np.int64) if 'pid' in part.columns \
+                else np.zeros(len(part), dtype=np.int64)
+            part_ts = part['timestamp_ns'].to_numpy().astype(np.int64)
+            if 'time_since_last_fault' not in part.columns:
+                part = add_fault_features(part)
+                # diff() restarts in every batch, carry each process's gap
+                # across the boundary
+                gap_column = part.columns.get_loc('time_since_last_fault')
+                _, firsts = np.unique(keys, return_index=True)
+                for row in firsts.tolist():
+                    last = prev_ts.get(int(keys[row]))
+                    if last is not None:
+                        part.iloc[row, gap_column] = \
+                            (int(part_ts[row]) - last) / part['sample_weight'].iloc[row]
+            uniques, lasts = np.unique(keys[::-1], return_index=True)
+            prev_ts.update(zip(uniques.tolist(), part_ts[len(part) - 1 - lasts].tolist()))
+            if rebase and origin is None:
+                origin = _origin(part, columns)
+            rows = dest[start:start + len(part)] if dest is not None \
+                else slice(start, start + len(part))
+            base[rows] = _block(part, columns, origin)
+            timestamps[rows] = part_ts
+            start += len(part)
+        return cls(base, timestamps, window_size, pids)
+
+    def __len__(self):
+        if self.starts is not None:
+            return len(self.starts)
+        return max(len(self.base) - self.window_size, 0)
+
+    def _windows(self):
+        n_columns = self.base.shape[1]
+        itemsize = self.base.itemsize
+        return as_strided(self.base, shape=(max(len(self.base) - self.window_size, 0),
+                                            self.window_size * n_columns),
+                          strides=(n_columns * itemsize, itemsize), writeable=False)
+
+    @property
+    def X(self):
+        """(n_samples, window_size * n_columns) samples
+
+        A read-only view over the base matrix, except with pids, where it
+        is a copy of every sample; use take() or chunks() there.
+        """
+        if self.starts is not None:
+            return self._windows()[self.starts]
+        return self._windows()
+
+    def take(self, indices):
+        """Samples at indices, copying only those rows"""
+        indices = np.asarray(indices)
+        return self._windows()[self.starts[indices] if self.starts is not None else indices]
+
+    @property
+    def y(self):
+        """Timestamp of the fault following each window, as float64 ns"""
+        y = self.timestamps[self.window_size:].astype(np.float64)
+        return y[self.starts] if self.starts is not None else y
+
+    def chunks(self, chunk_rows=CHUNK_ROWS):
+        """Yield contiguous (X, y) blocks of at most chunk_rows samples"""
+        windows = self._windows()
+        for start in range(0, len(self), chunk_rows):
+            stop = min(start + chunk_rows, len(self))
+            rows = self.starts[start:stop] if self.starts is not None else slice(start, stop)
+            targets = (self.starts[start:stop] if self.starts is not None
+                       else np.arange(start, stop)) + self.window_size
+            yield (np.ascontiguousarray(windows[rows]),
+                   self.timestamps[targets].astype(np.float64))
+
+
+def _allocate(n_rows, n_columns, dtype, out):
+    if out is None:
+        return np.empty((n_rows, n_columns), dtype=dtype)
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n_rows, n_columns))
+
+
+def _origin(df, columns):
+    origin = np.zeros(len(columns))
+    for j, column in enumerate(columns):
+        if column in REBASE_COLUMNS:
+            origin[j] = float(df[column].iloc[0])
+    return origin
+
+
+def _block(part, columns, origin):
+    block = part[columns].to_numpy(dtype=np.float64)
+    np.nan_to_num(block, copy=False)  # Same as the notebook's fillna(0)
+    if origin is not None:
+        block -= origin
+    return block
+
+
+def create_ml_dataset(data, window_size=3, dtype=np.float64, rebase=True):
+    """Drop-in for the notebook's create_ml_dataset, returns (X view, y array)"""
+    dataset = WindowDataset.from_frame(data, window_size, dtype=dtype, rebase=rebase)
+    return dataset.X, dataset.y
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# Window sizes built from one capture, finest first
+RESOLUTIONS = ['1ms', '10ms', '100ms', '250ms', '1s']
+ROLLING_WINDOW = 5  # Windows averaged into the *_avg features
+
+
+def resolution_ns(resolution):
+    return int(pd.Timedelta(resolution).value)
+
+
+def to_ns(timestamps):
+    """Integer ns of float-second timestamps, as window.py records them"""
+    return np.rint(np.asarray(timestamps, dtype=np.float64) * 1e9).astype(np.int64)
+
+
+def roll_up(counts, factor):
+    """Sums of each run of factor consecutive windows, counts is windows x columns"""
+    pad = -len(counts) % factor
+    if pad:
+        counts = np.concatenate([counts, np.zeros((pad, counts.shape[1]), dtype=counts.dtype)])
+    return counts.reshape(-1, factor, counts.shape[1]).sum(axis=1)
+
+
+def multi_resolution_counts(timestamps_ns, values, resolutions=RESOLUTIONS):
+    """Per-window sums of values at every resolution, from one bucketing pass
+
+    values is events x columns. Only the finest resolution is bucketed with
+    np.bincount, every other one is rolled up from the coarsest level
+    already built whose window divides its own. Every level's first window
+    starts at the first event, as DataFrame.resample() does on a
+    TimedeltaIndex.
+
+    Returns the origin in ns and resolution -> counts.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    values = np.asarray(values).reshape(len(timestamps_ns), -1)
+    widths = sorted((resolution_ns(r), r) for r in resolutions)
+    origin = int(timestamps_ns.min())
+    offsets = timestamps_ns - origin
+
+    built = []  # (width, counts), finest first
+    levels = {}
+    for width, resolution in widths:
+        source = next(((w, c) for w, c in reversed(built) if width % w == 0), None)
+        if source is None:
+            index = offsets // width
+            counts = np.stack([np.bincount(index, weights=values[:, i])
+                               for i in range(values.shape[1])], axis=1)
+            counts = np.rint(counts).astype(np.int64)
+        else:
+            counts = roll_up(source[1], width // source[0])
+        built.append((width, counts))
+        levels[resolution] = counts
+    return origin, levels
+
+
+def window_frame(origin, resolution, counts, columns, horizon=1,
+                 rolling=ROLLING_WINDOW):
+    """Windows of one level with their label and rolling averages
+
+    label is whether the window horizon ahead has any events, the last
+    horizon windows have none to look at and are dropped. The averages are
+    over the last rolling windows, 0 until there are that many.
+    """
+    width = resolution_ns(resolution)
+    starts = origin + np.arange(len(counts), dtype=np.int64) * width
+    frame = pd.DataFrame(counts, columns=columns,
+                         index=pd.TimedeltaIndex(pd.to_timedelta(starts, unit='ns'),
+                                                 name='timestamp'))
+    total = counts.sum(axis=1)
+    ahead = np.zeros(len(counts), dtype=np.int64)
+    if len(counts) > horizon:
+        ahead[:len(counts) - horizon] = total[horizon:] > 0
+    frame['label'] = ahead
+    frame = frame.iloc[:max(len(counts) - horizon, 0)]
+
+    kept = counts[:len(frame)]
+    cumulative = np.concatenate([np.zeros((1, kept.shape[1])), np.cumsum(kept, axis=0)])
+    averages = np.zeros(kept.shape)
+    averages[rolling - 1:] = (cumulative[rolling:] - cumulative[:-rolling]) / rolling
+    for i, column in enumerate(columns):
+        frame[f'{column}_avg'] = averages[:, i]
+    return frame
+
+
+def multi_resolution_frames(df, columns, resolutions=RESOLUTIONS, horizon=1,
+                            rolling=ROLLING_WINDOW, time_column='timestamp'):
+    """resolution -> labelled window frame of df's columns summed per window
+
+    time_column is float seconds.
+    """
+    origin, levels = multi_resolution_counts(to_ns(df[time_column]),
+                                             df[columns].to_numpy(), resolutions)
+    return {resolution: window_frame(origin, resolution, counts, columns, horizon, rolling)
+            for resolution, counts in levels.items()}